@@ -0,0 +1,173 @@
+"""Synthetic SSX data trees and a stand-in DIALS installation for the benchmarks."""
+import json
+import os
+import stat
+
+from standin import PROGRAMS
+
+STANDIN = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'standin.py')
+
+BEAMLINE_JSON = {
+    'beamline_input': {'energy': '12.663', 'det_distance': '200'},
+    'user_input': {'unit_cell': '79.45,79.45,38.45,90,90,90', 'space_group': 'p43212'},
+}
+
+
+def make_bin(root):
+    """Install the stand-in executables and a DIALS setup script that puts them on PATH.
+
+    Returns:
+        str: The dials_path to hand to the tools (holding the 'dials' setup script)
+    """
+    bin_dir = os.path.join(root, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    os.chmod(STANDIN, os.stat(STANDIN).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    for program in PROGRAMS:
+        link = os.path.join(bin_dir, program)
+        if not os.path.lexists(link):
+            os.symlink(STANDIN, link)
+    with open(os.path.join(root, 'dials'), 'w') as fp:
+        fp.write(f'export PATH="{bin_dir}:$PATH"\n')
+    os.environ['PATH'] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+    return root
+
+
+def make_data_dir(data_dir, run_num=1, n_masters=8, data_files=1, data_bytes=4096):
+    """Lay out a data directory as the master-file tools expect it.
+
+    Writes beamline_run<run_num>.json, xy.json, run.phil and raster/ holding
+    n_masters <name>_master.h5 files with data_files <name>_data_*.h5 each.
+    Data file sizes vary across the raster so size-based image selection has
+    something to choose between.
+    """
+    raster = os.path.join(data_dir, 'raster')
+    os.makedirs(raster, exist_ok=True)
+    with open(os.path.join(data_dir, f"beamline_run{run_num}.json"), 'w') as fp:
+        json.dump(BEAMLINE_JSON, fp)
+    with open(os.path.join(data_dir, 'xy.json'), 'w') as fp:
+        json.dump({'beamx': -214.4, 'beamy': 218.2}, fp)
+    with open(os.path.join(data_dir, 'run.phil'), 'w') as fp:
+        fp.write("nproc = 4\n")
+    for i in range(n_masters):
+        name = f"r{i:05d}"
+        open(os.path.join(raster, f"{name}_master.h5"), 'wb').close()
+        size = data_bytes * (1 + (i * 7919) % 5)
+        for j in range(1, data_files + 1):
+            with open(os.path.join(raster, f"{name}_data_{j:06d}.h5"), 'wb') as fp:
+                fp.truncate(size)
+    return data_dir
+
+
+def make_refined_tree(refined_dir, n_runs):
+    """Create refined/<run>/batch_1/ directories as run_refined_proc leaves them."""
+    for i in range(n_runs):
+        os.makedirs(os.path.join(refined_dir, f"r{i:05d}", 'batch_1'), exist_ok=True)
+    return refined_dir
+
+
+def make_cbfs(data_dir, chip_name, run_num, n_images):
+    """Create empty <chip>_<run>_<n>.cbf images numbered from 1."""
+    os.makedirs(data_dir, exist_ok=True)
+    for n in range(1, n_images + 1):
+        open(os.path.join(data_dir, f"{chip_name}_{run_num}_{str(n).zfill(5)}.cbf"), 'wb').close()
+    return data_dir
+
+
+def make_ints(proc_dir, n_ints, start=0):
+    """Create int-0-<n>.pickle files numbered from start."""
+    os.makedirs(proc_dir, exist_ok=True)
+    for n in range(start, start + n_ints):
+        open(os.path.join(proc_dir, f"int-0-{n:06d}.pickle"), 'wb').close()
+    return proc_dir
+
+
+def make_master_h5(path, n_images, detector_distance=0.2, beam_center=(2070.0, 2180.0),
+                   pixel_size=75e-6, wavelength=0.979, bytes_per_image=1024):
+    """Write an Eiger-style <name>_master.h5 holding only the metadata, plus one data file.
+
+    The detector geometry goes where the NeXus master files keep it (distance and pixel
+    sizes in m, beam centre in pixels) and the data file is bytes_per_image per image,
+    so size-based estimates scale with the image count too.
+    """
+    import h5py
+    with h5py.File(path, 'w') as h5:
+        detector = h5.create_group('/entry/instrument/detector')
+        detector['detector_distance'] = detector_distance
+        detector['beam_center_x'], detector['beam_center_y'] = beam_center
+        detector['x_pixel_size'] = detector['y_pixel_size'] = pixel_size
+        specific = detector.create_group('detectorSpecific')
+        specific['nimages'] = n_images
+        specific['ntrigger'] = 1
+        h5['/entry/instrument/beam/incident_wavelength'] = wavelength
+    with open(path.replace('_master.h5', '_data_000001.h5'), 'wb') as fp:
+        fp.truncate(bytes_per_image * n_images)
+    return path
+
+
+def encode_byte_offset(image):
+    """Compress an integer image with the CBF byte-offset scheme, escaping to 2, 4 or 8 byte deltas."""
+    import numpy as np
+    deltas = np.diff(np.asarray(image, dtype=np.int64).ravel(), prepend=0)
+    wide = np.flatnonzero(np.abs(deltas) > 127)
+    chunks, start = [], 0
+    for i in wide.tolist():
+        chunks.append(deltas[start:i].astype(np.int8).tobytes())
+        delta = int(deltas[i])
+        if -0x7fff <= delta <= 0x7fff:
+            chunks.append(b'\x80' + delta.to_bytes(2, 'little', signed=True))
+        elif -0x7fffffff <= delta <= 0x7fffffff:
+            chunks.append(b'\x80\x00\x80' + delta.to_bytes(4, 'little', signed=True))
+        else:
+            chunks.append(b'\x80\x00\x80\x00\x00\x00\x80' + delta.to_bytes(8, 'little', signed=True))
+        start = i + 1
+    chunks.append(deltas[start:].astype(np.int8).tobytes())
+    return b''.join(chunks)
+
+
+def write_cbf(path, image):
+    """Write an int32 image as a minimal byte-offset compressed CBF file."""
+    data = encode_byte_offset(image)
+    slow, fast = image.shape
+    header = (
+        "###CBF: VERSION 1.5\n"
+        f"data_{os.path.splitext(os.path.basename(path))[0]}\n\n"
+        "_array_data.data\n;\n--CIF-BINARY-FORMAT-SECTION--\n"
+        'Content-Type: application/octet-stream;\n     conversions="x-CBF_BYTE_OFFSET"\n'
+        "Content-Transfer-Encoding: BINARY\n"
+        f"X-Binary-Size: {len(data)}\n"
+        "X-Binary-ID: 1\n"
+        'X-Binary-Element-Type: "signed 32-bit integer"\n'
+        "X-Binary-Element-Byte-Order: LITTLE_ENDIAN\n"
+        f"X-Binary-Number-of-Elements: {slow * fast}\n"
+        f"X-Binary-Size-Fastest-Dimension: {fast}\n"
+        f"X-Binary-Size-Second-Dimension: {slow}\n"
+        "X-Binary-Size-Padding: 4095\n\n"
+    ).encode()
+    with open(path, 'wb') as fp:
+        fp.write(header + b'\x0c\x1a\x04\xd5' + data + b'\0' * 4095
+                 + b"\n--CIF-BINARY-FORMAT-SECTION----\n;\n")
+    return path
+
+
+def make_cbf_frames(data_dir, chip_name, run_num, n_images, hit_rate=0.2, shape=(512, 512),
+                    n_spots=40, seed=0):
+    """Write <chip>_<run>_<n>.cbf frames of Poisson background, a hit_rate fraction with Bragg spots.
+
+    Spots are 3x3 pixel blobs of a few hundred to tens of thousands of counts, so
+    both short and long byte-offset escapes occur. Returns the names of the hits.
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    hits = []
+    for n in range(1, n_images + 1):
+        image = rng.poisson(3.0, shape).astype(np.int32)
+        image[:, shape[1] // 2] = -1  # module gap
+        name = f"{chip_name}_{run_num}_{str(n).zfill(5)}.cbf"
+        if rng.random() < hit_rate:
+            for y, x, counts in zip(rng.integers(2, shape[0] - 2, n_spots), rng.integers(2, shape[1] - 2, n_spots),
+                                    rng.integers(200, 50000, n_spots)):
+                image[y - 1:y + 2, x - 1:x + 2] += counts
+            hits.append(name)
+        write_cbf(os.path.join(data_dir, name), image)
+    return hits
@@ -0,0 +1,166 @@
+"""Synthetic PRIME logs in the layout gladier_ssx.prime_log parses, and curves for the fits primalisys makes.
+
+Also usable from the command line to write logs for manual runs:
+    python gladier-ssx/benchmarks/prime_logs.py out.log --frames 10000 --frame-lines
+"""
+import argparse
+import math
+import random
+
+HEADER = ("Bin Resolution Range     Completeness      <N_obs> |Rmerge  Rsplit   CC1/2   N_ind "
+          "|CCiso   N_ind| <I/sigI>   <I>    <I**2>")
+RULE = "-" * 120
+
+
+def resolution_bins(n_bins, d_max=50.0, d_min=1.5):
+    """Bin edges (low, high resolution) equally spaced in 1/d**2, as in PRIME's tables."""
+    lo, hi = d_max ** -2, d_min ** -2
+    edges = [(lo + (hi - lo) * i / n_bins) ** -0.5 for i in range(n_bins + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def prime_table(label, n_frames, n_bins=20, noise=0.02, malformed=0.0, rng=None):
+    """Lines of one 'Summary for <label>' table for a dataset of n_frames frames.
+
+    Multiplicity grows with the frame count and falls off with resolution, and
+    CC1/2, <I/sigI> and completeness follow it, so larger datasets extend
+    to higher resolution the way real PRIME runs do. A malformed fraction of
+    the rows is cut short, as in logs truncated or interleaved while written.
+    """
+    rng = rng or random.Random(0)
+
+    def jitter(value, scale=1.0):
+        return value * (1.0 + rng.gauss(0.0, noise * scale))
+
+    lines = [f" Summary for {label}", HEADER, RULE]
+    for i, (d_lo, d_hi) in enumerate(resolution_bins(n_bins)):
+        multiplicity = 0.062 * n_frames * math.exp(-0.12 * i)
+        n_refl = int(6200 * math.exp(-0.11 * i))
+        completeness = min(100.0, jitter(100.0 * (1.0 - math.exp(-multiplicity)), 0.01))
+        cc_half = 100.0 * multiplicity / (multiplicity + 1.2 * math.exp(0.1 * i))
+        isigi = 1.9 * math.exp(-0.085 * i) * math.sqrt(n_frames / 900.0)
+        row = (
+            f"{i + 1:02d} {d_lo:7.2f} - {d_hi:7.2f} {completeness:6.2f} {n_refl:6d} / {n_refl:6d} "
+            f"{jitter(multiplicity):7.2f} {10.0:7.2f} {12.0:7.2f} {min(100.0, jitter(cc_half)):7.2f} "
+            f"{1000:6d} {50.0:7.2f} {int(0.9 * n_frames):6d} {jitter(isigi):8.2f} {500.0:10.1f} "
+            f"{jitter(2.0):7.2f}"
+        )
+        if rng.random() < malformed:
+            row = row[:rng.randint(10, 40)]
+        lines.append(row)
+    lines.append(RULE)
+    lines.append("TOTAL  50.00 - 1.50 99.9 1 / 1 1 1 1 1 1 1 1 1 1 1")
+    lines.append("")
+    return lines
+
+
+def frame_lines(n_frames, rng):
+    """Per-frame lines as PRIME prints them while scaling, one per frame."""
+    return [f"frame {n:07d}.pickle G={rng.uniform(0.5, 2.0):6.3f} B={rng.uniform(-5, 5):6.2f} "
+            f"CC={rng.uniform(0.0, 1.0):5.2f} N_refl={rng.randint(20, 800):4d}"
+            for n in range(n_frames)]
+
+
+def prime_log_lines(n_frames, n_bins=20, n_cycles=3, noise=0.02, bad_fraction=0.1,
+                    malformed=0.0, per_frame=False, seed=0):
+    """Lines of a PRIME log with mean_scaling and n_cycles postref_cycle_N tables.
+
+    Args:
+        n_frames: Number of frames merged, which drives the statistics
+        n_bins: Resolution bins per table (primalisys expects 20)
+        n_cycles: Number of postref cycles (primalisys reads postref_cycle_3)
+        noise: Relative Gaussian noise on the per-bin statistics
+        bad_fraction: Fraction of frames reported as bad cc frames
+        malformed: Fraction of table rows cut short
+        per_frame: Print a line per frame before every table, which makes the
+            log grow with the frame count like a real one
+        seed: Random seed; equal arguments give identical logs
+    """
+    rng = random.Random(seed)
+    n_bad = int(round(bad_fraction * n_frames))
+    lines = ["PRIME log"]
+    for label in ['mean_scaling'] + [f"postref_cycle_{n}" for n in range(1, n_cycles + 1)]:
+        if per_frame:
+            lines.extend(frame_lines(n_frames, rng))
+        lines.extend(prime_table(label, n_frames, n_bins, noise, malformed, rng))
+        lines.append(f"No. good frames:  {n_frames - n_bad}")
+        lines.append(f"No. bad cc frames: {n_bad}")
+        lines.append("")
+    return lines
+
+
+def write_prime_log(path, n_frames, **kwargs):
+    """Write a synthetic PRIME log to path, see prime_log_lines for the options."""
+    with open(path, 'w') as fp:
+        for line in prime_log_lines(n_frames, **kwargs):
+            fp.write(line + "\n")
+    return path
+
+
+# Curves of known parameters for each primalisys fit: model name in gladier_ssx.prime_fit, x axis
+# ('bins' for the bin index, 'resolution' for Angstrom), true parameters and the fixed p0
+# primalisys started curve_fit from before prime_fit warm-started it
+FIT_CURVES = (
+    ('I2', 'exp3', 'bins', (0.5, 0.2, 1.8), (1, 0.5, 2)),
+    ('CC', 'exp', 'resolution', (-300.0, 0.5, 95.0), (0, 0, 1)),
+    ('NOBS', 'exp', 'resolution', (-100.0, 0.3, 40.0), (0, 0, 1)),
+    ('COMP', 'exp2', 'bins', (1.0, 0.25, 3.0, 100.0), (1, 0.2, 2, 100)),
+    ('ISIGI', 'exp4', 'bins', (20.0, 0.15, 0.3), (1, 0.6, 4)),
+)
+
+
+def fit_curves(noise=0.005, seed=0):
+    """(name, model, x, y, true parameters, legacy p0) for every entry of FIT_CURVES.
+
+    y is the model at the true parameters plus Gaussian noise of noise times its range.
+    """
+    import numpy as np
+    from gladier_ssx import prime_fit
+
+    rng = np.random.default_rng(seed)
+    axes = {'bins': prime_fit.RES_BINS, 'resolution': np.linspace(25.0, 1.6, prime_fit.N_BINS)}
+    curves = []
+    for name, model_name, axis, pars, legacy_p0 in FIT_CURVES:
+        model = getattr(prime_fit, model_name)
+        x = axes[axis]
+        y = model(x, *pars)
+        y = y + rng.normal(0.0, noise * np.ptp(y), y.size)
+        curves.append((name, model, x, y, pars, legacy_p0))
+    return curves
+
+
+def legacy_fit(model, x, y, p0):
+    """Fit as primalisys did before prime_fit: curve_fit from the fixed p0 without a Jacobian.
+
+    Returns:
+        The fitted parameters, or None if curve_fit failed
+    """
+    from scipy.optimize import curve_fit
+
+    try:
+        pars, _ = curve_fit(f=model, xdata=x, ydata=y, p0=list(p0))
+    except (RuntimeError, ValueError):
+        return None
+    return pars
+
+
+def main():
+    """Write one synthetic PRIME log."""
+    parser = argparse.ArgumentParser(description="Write a synthetic PRIME log")
+    parser.add_argument("path", help="Output log path")
+    parser.add_argument("--frames", type=int, default=1000, help="Number of frames merged")
+    parser.add_argument("--bins", type=int, default=20, help="Resolution bins per table")
+    parser.add_argument("--cycles", type=int, default=3, help="Number of postref cycles")
+    parser.add_argument("--noise", type=float, default=0.02, help="Relative noise on the statistics")
+    parser.add_argument("--bad-fraction", type=float, default=0.1, help="Fraction of bad cc frames")
+    parser.add_argument("--malformed", type=float, default=0.0, help="Fraction of table rows cut short")
+    parser.add_argument("--frame-lines", action="store_true", help="Print a line per frame before each table")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    write_prime_log(args.path, args.frames, n_bins=args.bins, n_cycles=args.cycles, noise=args.noise,
+                    bad_fraction=args.bad_fraction, malformed=args.malformed,
+                    per_frame=args.frame_lines, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,696 @@
+#!/usr/bin/env python
+"""Orchestration benchmarks for the SSX tools, run against the stand-in executables.
+
+Every tool function is driven end to end on synthetic data with the programs
+it launches replaced by standin.py, so the numbers measure this package's own
+overhead (discovery, bookkeeping, process launch, log handling) and how it
+scales, on any Linux box without DIALS or real data. The gladier package must
+be importable, as for the tools themselves.
+
+Usage:
+    python gladier-ssx/benchmarks/run_benchmarks.py [--quick] [--only NAME ...]
+        [--json results.json] [--compare baseline.json] [--threshold 0.2]
+
+--json saves the results; --compare reports every measurement that got
+slower than the saved baseline by more than the threshold and exits with
+status 1 if there are any.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fixtures  # noqa: E402
+import prime_logs  # noqa: E402
+from prime_logs import write_prime_log  # noqa: E402
+from gladier_ssx.catalog import open_catalog  # noqa: E402
+from gladier_ssx.cbf_container import read_frames, verify_container  # noqa: E402
+from gladier_ssx.dials_env import dials_environment  # noqa: E402
+from gladier_ssx.hit_finding import prefilter_hits, read_cbf  # noqa: E402
+from gladier_ssx.int_index import IntIndex  # noqa: E402
+from gladier_ssx.local_executor import run_local  # noqa: E402
+from gladier_ssx.master_metadata import read_master_metadata  # noqa: E402
+from gladier_ssx.metrics import collect_metrics  # noqa: E402
+from gladier_ssx.placement import available_cores  # noqa: E402
+from gladier_ssx.primalisys_plot import plot_fits  # noqa: E402
+from gladier_ssx.prime_decision import decision_engine  # noqa: E402
+from gladier_ssx.prime_fit import fit_metrics, metric_arrays  # noqa: E402
+from gladier_ssx.prime_log import parse_prime_log  # noqa: E402
+from gladier_ssx.runner import run_logged  # noqa: E402
+from tools.cbf_container import repack_cbf  # noqa: E402
+from tools.create_phil import CreatePhil, create_phil  # noqa: E402
+from tools.dials_prime import dials_prime  # noqa: E402
+from tools.dials_stills import dials_stills  # noqa: E402
+from tools.merge_all import MergeAll, merge_all  # noqa: E402
+from tools.primalisys import Primalisys, primalisys  # noqa: E402
+from tools.primalisys_batch import primalisys_batch  # noqa: E402
+from tools.run_initial_proc import RunInitialProc, run_initial_proc  # noqa: E402
+from tools.run_prime import RunPrime, run_prime  # noqa: E402
+from tools.run_refined_proc import RunRefinedProc, run_refined_proc  # noqa: E402
+from tools.stream_refined_proc import stream_refined_proc  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark; it receives a scratch directory and the quick flag and yields result rows."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def timed(func, *args, **kwargs):
+    """Call func and return (seconds, result)."""
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+def repeat(func, n):
+    """Median and minimum wall time of n calls of func."""
+    times = [timed(func)[0] for _ in range(n)]
+    return {'seconds': statistics.median(times), 'min_seconds': min(times)}
+
+
+@contextlib.contextmanager
+def standin_env(**settings):
+    """Set SSX_STANDIN_* variables for the duration of the block."""
+    saved = {key: os.environ.get(f"SSX_STANDIN_{key}") for key in settings}
+    os.environ.update({f"SSX_STANDIN_{key}": str(value) for key, value in settings.items()})
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(f"SSX_STANDIN_{key}", None)
+            else:
+                os.environ[f"SSX_STANDIN_{key}"] = value
+
+
+def child_seconds(result):
+    """Wall time spent inside launched programs, from the metrics records of a tool result."""
+    return sum(record['wall_time'] for record in collect_metrics(result))
+
+
+@benchmark
+def tool_overhead(root, quick):
+    """Every tool once with zero-latency stand-ins: tool wall time minus time spent in its children."""
+    dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+    env_cache = os.path.join(root, 'env_cache')
+    registry = os.path.join(root, 'registry.json')
+    data_dir = fixtures.make_data_dir(os.path.join(root, 'data'), n_masters=8)
+    cbf_dir = fixtures.make_cbfs(os.path.join(root, 'cbf'), 'chip', 1, 10)
+    proc_dir = os.path.join(root, 'proc')
+    prime_dir = os.path.join(root, 'prime')
+    with open(os.path.join(cbf_dir, 'beamline_run1.json'), 'w') as fp:
+        json.dump(fixtures.BEAMLINE_JSON, fp)
+
+    def call(name, func, cwd=None, **data):
+        if cwd:
+            os.chdir(cwd)
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds, result = timed(func, **data)
+        children = child_seconds(result)
+        return {'benchmark': 'tool_overhead', 'params': {'tool': name}, 'seconds': seconds,
+                'child_seconds': children, 'overhead_seconds': seconds - children}
+
+    yield call('create_phil', create_phil, data_dir=cbf_dir, proc_dir=proc_dir, run_num=1, chip_name='chip')
+    yield call('run_initial_proc', run_initial_proc, data_dir=data_dir, run_num=1,
+               geometry_registry=registry, catalog=os.path.join(data_dir, '.ssx_catalog.sqlite'))
+    yield call('run_refined_proc', run_refined_proc, cwd=data_dir, reuse_geometry=False)
+    yield call('merge_all', merge_all, cwd=data_dir, dials_path=dials_path, env_cache_dir=env_cache)
+    yield call('run_prime', run_prime, cwd=data_dir)
+    yield call('dials_stills', dials_stills, data_dir=cbf_dir, proc_dir=proc_dir, run_num=1,
+               chip_name='chip', cbf_num=10, stills_batch_size=10, filename='chip_1_00010.cbf',
+               dials_path=dials_path, env_cache_dir=env_cache)
+    yield call('dials_prime', dials_prime, data_dir=cbf_dir, proc_dir=proc_dir, prime_dir=prime_dir,
+               run_num=1, chip_name='chip', dials_path=dials_path, env_cache_dir=env_cache)
+    log = glob.glob(os.path.join(prime_dir, 'chip_*_prime', 'log.txt'))[0]
+    yield call('primalisys', primalisys, prime_dir=prime_dir, upload_dir=prime_dir, prime_input=log, plot='none')
+
+
+@benchmark
+def refined_proc_scaling(root, quick):
+    """run_refined_proc over n master files at several max_jobs, then a rerun that the manifest skips."""
+    fixtures.make_bin(os.path.join(root, 'dials'))
+    sizes = (16,) if quick else (16, 64)
+    with standin_env(XIA2_SSX_LATENCY=0.05):
+        for n_masters in sizes:
+            for max_jobs in (1, 4, 8):
+                data_dir = fixtures.make_data_dir(os.path.join(root, f"data_{n_masters}_{max_jobs}"),
+                                                  n_masters=n_masters)
+                os.chdir(data_dir)
+                seconds, _ = timed(run_refined_proc, max_jobs=max_jobs, reuse_geometry=False)
+                yield {'benchmark': 'refined_proc_scaling',
+                       'params': {'n_masters': n_masters, 'max_jobs': max_jobs}, 'seconds': seconds}
+            seconds, result = timed(run_refined_proc, max_jobs=max_jobs, reuse_geometry=False)
+            yield {'benchmark': 'refined_proc_scaling',
+                   'params': {'n_masters': n_masters, 'rerun': True}, 'seconds': seconds,
+                   'skipped': result['skipped']}
+
+
+@benchmark
+def log_streaming(root, quick):
+    """run_logged with verbose children: wall time, throughput and the parent's peak RSS growth."""
+    fixtures.make_bin(os.path.join(root, 'dials'))
+    for mib in ((1, 16) if quick else (1, 64, 256)):
+        with standin_env(XIA2_SSX_OUTPUT=mib * 1024 * 1024):
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            seconds, _ = timed(run_logged, 'xia2.ssx', log_dir=os.path.join(root, 'logs'), name=f"out_{mib}",
+                               cwd=root, max_bytes=16 * 1024 * 1024)
+            rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        yield {'benchmark': 'log_streaming', 'params': {'output_mib': mib}, 'seconds': seconds,
+               'mib_per_second': mib / seconds, 'parent_rss_growth_kb': rss_after - rss_before}
+
+
+@benchmark
+def dials_env_startup(root, quick):
+    """Capturing the DIALS environment from a slow setup script, cold and from the cache.
+
+    Also times launching a stand-in program with `source <setup script> && program`,
+    as the tools used to, against launching it directly in the cached environment.
+    """
+    dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+    setup_script = os.path.join(dials_path, 'dials')
+    with open(setup_script, 'a') as fp:
+        fp.write("sleep 0.2\nexport DIALS_STANDIN=1\n")
+    cache_dir = os.path.join(root, 'env_cache')
+    seconds, _ = timed(dials_environment, dials_path, cache_dir)
+    yield {'benchmark': 'dials_env_startup', 'params': {'cache': 'cold'}, 'seconds': seconds}
+    yield dict(repeat(lambda: dials_environment(dials_path, cache_dir), 20),
+               benchmark='dials_env_startup', params={'cache': 'warm'})
+
+    workdir = os.path.join(root, 'launch')
+    os.makedirs(workdir, exist_ok=True)
+    n = 5 if quick else 20
+
+    def sourced():
+        subprocess.run(f"source {setup_script} && xia2.ssx", shell=True, executable='/bin/bash', cwd=workdir,
+                       stdout=subprocess.DEVNULL, check=True)
+
+    def direct():
+        subprocess.run(['xia2.ssx'], env=dials_environment(dials_path, cache_dir), cwd=workdir,
+                       stdout=subprocess.DEVNULL, check=True)
+
+    yield dict(repeat(sourced, n), benchmark='dials_env_startup', params={'launch': 'source'})
+    yield dict(repeat(direct, n), benchmark='dials_env_startup', params={'launch': 'cached_env'})
+
+
+@benchmark
+def catalog_discovery(root, quick):
+    """Finding refined/<run>/batch_1 directories and raster master files, with and without cached listings, against glob.
+
+    Local disks are where this harness runs, so cached_warm only shows the cost of
+    the index; on Lustre or NFS every listing avoided is a metadata server round trip.
+    """
+    for n_runs in ((1000,) if quick else (1000, 10000)):
+        refined = fixtures.make_refined_tree(os.path.join(root, f"refined_{n_runs}"), n_runs)
+        raster = os.path.join(root, f"raster_{n_runs}")
+        os.makedirs(raster, exist_ok=True)
+        for i in range(n_runs):
+            open(os.path.join(raster, f"chip_{i // 100}_{i:05d}.cbf"), 'w').close()
+        for i in range(n_runs // 100):
+            open(os.path.join(raster, f"chip_{i}_master.h5"), 'w').close()
+        # Old enough that the cached listings are outside the racy window
+        old = time.time() - 10
+        for path in [raster, refined] + [entry.path for entry in os.scandir(refined)]:
+            os.utime(path, (old, old))
+        tasks = {
+            'batch_dirs': (lambda catalog: catalog.batch_dirs(refined),
+                           lambda: sorted(glob.glob(os.path.join(refined, '*', 'batch_1')))),
+            'raster_masters': (lambda catalog: catalog.glob(raster, '*_master.h5'),
+                               lambda: sorted(glob.glob(os.path.join(raster, '*_master.h5')))),
+        }
+        for task, (with_catalog, with_glob) in tasks.items():
+            params = {'n_runs': n_runs, 'task': task}
+            index = os.path.join(root, f"catalog_{n_runs}_{task}.sqlite")
+            with open_catalog(index, cache_listings=True) as catalog:
+                seconds, _ = timed(with_catalog, catalog)
+                yield {'benchmark': 'catalog_discovery', 'params': dict(params, method='cached_cold'),
+                       'seconds': seconds}
+                yield dict(repeat(lambda: with_catalog(catalog), 5), benchmark='catalog_discovery',
+                           params=dict(params, method='cached_warm'))
+            with open_catalog(index, cache_listings=False) as catalog:
+                yield dict(repeat(lambda: with_catalog(catalog), 5), benchmark='catalog_discovery',
+                           params=dict(params, method='scandir'))
+            yield dict(repeat(with_glob, 5), benchmark='catalog_discovery', params=dict(params, method='glob'))
+
+
+@benchmark
+def int_index_arrival(root, quick):
+    """Frames arriving in batches and a PRIME trigger check per batch: appending what each batch
+    wrote, reconciling against a listing of proc_dir, and rewriting a sorted int list."""
+    total, batch = (10000, 500) if quick else (50000, 500)
+    for method in ('append', 'update_from_dir', 'rewrite'):
+        proc_dir = os.path.join(root, f"proc_{method}")
+        index = IntIndex(os.path.join(root, f"{method}_ints.txt"))
+        elapsed = 0.0
+        for start in range(0, total, batch):
+            fixtures.make_ints(proc_dir, batch, start)
+            written = [os.path.join(proc_dir, f"int-0-{n:06d}.pickle") for n in range(start, start + batch)]
+            t0 = time.perf_counter()
+            if method == 'append':
+                index.append(written)
+            elif method == 'update_from_dir':
+                index.update_from_dir(proc_dir)
+            else:
+                names = sorted(name for name in os.listdir(proc_dir) if name.startswith('int-'))
+                with open(index.index_path, 'w') as fp:
+                    fp.write("".join(os.path.join(proc_dir, name) + "\n" for name in names))
+            n_ints = len(index) if method != 'rewrite' else len(names)
+            elapsed += time.perf_counter() - t0
+        assert n_ints == total
+        yield {'benchmark': 'int_index_arrival', 'params': {'frames': total, 'batch': batch, 'method': method},
+               'seconds': elapsed}
+
+
+@benchmark
+def image_selection(root, quick):
+    """Adaptive initial refinement per selection strategy: files and wall time until converged."""
+    fixtures.make_bin(os.path.join(root, 'dials'))
+    with standin_env(XIA2_SSX_LATENCY=0.02):
+        for strategy in ('first', 'largest', 'spread'):
+            data_dir = fixtures.make_data_dir(os.path.join(root, f"data_{strategy}"), n_masters=32)
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds, result = timed(run_initial_proc, data_dir=data_dir, n_files=2, selection=strategy,
+                                        adaptive=True, adaptive_step=2, max_files=32,
+                                        convergence_tolerance=0.002, reuse_geometry=False)
+            yield {'benchmark': 'image_selection', 'params': {'selection': strategy}, 'seconds': seconds,
+                   'files': result['n_files'], 'rounds': len(result['rounds']), 'converged': result['converged']}
+
+
+@benchmark
+def primalisys_end_to_end(root, quick):
+    """primalisys on synthetic PRIME logs of growing frame counts, for each plot mode.
+
+    'seconds' is the time until primalisys returns and 'png_seconds' the time until
+    primalysis.png exists, which for plot='background' is drawn after it has returned.
+    """
+    png = os.path.join(root, 'primalysis.png')
+    for plot in ('inline', 'background', 'none'):
+        for n_frames in ((1000,) if quick else (1000, 10000, 100000)):
+            log = write_prime_log(os.path.join(root, f"prime_{n_frames}.log"), n_frames)
+            returned, drawn = [], []
+            for _ in range(3):
+                if os.path.exists(png):
+                    os.remove(png)
+                t0 = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    primalisys(prime_dir=root, upload_dir=root, prime_input=log, plot=plot)
+                returned.append(time.perf_counter() - t0)
+                if plot != 'none':
+                    deadline = time.monotonic() + 120
+                    while not os.path.exists(png) and time.monotonic() < deadline:
+                        time.sleep(0.005)
+                    drawn.append(time.perf_counter() - t0)
+            yield {'benchmark': 'primalisys_end_to_end', 'params': {'plot': plot, 'n_frames': n_frames},
+                   'seconds': statistics.median(returned), 'min_seconds': min(returned),
+                   'png_seconds': statistics.median(drawn) if drawn else None}
+
+
+@benchmark
+def primalisys_stages(root, quick):
+    """primalisys parse, fit, decide and plot times on logs with a line per frame, across frame counts."""
+    for n_frames in ((1000, 10000) if quick else (1000, 10000, 100000)):
+        log = write_prime_log(os.path.join(root, f"prime_{n_frames}.log"), n_frames, per_frame=True)
+        parse = repeat(lambda: parse_prime_log(log), 3)
+        parsed = parse_prime_log(log)
+        array_list = metric_arrays(parsed['tables']['postref_cycle_3'])
+        gb_list = [parsed['good_frames'], parsed['bad_frames']]
+        fit = repeat(lambda: fit_metrics(array_list), 3)
+        fitting_list = (array_list[0],) + tuple(fit_metrics(array_list))
+        with contextlib.redirect_stdout(io.StringIO()):
+            decide = repeat(lambda: decision_engine(fitting_list, gb_list), 3)
+        try:
+            plot_seconds, _ = timed(plot_fits, fitting_list, gb_list, os.path.join(root, 'primalysis.png'))
+        except ImportError:
+            plot_seconds = None
+        params = {'n_frames': n_frames, 'log_mib': round(os.path.getsize(log) / 2 ** 20, 1)}
+        yield {'benchmark': 'primalisys_stages', 'params': dict(params, stage='parse'), **parse}
+        yield {'benchmark': 'primalisys_stages', 'params': dict(params, stage='fit'), **fit}
+        yield {'benchmark': 'primalisys_stages', 'params': dict(params, stage='decide'), **decide}
+        if plot_seconds is not None:
+            yield {'benchmark': 'primalisys_stages', 'params': dict(params, stage='plot'), 'seconds': plot_seconds}
+
+    log = write_prime_log(os.path.join(root, 'prime_malformed.log'), 10000, per_frame=True, malformed=0.05)
+    yield dict(repeat(lambda: parse_prime_log(log), 3), benchmark='primalisys_stages',
+               params={'n_frames': 10000, 'stage': 'parse', 'malformed': 0.05},
+               malformed_lines=parse_prime_log(log)['malformed_lines'])
+
+
+@benchmark
+def prime_fit_legacy(root, quick):
+    """Each primalisys fit on a curve of known parameters: curve_fit from the old fixed p0 against prime_fit.
+
+    Rows give the time per fit and the largest relative difference of the parameters
+    from the true ones and, for prime_fit, from the old fit's.
+    """
+    import numpy as np
+    from gladier_ssx.prime_fit import exp2, fit_curve
+
+    def identifiable(model, pars):
+        # exp2 depends on a and c only through a * e^-c
+        pars = np.asarray(pars, dtype=float)
+        return np.array([pars[0] * np.exp(-pars[2]), pars[1], pars[3]]) if model is exp2 else pars
+
+    def rel_diff(model, pars, reference):
+        if pars is None:
+            return None
+        reference = identifiable(model, reference)
+        return float(np.max(np.abs(identifiable(model, pars) - reference) / np.abs(reference)))
+
+    n = 20 if quick else 200
+    for name, model, x, y, pars, legacy_p0 in prime_logs.fit_curves():
+        with np.errstate(over='ignore', invalid='ignore'):
+            legacy = prime_logs.legacy_fit(model, x, y, legacy_p0)
+            fitted, _, ok = fit_curve(model, x, y, legacy_p0)
+            legacy_time = repeat(lambda: prime_logs.legacy_fit(model, x, y, legacy_p0), n)
+            new_time = repeat(lambda: fit_curve(model, x, y, legacy_p0), n)
+        yield dict(legacy_time, benchmark='prime_fit_legacy', params={'fit': name, 'method': 'curve_fit'},
+                   rel_diff_true=rel_diff(model, legacy, pars))
+        yield dict(new_time, benchmark='prime_fit_legacy', params={'fit': name, 'method': 'prime_fit'},
+                   rel_diff_true=rel_diff(model, fitted if ok else None, pars),
+                   rel_diff_legacy=rel_diff(model, fitted if ok else None, legacy) if legacy is not None else None)
+
+
+@benchmark
+def primalisys_batch_pool(root, quick):
+    """primalisys_batch over a shift of chips with growing PRIME runs, serial and in a process pool."""
+    n_chips, n_runs = (4, 6) if quick else (12, 12)
+    prime_root = os.path.join(root, 'prime_batch')
+    for c in range(n_chips):
+        for r in range(1, n_runs + 1):
+            run_dir = os.path.join(prime_root, f"chip{c:02d}", f"chip{c:02d}_{250 * r}_prime")
+            os.makedirs(run_dir, exist_ok=True)
+            write_prime_log(os.path.join(run_dir, 'log.txt'), 250 * r, per_frame=True, seed=c * n_runs + r)
+    n_logs = n_chips * n_runs
+    for workers in sorted({1, 4, os.cpu_count() or 1}):
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds, result = timed(primalisys_batch, prime_root=prime_root, upload_dir=os.path.join(root, 'upload'),
+                                    workers=workers)
+        yield {'benchmark': 'primalisys_batch_pool', 'params': {'n_logs': n_logs, 'workers': workers},
+               'seconds': seconds, 'logs_per_second': n_logs / seconds,
+               'failed': sum(1 for row in result['rows'] if row.get('error'))}
+
+
+@benchmark
+def local_pipeline(root, quick):
+    """The SSXClient tool chain run locally, one stage at a time and with independent stages overlapped."""
+    tools = [CreatePhil, RunInitialProc, RunRefinedProc, MergeAll, RunPrime, Primalisys]
+    latency = 0.2 if quick else 1.0
+    dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+    for workers in (1, None):
+        data_dir = fixtures.make_data_dir(os.path.join(root, f"data_{workers}"), n_masters=4)
+        flow_input = {'data_dir': data_dir, 'dials_path': dials_path, 'env_cache_dir': os.path.join(root, 'env_cache'),
+                      'reuse_geometry': False, 'n_files': 2, 'run_num': 1}
+        stage_input = {
+            'create_phil': {'proc_dir': 'proc'},
+            'merge_all': {'output_dir': 'final_merge'},
+            'run_prime': {'output_dir': 'prime_results'},
+            'primalisys': {'prime_dir': 'prime_results', 'upload_dir': 'prime_results',
+                           'prime_input': 'prime.log', 'plot': 'none'},
+        }
+        with standin_env(XIA2_SSX_REDUCE_LATENCY=latency, PRIME_LATENCY=latency, XIA2_SSX_LATENCY=latency / 10):
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds, results = timed(run_local, tools, flow_input, max_workers=workers,
+                                         stage_input=stage_input, cwd=data_dir)
+        yield {'benchmark': 'local_pipeline', 'params': {'workers': workers or len(tools), 'latency': latency},
+               'seconds': seconds, 'child_seconds': child_seconds(results)}
+
+
+def collect_masters(raster, n_masters, interval, end_marker):
+    """Write a master file and its data file every interval seconds, like a detector, then the end marker."""
+    for i in range(n_masters):
+        time.sleep(interval)
+        with open(os.path.join(raster, f"r{i:05d}_data_000001.h5"), 'wb') as fp:
+            fp.truncate(4096)
+        open(os.path.join(raster, f"r{i:05d}_master.h5"), 'wb').close()
+    open(end_marker, 'w').close()
+
+
+@benchmark
+def streaming_collection(root, quick):
+    """Seconds from the start of collection to the first merged statistics, batch against streaming."""
+    n_masters, interval = (8, 0.1) if quick else (24, 0.25)
+    dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+    for mode in ('batch', 'stream'):
+        data_dir = fixtures.make_data_dir(os.path.join(root, f"collect_{mode}"), n_masters=0)
+        geometry = os.path.join(data_dir, 'initial_refinement', 'geometry_refinement', 'refined.expt')
+        os.makedirs(os.path.dirname(geometry))
+        open(geometry, 'w').close()
+        end_marker = os.path.join(data_dir, 'collection_done')
+        os.chdir(data_dir)
+        collector = threading.Thread(target=collect_masters,
+                                     args=(os.path.join(data_dir, 'raster'), n_masters, interval, end_marker))
+        with standin_env(XIA2_SSX_LATENCY=interval, XIA2_SSX_REDUCE_LATENCY=interval * 2, PRIME_LATENCY=interval * 2), \
+                contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            collector.start()
+            if mode == 'batch':
+                collector.join()
+                run_refined_proc(max_jobs=2, reuse_geometry=False, refined_geometry=geometry)
+                merge_all(dials_path=dials_path, env_cache_dir=os.path.join(root, 'env_cache'))
+                run_prime()
+                first_merge = total = time.perf_counter() - t0
+                n_merges = 1
+            else:
+                result = stream_refined_proc(max_jobs=2, reuse_geometry=False, refined_geometry=geometry, merge_every=max(2, n_masters // 4),
+                                             poll_interval=interval / 2, settle_seconds=0, end_marker=end_marker,
+                                             dials_path=dials_path, env_cache_dir=os.path.join(root, 'env_cache'))
+                total = time.perf_counter() - t0
+                first_merge, n_merges = result['first_merge_seconds'], len(result['merges'])
+            collector.join()
+        yield {'benchmark': 'streaming_collection', 'params': {'mode': mode, 'n_masters': n_masters},
+               'seconds': first_merge, 'total_seconds': total, 'collection_seconds': n_masters * interval,
+               'merges': n_merges}
+
+
+@benchmark
+def core_placement(root, quick):
+    """run_refined_proc throughput with every job told to use all cores against jobs pinned to disjoint cores."""
+    n_masters, cpu = (4, 0.2) if quick else (16, 1.0)
+    n_cores = len(available_cores())
+    fixtures.make_bin(os.path.join(root, 'dials'))
+    for max_jobs in (2, 4):
+        for mode in ('shared', 'pinned'):
+            data_dir = fixtures.make_data_dir(os.path.join(root, f"placement_{max_jobs}_{mode}"), n_masters=n_masters)
+            os.chdir(data_dir)
+            # 'shared' is today's behaviour: a fixed nproc sized for the whole node in every job
+            settings = {'nproc_per_job': n_cores} if mode == 'shared' else {'pin_cores': True}
+            with standin_env(XIA2_SSX_CPU=cpu), contextlib.redirect_stdout(io.StringIO()):
+                seconds, result = timed(run_refined_proc, max_jobs=max_jobs, reuse_geometry=False,
+                                        refined_geometry=os.path.join(data_dir, 'run.phil'), **settings)
+            yield {'benchmark': 'core_placement', 'params': {'mode': mode, 'max_jobs': max_jobs, 'cores': n_cores},
+                   'seconds': seconds, 'files_per_second': n_masters / seconds, 'failed': result['failed']}
+
+
+@benchmark
+def refined_ordering(root, quick):
+    """Metadata scan of synthetic master files, and run_refined_proc makespan in name order against longest first."""
+    # A few long runs sorting last by name, behind many short ones: the worst case for name order
+    per_image = 0.002 if quick else 0.01
+    sizes = [20] * 12 + [200] * 2
+    fixtures.make_bin(os.path.join(root, 'dials'))
+    for order in ('name', 'longest_first'):
+        data_dir = os.path.join(root, f"ordering_{order}")
+        raster = os.path.join(data_dir, 'raster')
+        os.makedirs(raster)
+        masters = [fixtures.make_master_h5(os.path.join(raster, f"r{i:05d}_master.h5"), n_images)
+                   for i, n_images in enumerate(sizes)]
+        os.chdir(data_dir)
+        if order == 'name':
+            seconds, _ = timed(lambda: [read_master_metadata(path) for path in masters])
+            yield {'benchmark': 'refined_ordering', 'params': {'scan': 'h5py', 'files': len(masters)},
+                   'seconds': seconds}
+            with open_catalog() as catalog:
+                for scan in ('cold', 'cached'):
+                    seconds, _ = timed(catalog.master_metadata, masters)
+                    yield {'benchmark': 'refined_ordering', 'params': {'scan': scan, 'files': len(masters)},
+                           'seconds': seconds}
+        with standin_env(XIA2_SSX_IMAGE_LATENCY=per_image), contextlib.redirect_stdout(io.StringIO()):
+            seconds, result = timed(run_refined_proc, max_jobs=4, order=order, reuse_geometry=False,
+                                    refined_geometry=masters[0])
+        ideal = max(sum(sizes) / 4, max(sizes)) * per_image
+        yield {'benchmark': 'refined_ordering', 'params': {'order': order, 'max_jobs': 4, 'files': len(masters)},
+               'seconds': seconds, 'ideal_seconds': ideal, 'failed': result['failed']}
+
+
+@benchmark
+def hit_prefilter(root, quick):
+    """CBF decode and hit-scoring throughput, and dials_stills CPU time with and without the prefilter."""
+    n_images, shape = (40, (512, 512)) if quick else (100, (2527, 2463))
+    cbf_dir = os.path.join(root, 'cbf')
+    hits = fixtures.make_cbf_frames(cbf_dir, 'chip', 1, n_images, hit_rate=0.2, shape=shape)
+    paths = sorted(glob.glob(os.path.join(cbf_dir, '*.cbf')))
+    seconds, _ = timed(lambda: [read_cbf(path) for path in paths[:10]])
+    yield {'benchmark': 'hit_prefilter', 'params': {'stage': 'decode', 'shape': list(shape)},
+           'seconds': seconds / 10, 'frames_per_second': 10 / seconds}
+    for workers in sorted({1, len(available_cores())}):
+        seconds, (kept, stats) = timed(prefilter_hits, paths, workers=workers)
+        yield {'benchmark': 'hit_prefilter', 'params': {'stage': 'prefilter', 'workers': workers, 'frames': n_images},
+               'seconds': seconds, 'frames_per_second': n_images / seconds, 'hit_rate': stats['hit_rate'],
+               'missed_hits': len(set(hits) - {os.path.basename(path) for path in kept})}
+
+    dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+    with open(os.path.join(cbf_dir, 'beamline_run1.json'), 'w') as fp:
+        json.dump(fixtures.BEAMLINE_JSON, fp)
+    for prefilter in (False, True):
+        proc_dir = os.path.join(root, f"proc_{prefilter}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_phil(data_dir=cbf_dir, proc_dir=proc_dir, run_num=1, chip_name='chip')
+        # Stand-in cost per frame well below real DIALS, which takes seconds per still
+        with standin_env(DIALS_STILLS_PROCESS_IMAGE_CPU=0.01 if quick else 0.05):
+            seconds, result = timed(dials_stills, data_dir=cbf_dir, proc_dir=proc_dir, run_num=1, chip_name='chip',
+                                    cbf_num=n_images, stills_batch_size=n_images, filename='chip_1_00001.cbf',
+                                    dials_path=dials_path, env_cache_dir=os.path.join(root, 'env_cache'),
+                                    prefilter=prefilter)
+        yield {'benchmark': 'hit_prefilter', 'params': {'stage': 'dials_stills', 'prefilter': prefilter,
+                                                        'frames': n_images},
+               'seconds': seconds, 'child_cpu_seconds': sum(record['user_time'] + record['system_time'] for record in collect_metrics(result)),
+               'integrated': len(glob.glob(os.path.join(proc_dir, 'int-*.pickle')))}
+
+
+@benchmark
+def cbf_container(root, quick):
+    """Repacking CBF stills into an HDF5 container: bytes moved, reads of a batch and dials_stills on either input."""
+    n_images, shape = (40, (512, 512)) if quick else (200, (1679, 1475))
+    cbf_dir = os.path.join(root, 'cbf')
+    fixtures.make_cbf_frames(cbf_dir, 'chip', 1, n_images, shape=shape)
+    batch = {'data_dir': cbf_dir, 'run_num': 1, 'chip_name': 'chip', 'cbf_num': n_images, 'stills_batch_size': n_images}
+
+    def read_loose():
+        for path in sorted(glob.glob(os.path.join(cbf_dir, '*.cbf'))):
+            os.stat(path)
+            with open(path, 'rb') as fp:
+                fp.read()
+
+    # Metadata operations: a stat and an open per loose file, one open of the container
+    yield {'benchmark': 'cbf_container', 'params': {'stage': 'read', 'input': 'loose', 'frames': n_images},
+           **repeat(read_loose, 3), 'metadata_ops': 2 * n_images}
+    for compression in (None, 'lzf', 'gzip'):
+        seconds, result = timed(repack_cbf, compression=compression,
+                                container_dir=os.path.join(root, f"containers_{compression}"), **batch)
+        yield {'benchmark': 'cbf_container', 'params': {'stage': 'repack', 'compression': str(compression),
+                                                        'frames': n_images},
+               'seconds': seconds, 'mb_per_second': result['bytes_in'] / seconds / 1e6,
+               'bytes_in': result['bytes_in'], 'bytes_out': result['bytes_out']}
+        container = result['container']
+        yield {'benchmark': 'cbf_container', 'params': {'stage': 'read', 'input': 'container',
+                                                        'compression': str(compression), 'frames': n_images},
+               **repeat(lambda: list(read_frames(container)), 3), 'metadata_ops': 1}
+        # What remove_cbfs adds before deleting the files
+        yield dict(repeat(lambda: verify_container(container, glob.glob(os.path.join(cbf_dir, '*.cbf'))), 3),
+                   benchmark='cbf_container', params={'stage': 'verify', 'compression': str(compression),
+                                                      'frames': n_images})
+
+    dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+    with open(os.path.join(cbf_dir, 'beamline_run1.json'), 'w') as fp:
+        json.dump(fixtures.BEAMLINE_JSON, fp)
+    for source in ('loose', 'container'):
+        proc_dir = os.path.join(root, f"proc_{source}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_phil(data_dir=cbf_dir, proc_dir=proc_dir, run_num=1, chip_name='chip')
+        seconds, result = timed(dials_stills, proc_dir=proc_dir, filename='chip_1_00001.cbf', dials_path=dials_path,
+                                env_cache_dir=os.path.join(root, 'env_cache'), scratch_dir=root,
+                                container=container if source == 'container' else None,
+                                prefer_container=True, **batch)
+        yield {'benchmark': 'cbf_container', 'params': {'stage': 'dials_stills', 'input': source, 'frames': n_images},
+               'seconds': seconds, 'integrated': len(glob.glob(os.path.join(proc_dir, 'int-*.pickle')))}
+
+
+@benchmark
+def merge_sharding(root, quick):
+    """merge_all on thousands of batches: one reduction against shards reduced side by side and combined."""
+    n_batches, per_input = (200, 0.002) if quick else (2000, 0.002)
+    dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+    data_dir = fixtures.make_data_dir(os.path.join(root, 'data'), n_masters=0)
+    refined_dir = fixtures.make_refined_tree(os.path.join(data_dir, 'refined'), n_batches)
+    argv_bytes = sum(len(f"directory={os.path.join(refined_dir, name, 'batch_1')}") + 1 for name in os.listdir(refined_dir))
+    for shard_size, max_jobs in ((None, 1), (n_batches // 20, 4), (n_batches // 5, 4)):
+        os.chdir(data_dir)
+        output_dir = f"merge_{shard_size}"
+        with standin_env(XIA2_SSX_REDUCE_IMAGE_LATENCY=per_input):
+            seconds, result = timed(merge_all, output_dir=output_dir, shard_size=shard_size, max_jobs=max_jobs,
+                                    dials_path=dials_path, env_cache_dir=os.path.join(root, 'env_cache'))
+        with open(os.path.join(data_dir, output_dir, 'DataFiles', 'scaled.expt'), 'r') as fp:
+            merged = json.load(fp)['n_batches']
+        yield {'benchmark': 'merge_sharding', 'params': {'batches': n_batches, 'shard_size': shard_size,
+                                                         'max_jobs': max_jobs},
+               'seconds': seconds, 'reductions': 1 + len(result.get('shards', [])), 'batches_merged': merged,
+               'cmd_bytes': len(result['cmd']), 'unsharded_argv_bytes': argv_bytes,
+               'returncode': result['returncode']}
+
+
+def row_key(row):
+    """Identity of a measurement across runs."""
+    return f"{row['benchmark']} {json.dumps(row['params'], sort_keys=True)}"
+
+
+def compare(rows, baseline_path, threshold):
+    """Rows slower than the baseline by more than threshold, as (key, baseline seconds, seconds)."""
+    with open(baseline_path, 'r') as fp:
+        baseline = {row_key(row): row for row in json.load(fp)}
+    regressions = []
+    for row in rows:
+        old = baseline.get(row_key(row))
+        if old and row['seconds'] > old['seconds'] * (1.0 + threshold):
+            regressions.append((row_key(row), old['seconds'], row['seconds']))
+    return regressions
+
+
+def format_row(row):
+    """One line of the results table."""
+    params = " ".join(f"{key}={value}" for key, value in row['params'].items())
+    extra = " ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                     for key, value in row.items() if key not in ('benchmark', 'params', 'seconds'))
+    return f"{row['benchmark']:<24} {params:<40} {row['seconds'] * 1000:10.2f} ms  {extra}"
+
+
+def main():
+    """Run the selected benchmarks and report, save or compare the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="Run the smallest size of every benchmark")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Baseline results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    rows = []
+    cwd = os.getcwd()
+    for name in args.only or BENCHMARKS:
+        with tempfile.TemporaryDirectory(prefix=f"ssx_bench_{name}_") as root:
+            saved_path = os.environ['PATH']
+            try:
+                for row in BENCHMARKS[name](root, args.quick):
+                    print(format_row(row), flush=True)
+                    rows.append(row)
+            finally:
+                os.chdir(cwd)
+                os.environ['PATH'] = saved_path
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(rows, fp, indent=2)
+    if args.compare:
+        regressions = compare(rows, args.compare, args.threshold)
+        for key, old, new in regressions:
+            print(f"REGRESSION {key}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""Stand-in for the DIALS/xia2/PRIME executables the SSX tools launch.
+
+The program to imitate is taken from the name this file is invoked under,
+so it is installed by symlinking it as xia2.ssx, xia2.ssx_reduce,
+dials.stills_process, prime and prime.run (see fixtures.make_bin). Each one
+takes the same arguments as the real program and writes the outputs the
+next stage reads, with no science behind them.
+
+Behaviour is set through the environment. Every variable can be given per
+program as SSX_STANDIN_<PROGRAM>_<SETTING>, e.g. SSX_STANDIN_XIA2_SSX_LATENCY,
+falling back to SSX_STANDIN_<SETTING>:
+    LATENCY      seconds to sleep (default: 0)
+    IMAGE_LATENCY  further seconds to sleep per image: for xia2.ssx each image in the image=
+                 master files, counted from their detectorSpecific/nimages (needs h5py), for
+                 dials.stills_process each image file given, for xia2.ssx_reduce each
+                 directory= or experiments= input (default: 0)
+    IMAGE_CPU    further seconds of CPU to burn per image, counted as for IMAGE_LATENCY (default: 0)
+    CPU          seconds of CPU to burn, split across the processes the program is told to use
+                 (nproc= for xia2.ssx, mp.nproc= for dials.stills_process; default: 0)
+    OUTPUT       bytes written to stdout (default: 0)
+    FAIL         exit with status 1 when set to 1 (default: 0)
+    HIT_RATE     fraction of images dials.stills_process integrates (default: 1.0)
+    PRIME_BINS, PRIME_CYCLES  shape of the PRIME logs written (default: 20 bins, 3 cycles)
+"""
+import glob
+import json
+import os
+import re
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from prime_logs import write_prime_log  # noqa: E402
+
+
+def setting(program, name, default):
+    """Read SSX_STANDIN_<PROGRAM>_<NAME>, then SSX_STANDIN_<NAME>."""
+    key = re.sub(r'[^A-Z0-9]', '_', program.upper())
+    value = os.environ.get(f"SSX_STANDIN_{key}_{name}", os.environ.get(f"SSX_STANDIN_{name}"))
+    return type(default)(value) if value is not None else default
+
+
+def burn_cpu(seconds, nproc=1):
+    """Spin for the given amount of CPU time, shared by nproc processes like a parallel program."""
+    if seconds <= 0:
+        return 0
+    children, worker = [], False
+    for _ in range(nproc - 1):
+        pid = os.fork()
+        if pid == 0:
+            worker = True
+            break
+        children.append(pid)
+    end = time.process_time() + seconds / nproc
+    x = 0
+    while time.process_time() < end:
+        for i in range(10000):
+            x += i * i
+    if worker:
+        os._exit(0)
+    for pid in children:
+        os.waitpid(pid, 0)
+    return x
+
+
+def requested_nproc(args):
+    """Process count the program was told to use, 1 if none."""
+    values = key_values(args, 'nproc') + key_values(args, 'mp.nproc')
+    return max(1, int(values[-1])) if values else 1
+
+
+def emit_output(n_bytes):
+    """Write n_bytes of log-like lines to stdout."""
+    line = b"standin: processing ...........................................................\n"
+    out = sys.stdout.buffer
+    while n_bytes > 0:
+        out.write(line[:n_bytes])
+        n_bytes -= len(line)
+    out.flush()
+
+
+def key_values(args, key):
+    """Values of 'key=value' arguments."""
+    return [arg.split('=', 1)[1] for arg in args if arg.startswith(f"{key}=")]
+
+
+def master_images(args):
+    """Images in the master files given as image= arguments, 0 for files h5py cannot read."""
+    import h5py
+    total = 0
+    for image in key_values(args, 'image'):
+        try:
+            with h5py.File(image, 'r') as h5:
+                total += int(h5['/entry/instrument/detector/detectorSpecific/nimages'][()])
+        except (OSError, KeyError):
+            pass
+    return total
+
+
+def image_count(program, args):
+    """Images the program was asked to process."""
+    if program == 'xia2.ssx':
+        return master_images(args)
+    if program == 'dials.stills_process':
+        return len([arg for arg in args[1:] if '=' not in arg])
+    if program == 'xia2.ssx_reduce':
+        return sum(len(values) for values in reduce_inputs(args).values())
+    return 0
+
+
+def phil_values(phil_path, key):
+    """Values of 'key = value' lines in a phil file."""
+    with open(phil_path, 'r') as fp:
+        return [m.group(1).strip() for m in re.finditer(rf'^\s*{key}\s*=\s*(.+)$', fp.read(), re.M)]
+
+
+def xia2_ssx(args):
+    """Write batch_1/ and geometry_refinement/refined.expt.
+
+    The refined detector origin moves by 1 mm / (KiB of image data refined on),
+    counting each master's <name>_data_*.h5 files, so the refinement converges
+    faster the more (or the more informative) images it is given.
+    """
+    images = key_values(args, 'image')
+    data_kib = sum(os.path.getsize(path) for image in images
+                   for path in glob.glob(image.replace('_master.h5', '_data_*.h5'))) / 1024
+    os.makedirs('batch_1', exist_ok=True)
+    os.makedirs('geometry_refinement', exist_ok=True)
+    for name in ('integrated_1.expt', 'integrated_1.refl'):
+        with open(os.path.join('batch_1', name), 'w') as fp:
+            fp.write(json.dumps({'images': images}))
+    z = -200.0 + 1.0 / max(data_kib, 1.0)
+    with open(os.path.join('geometry_refinement', 'refined.expt'), 'w') as fp:
+        json.dump({'detector': [{'panels': [{'origin': [0.0, 0.0, z]}]}],
+                   'beam': [{'direction': [0.0, 0.0, 1.0], 'wavelength': 0.979}]}, fp)
+
+
+def reduce_inputs(args):
+    """directory= and experiments= inputs of xia2.ssx_reduce, from the command line and any .phil file given."""
+    inputs = {key: key_values(args, key) for key in ('directory', 'experiments')}
+    for phil in [arg for arg in args if arg.endswith('.phil') and '=' not in arg]:
+        for key in inputs:
+            inputs[key] += phil_values(phil, key)
+    return inputs
+
+
+def xia2_ssx_reduce(args):
+    """Write DataFiles/scaled.expt, scaled.refl and merged.mtz, sized by the number of batches merged.
+
+    Batches are counted one per directory= input plus those recorded in each
+    experiments= input, so partial merges can be combined hierarchically.
+    """
+    inputs = reduce_inputs(args)
+    n_batches = len(inputs['directory'])
+    for path in inputs['experiments']:
+        with open(path, 'r') as fp:
+            n_batches += json.load(fp)['n_batches']
+    os.makedirs('DataFiles', exist_ok=True)
+    with open(os.path.join('DataFiles', 'scaled.expt'), 'w') as fp:
+        json.dump({'n_batches': n_batches}, fp)
+    open(os.path.join('DataFiles', 'scaled.refl'), 'wb').close()
+    with open(os.path.join('DataFiles', 'merged.mtz'), 'wb') as fp:
+        fp.write(b'\0' * 1024 * n_batches)
+
+
+def dials_stills_process(args):
+    """Write an int-<n>-<image>.pickle into the current directory for each integrated image."""
+    hit_rate = setting('dials.stills_process', 'HIT_RATE', 1.0)
+    for image in [arg for arg in args[1:] if '=' not in arg]:
+        stem = os.path.splitext(os.path.basename(image))[0]
+        # Deterministic hits, so reruns on the same images integrate the same frames
+        if zlib.crc32(stem.encode()) % 1000 < hit_rate * 1000:
+            with open(f"int-0-{stem}.pickle", 'wb') as fp:
+                fp.write(b'\0' * 256)
+
+
+def _write_log(program, path, n_frames):
+    write_prime_log(path, n_frames=max(n_frames, 1),
+                    n_bins=setting(program, 'PRIME_BINS', 20),
+                    n_cycles=setting(program, 'PRIME_CYCLES', 3))
+
+
+def prime(args):
+    """Write the PRIME log named by the phil's output.log, with frames from its input directories."""
+    phil = args[0]
+    n_frames = 100 * len(phil_values(phil, 'directory'))
+    log = (phil_values(phil, 'log') or ['prime.log'])[0]
+    _write_log('prime', log, n_frames)
+
+
+def prime_run(args):
+    """Write <run_no>/log.txt with as many frames as the int list named by the phil's data."""
+    phil = args[0]
+    run_no = phil_values(phil, 'run_no')[0]
+    with open(phil_values(phil, 'data')[0], 'r') as fp:
+        n_frames = sum(1 for line in fp if line.strip())
+    os.makedirs(run_no, exist_ok=True)
+    _write_log('prime.run', os.path.join(run_no, 'log.txt'), n_frames)
+
+
+PROGRAMS = {
+    'xia2.ssx': xia2_ssx,
+    'xia2.ssx_reduce': xia2_ssx_reduce,
+    'dials.stills_process': dials_stills_process,
+    'prime': prime,
+    'prime.run': prime_run,
+}
+
+
+def main():
+    """Imitate the program this file was invoked as."""
+    program = os.path.basename(sys.argv[0])
+    if program not in PROGRAMS:
+        sys.exit(f"standin: unknown program {program!r}, expected one of {sorted(PROGRAMS)}")
+    args = sys.argv[1:]
+    # --phil takes its value as the next argument; drop both
+    while '--phil' in args:
+        i = args.index('--phil')
+        del args[i:i + 2]
+
+    image_latency = setting(program, 'IMAGE_LATENCY', 0.0)
+    image_cpu = setting(program, 'IMAGE_CPU', 0.0)
+    n_images = image_count(program, args) if image_latency or image_cpu else 0
+    time.sleep(setting(program, 'LATENCY', 0.0) + image_latency * n_images)
+    burn_cpu(setting(program, 'CPU', 0.0) + image_cpu * n_images, requested_nproc(args))
+    emit_output(setting(program, 'OUTPUT', 0))
+    if setting(program, 'FAIL', 0):
+        sys.exit(1)
+    PROGRAMS[program](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,9 @@
 
 ##Basic Python import's
 import argparse
+import os
 from pprint import pprint
+from typing import Any, Dict
 ##Base Gladier imports
 from gladier import GladierBaseClient, generate_flow_definition
 
@@ -14,6 +16,10 @@ from .tools.run_refined_proc import RunRefinedProc
 from .tools.merge_all import MergeAll
 from .tools.run_prime import RunPrime
 from .tools.primalisys import Primalisys 
+from .tools.primalisys_batch import primalisys_batch
+from gladier_ssx.local_executor import run_local
+from gladier_ssx.metrics import collect_metrics, summarize_metrics
+from gladier_ssx.tracing import write_chrome_trace
 
 
 ##Generate flow based on the collection of `gladier_tools`
@@ -29,21 +35,34 @@ class SSXClient(GladierBaseClient):
         Primalisys,
     ]
 
+    def metrics_summary(self, action_id: str) -> Dict[str, Dict[str, Any]]:
+        """Aggregate the resource usage recorded by every tool of a flow run.
 
-## Main client
-def run_flow(event: str) -> None:
-    """Run the SSX processing flow.
-    
-    Args:
-        event: Event string (currently unused, kept for compatibility)
-    """
-    ##The first step Client instance
-    ssxClient = SSXClient()
-    print("Flow created with ID: " + ssxClient.get_flow_id())
-    print("https://app.globus.org/flows/" + ssxClient.get_flow_id())
-    print("")
+        Args:
+            action_id: ID of the flow run
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Wall, user and system time, peak RSS and I/O bytes
+            per stage (run_initial_proc, run_refined_proc, merge_all, ...) plus a 'total' entry
+        """
+        return summarize_metrics(collect_metrics(self.get_status(action_id)))
+
+    def export_trace(self, action_id: str, path: str) -> str:
+        """Write the timeline of a flow run as a Chrome trace, viewable in chrome://tracing or Perfetto.
+
+        Args:
+            action_id: ID of the flow run
+            path: Output path of the trace JSON
 
-    ## Flow inputs necessary for each tool on the flow definition.
+        Returns:
+            str: The path written
+        """
+        return write_chrome_trace(self.get_status(action_id), path)
+
+
+## Flow inputs necessary for each tool on the flow definition.
+def build_flow_input(args: argparse.Namespace) -> Dict[str, Any]:
+    """Build the flow input from the command line arguments."""
     flow_input = {
         "input": {
             # Transfer variables
@@ -55,6 +74,7 @@ def run_flow(event: str) -> None:
             
             # SSX Processing parameters
             "data_dir": args.data_dir,
+            "run_num": args.run_num,
             
             # Processing parameters
             "n_files": 2,
@@ -70,6 +90,23 @@ def run_flow(event: str) -> None:
             "compute_endpoint": args.compute_endpoint,
         }
     }
+    return flow_input
+
+
+## Main client
+def run_flow(event: str) -> None:
+    """Run the SSX processing flow.
+    
+    Args:
+        event: Event string (currently unused, kept for compatibility)
+    """
+    ##The first step Client instance
+    ssxClient = SSXClient()
+    print("Flow created with ID: " + ssxClient.get_flow_id())
+    print("https://app.globus.org/flows/" + ssxClient.get_flow_id())
+    print("")
+
+    flow_input = build_flow_input(args)
     print("Created payload.")
     pprint(flow_input)
     print("")
@@ -84,6 +121,31 @@ def run_flow(event: str) -> None:
     print("https://app.globus.org/runs/" + flow_run["action_id"])
 
 
+## Per-stage inputs of a local run, for keys the stages read differently or the flow leaves out.
+## primalisys changes into upload_dir before opening prime_input.
+LOCAL_STAGE_INPUT = {
+    'create_phil': {'proc_dir': 'proc'},
+    'merge_all': {'output_dir': 'final_merge'},
+    'run_prime': {'output_dir': 'prime_results'},
+    'primalisys': {'prime_dir': 'prime_results', 'upload_dir': 'prime_results',
+                   'prime_input': 'prime.log', 'plot': 'none'},
+}
+
+
+def run_flow_locally(args: argparse.Namespace) -> None:
+    """Run the SSX tool chain on this host, overlapping independent stages.
+
+    Stages start in the data directory. The per-stage resource summary is printed
+    and the timeline is written to local.trace.json in the current directory.
+    """
+    flow_input = build_flow_input(args)["input"]
+    flow_input["data_dir"] = os.path.abspath(args.data_dir)
+    results = run_local(SSXClient.gladier_tools, flow_input, max_workers=args.workers,
+                        stage_input=LOCAL_STAGE_INPUT, cwd=args.data_dir)
+    pprint(summarize_metrics(collect_metrics(results)))
+    print(write_chrome_trace(results, "local.trace.json"))
+
+
 ##  Arguments for the execution of this file as a stand-alone client
 def arg_parse() -> argparse.Namespace:
     """Parse command line arguments.
@@ -93,11 +155,27 @@ def arg_parse() -> argparse.Namespace:
     """
     parser = argparse.ArgumentParser(description="Gladier SSX Processing Client")
     parser.add_argument("--data-dir", help="Path to data directory", default="/path/to/data")
+    parser.add_argument("--run-num", type=int, help="Run number of the beamline JSON the phil is made from", default=1)
     parser.add_argument("--compute-endpoint", help="FuncX compute endpoint", default="4b116d3c-1703-4f8f-9f6f-39921e5864df")
+    parser.add_argument("--metrics", help="Print the per-stage resource summary of a finished flow run", metavar="RUN_ID")
+    parser.add_argument("--trace", help="Write the Chrome trace of a flow run to RUN_ID.trace.json", metavar="RUN_ID")
+    parser.add_argument("--primalisys-batch", help="Analyze every <chip>_<N>_prime run under PRIME_ROOT locally "
+                        "and write primalysis_batch.json/.csv to the current directory", metavar="PRIME_ROOT")
+    parser.add_argument("--local", action="store_true", help="Run the tool chain on this host instead of as a Globus flow")
+    parser.add_argument("--workers", type=int, help="Process pool size for --local and --primalisys-batch")
     return parser.parse_args()
 
 
 ## Main execution of this "file" as a Standalone client
 if __name__ == "__main__":
     args = arg_parse()
-    run_flow(args.name)
+    if args.metrics:
+        pprint(SSXClient().metrics_summary(args.metrics))
+    elif args.trace:
+        print(SSXClient().export_trace(args.trace, f"{args.trace}.trace.json"))
+    elif args.primalisys_batch:
+        primalisys_batch(prime_root=args.primalisys_batch, upload_dir='.', workers=args.workers)
+    elif args.local:
+        run_flow_locally(args)
+    else:
+        run_flow(args.name)
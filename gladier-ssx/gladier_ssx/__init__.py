@@ -0,0 +1,7 @@
+"""Helpers shared by the SSX tools.
+
+The tool functions in tools/ are shipped to the compute endpoint by source, so
+everything they use beyond the standard library is imported from this package,
+by absolute name, inside the function body. It must be installed wherever the
+tools run.
+"""
@@ -0,0 +1,267 @@
+"""On-disk catalog of raw inputs and per-stage outputs, built with os.scandir.
+
+On network and parallel filesystems (Lustre, NFS, GPFS, ...), where every
+listing is a round trip to a metadata server, directory listings are kept in
+a small SQLite index together with each directory's mtime. A directory is
+only rescanned when its mtime changes, i.e. when entries were added, removed
+or renamed, so repeated discovery of master files in a large raster costs one
+stat instead of a full listing. Those filesystems may store mtimes with one
+second granularity, so, as git does for racily clean files, a listing taken
+less than racy_window seconds after the directory's mtime is not trusted and
+the directory is scanned again. On local disks a plain os.scandir is faster
+than the index and is used instead. Master file metadata is cached in the
+index either way, keyed by the file's size and mtime.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import contextlib
+import fnmatch
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from .master_metadata import read_master_metadata
+
+CATALOG_NAME = '.ssx_catalog.sqlite'
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    scanned_ns INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entries (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    PRIMARY KEY (dir, name)
+);
+CREATE TABLE IF NOT EXISTS master_metadata (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+);
+"""
+
+
+# Filesystems whose listings are cached, as named in /proc/mounts
+NETWORK_FILESYSTEMS = ('lustre', 'nfs', 'nfs4', 'gpfs', 'beegfs', 'cifs', 'smb3', 'ceph', 'panfs', 'fuse.sshfs')
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Type of the filesystem holding path, from the longest matching mount point in /proc/mounts."""
+    path = os.path.realpath(path)
+    best, fs_type = '', None
+    try:
+        with open('/proc/mounts', 'r') as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+                if inside and len(mount_point) >= len(best):
+                    best, fs_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return fs_type
+
+
+class RunCatalog:
+    """Incrementally updated index of directory listings.
+
+    Paths passed in may be relative to the current directory; results are
+    returned joined onto the directory exactly as given, like glob.glob.
+
+    Args:
+        index_path: Path of the SQLite index
+        cache_listings: Keep directory listings in the index (default: only when the
+            index is on one of NETWORK_FILESYSTEMS)
+        racy_window: Seconds after a directory's mtime during which a listing of it is
+            not trusted, covering the mtime granularity of the filesystem (default: 2)
+    """
+
+    def __init__(self, index_path: str = CATALOG_NAME, cache_listings: Optional[bool] = None,
+                 racy_window: float = 2.0):
+        self.index_path = index_path
+        if cache_listings is None:
+            cache_listings = filesystem_type(os.path.dirname(os.path.abspath(index_path))) in NETWORK_FILESYSTEMS
+        self.cache_listings = cache_listings
+        self.racy_window_ns = int(racy_window * 1e9)
+        self._db = sqlite3.connect(index_path, timeout=30)
+        self._db.executescript(_SCHEMA)
+        try:
+            # Indexes written before listings recorded their scan time are rescanned once
+            self._db.execute("ALTER TABLE dirs ADD COLUMN scanned_ns INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        self._depth = 0
+
+    def close(self) -> None:
+        """Close the index database."""
+        self._db.close()
+
+    def __enter__(self) -> 'RunCatalog':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Group index writes; nested blocks commit once, when the outermost one ends.
+
+        Refreshing many directories under one commit avoids a journal sync per directory.
+        """
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            if self._depth == 1:
+                self._db.rollback()
+            raise
+        finally:
+            self._depth -= 1
+        if self._depth == 0:
+            self._db.commit()
+
+    def refresh(self, directory: str) -> Optional[str]:
+        """Bring the index for one directory up to date.
+
+        Returns:
+            Optional[str]: The directory's index key, or None if it does not exist
+        """
+        return self._refresh(os.path.realpath(directory))
+
+    def _refresh(self, key: str) -> Optional[str]:
+        """refresh() for an already resolved index key."""
+        try:
+            # Stat before listing so a change made during the scan forces a rescan next time
+            mtime_ns = os.stat(key).st_mtime_ns
+        except FileNotFoundError:
+            with self._transaction():
+                self._db.execute("DELETE FROM entries WHERE dir = ?", (key,))
+                self._db.execute("DELETE FROM dirs WHERE path = ?", (key,))
+            return None
+
+        row = self._db.execute("SELECT mtime_ns, scanned_ns FROM dirs WHERE path = ?", (key,)).fetchone()
+        # A listing made within racy_window of the mtime could have missed an entry added
+        # in the same mtime tick after the scan, so only older listings are trusted
+        if row is not None and row[0] == mtime_ns and row[1] - mtime_ns >= self.racy_window_ns:
+            return key
+
+        scanned_ns = time.time_ns()
+        with os.scandir(key) as it:
+            rows = [(key, entry.name, int(entry.is_dir())) for entry in it]
+        with self._transaction():
+            self._db.execute("DELETE FROM entries WHERE dir = ?", (key,))
+            self._db.executemany("INSERT INTO entries (dir, name, is_dir) VALUES (?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO dirs (path, mtime_ns, scanned_ns) VALUES (?, ?, ?)",
+                             (key, mtime_ns, scanned_ns))
+        return key
+
+    def listdir(self, directory: str) -> List[Tuple[str, bool]]:
+        """Return (name, is_dir) pairs for a directory, sorted by name."""
+        if not self.cache_listings:
+            try:
+                with os.scandir(directory) as it:
+                    return sorted((entry.name, entry.is_dir()) for entry in it)
+            except FileNotFoundError:
+                return []
+        key = self.refresh(directory)
+        if key is None:
+            return []
+        rows = self._db.execute(
+            "SELECT name, is_dir FROM entries WHERE dir = ? ORDER BY name", (key,)
+        ).fetchall()
+        return [(name, bool(is_dir)) for name, is_dir in rows]
+
+    def glob(self, directory: str, pattern: str) -> List[str]:
+        """Sorted paths in directory whose names match a glob pattern.
+
+        Like glob.glob, names starting with '.' only match patterns that do too.
+        """
+        if not self.cache_listings:
+            names = [name for name, _ in self.listdir(directory) if fnmatch.fnmatchcase(name, pattern)]
+        else:
+            key = self.refresh(directory)
+            if key is None:
+                return []
+            names = [name for (name,) in self._db.execute(
+                "SELECT name FROM entries WHERE dir = ? AND name GLOB ? ORDER BY name", (key, pattern)
+            ).fetchall()]
+        return [os.path.join(directory, name) for name in names
+                if pattern.startswith('.') or not name.startswith('.')]
+
+    def subdirs(self, directory: str) -> List[str]:
+        """Sorted names of the subdirectories of a directory."""
+        return [name for name, is_dir in self.listdir(directory) if is_dir]
+
+    def master_metadata(self, master_files: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Metadata of master files (see master_metadata.read_master_metadata), read once per file version.
+
+        Only successful reads are cached; unreadable files, or any file while h5py is
+        missing, map to None and are tried again next time.
+        """
+        results: Dict[str, Optional[Dict[str, Any]]] = {}
+        with self._transaction():
+            for master_file in master_files:
+                key = os.path.realpath(master_file)
+                try:
+                    st = os.stat(key)
+                except FileNotFoundError:
+                    results[master_file] = None
+                    continue
+                row = self._db.execute(
+                    "SELECT size, mtime_ns, metadata FROM master_metadata WHERE path = ?", (key,)
+                ).fetchone()
+                if row is not None and row[:2] == (st.st_size, st.st_mtime_ns):
+                    results[master_file] = json.loads(row[2])
+                    continue
+                metadata = read_master_metadata(key)
+                if metadata is not None:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO master_metadata (path, size, mtime_ns, metadata) VALUES (?, ?, ?, ?)",
+                        (key, st.st_size, st.st_mtime_ns, json.dumps(metadata)),
+                    )
+                results[master_file] = metadata
+        return results
+
+    def first_master(self, data_dir: str) -> Optional[str]:
+        """The first *_master.h5 of data_dir, else of data_dir/raster, whose metadata supplies geometry defaults."""
+        masters = self.glob(data_dir, '*_master.h5') or self.glob(os.path.join(data_dir, 'raster'), '*_master.h5')
+        return masters[0] if masters else None
+
+    def batch_dirs(self, refined_dir: str, batch: str = 'batch_1') -> List[str]:
+        """Sorted <refined_dir>/<run>/<batch> directories that exist.
+
+        Checking <run>/<batch> directly costs the same one metadata operation per run
+        as checking that the run directory is unchanged, so only refined_dir's listing
+        goes through the index.
+        """
+        return [os.path.join(refined_dir, run_dir, batch) for run_dir in self.subdirs(refined_dir)
+                if os.path.isdir(os.path.join(refined_dir, run_dir, batch))]
+
+
+def open_catalog(index_path: Optional[str] = None, root: str = '.',
+                 cache_listings: Optional[bool] = None) -> RunCatalog:
+    """Open the run catalog, by default <root>/.ssx_catalog.sqlite; see RunCatalog for cache_listings.
+
+    An index that cannot be opened or written, e.g. one in a read-only data directory,
+    is treated as no catalog: an in-memory one is returned instead, which lists
+    directories directly and keeps nothing once closed.
+    """
+    index_path = index_path or os.path.join(root, CATALOG_NAME)
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    try:
+        if not os.access(index_dir, os.W_OK) or (os.path.exists(index_path)
+                                                 and not os.access(index_path, os.W_OK)):
+            raise OSError(f"{index_path} is not writable")
+        return RunCatalog(index_path, cache_listings)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Not using the run catalog at %s: %s", index_path, e)
+        return RunCatalog(':memory:', cache_listings=False)
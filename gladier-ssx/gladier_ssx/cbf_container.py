@@ -0,0 +1,176 @@
+"""HDF5 containers holding batches of CBF stills byte for byte."""
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import hashlib
+import os
+import re
+
+# Frame numbers are the trailing digits of <chip>_<run>_NNNNN.cbf
+FRAME_RE = re.compile(r'_(\d+)\.cbf$')
+GROUP = 'cbf'
+
+
+def frame_number(path: str) -> int:
+    """Frame number of a <chip>_<run>_NNNNN.cbf file."""
+    match = FRAME_RE.search(path)
+    if not match:
+        raise RuntimeError(f"No frame number in {path}")
+    return int(match.group(1))
+
+
+def write_container(paths: Sequence[str], container: str, chunk_bytes: int = 1 << 20,
+                    compression: Optional[str] = 'gzip', compression_level: int = 1,
+                    attrs: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """Stream CBF files into one HDF5 container, keeping each file's bytes unchanged.
+
+    The files are concatenated into the chunked, compressed uint8 dataset
+    /cbf/data, with /cbf/frame_number, /cbf/offset and /cbf/size indexing
+    every file, /cbf/name holding its original name and /cbf/sha256 the
+    digest of its bytes, for verify_container. Files are read one
+    at a time and appended, so memory use stays at about one chunk. The
+    container is written next to its final path and renamed into place.
+
+    Args:
+        paths: CBF files, e.g. one stills batch
+        container: Path of the container to write
+        chunk_bytes: HDF5 chunk size of /cbf/data
+        compression: h5py compression filter ('gzip', 'lzf' or None)
+        compression_level: gzip level; byte-offset data gains little from levels above 1
+        attrs: Optional attributes stored on /cbf, such as chip_name and run_num
+
+    Returns:
+        Dict[str, int]: 'frames', 'bytes_in' read from the CBFs and 'bytes_out' of the container
+    """
+    import h5py
+    import numpy as np
+
+    paths = sorted(paths, key=frame_number)
+    tmp_path = f"{container}.{os.getpid()}.tmp"
+    offsets, sizes, digests, bytes_in = [], [], [], 0
+    with h5py.File(tmp_path, 'w') as h5:
+        group = h5.create_group(GROUP)
+        group.attrs.update(attrs or {})
+        dataset = group.create_dataset('data', shape=(0,), maxshape=(None,), dtype=np.uint8,
+                                       chunks=(chunk_bytes,), compression=compression,
+                                       compression_opts=compression_level if compression == 'gzip' else None)
+        buffer, buffered = [], 0
+        for path in paths:
+            with open(path, 'rb') as fp:
+                content = fp.read()
+            offsets.append(bytes_in + buffered)
+            sizes.append(len(content))
+            digests.append(hashlib.sha256(content).digest())
+            buffer.append(content)
+            buffered += len(content)
+            if buffered >= chunk_bytes:
+                dataset.resize((bytes_in + buffered,))
+                dataset[bytes_in:] = np.frombuffer(b''.join(buffer), dtype=np.uint8)
+                bytes_in += buffered
+                buffer, buffered = [], 0
+        if buffered:
+            dataset.resize((bytes_in + buffered,))
+            dataset[bytes_in:] = np.frombuffer(b''.join(buffer), dtype=np.uint8)
+            bytes_in += buffered
+        group['frame_number'] = np.array([frame_number(path) for path in paths], dtype=np.int64)
+        group['offset'] = np.array(offsets, dtype=np.int64)
+        group['size'] = np.array(sizes, dtype=np.int64)
+        group['name'] = [os.path.basename(path).encode() for path in paths]
+        group['sha256'] = np.frombuffer(b''.join(digests), dtype=np.uint8).reshape(len(paths), 32)
+    os.replace(tmp_path, container)
+    return {'frames': len(paths), 'bytes_in': bytes_in, 'bytes_out': os.path.getsize(container)}
+
+
+def container_frames(container: str) -> List[int]:
+    """Frame numbers held in a container, in storage order."""
+    import h5py
+    with h5py.File(container, 'r') as h5:
+        return h5[GROUP]['frame_number'][()].tolist()
+
+
+def read_frames(container: str, frames: Optional[Sequence[int]] = None,
+                block_bytes: int = 64 << 20) -> Iterator[Tuple[str, memoryview]]:
+    """Yield (original name, CBF bytes) of the requested frames, or of every frame, in storage order.
+
+    Frames are stored in frame order, so neighbouring requested frames are read
+    together, in blocks of up to block_bytes, straight into one buffer. The bytes
+    yielded are views into that buffer, valid until the next block is read.
+
+    Raises:
+        RuntimeError: If a requested frame is not in the container
+    """
+    import h5py
+    import numpy as np
+
+    with h5py.File(container, 'r') as h5:
+        group = h5[GROUP]
+        numbers = group['frame_number'][()]
+        wanted = np.arange(len(numbers)) if frames is None else np.searchsorted(numbers, frames)
+        if frames is not None:
+            missing = [frame for frame, i in zip(frames, wanted) if i >= len(numbers) or numbers[i] != frame]
+            if missing:
+                raise RuntimeError(f"Frames {missing} are not in {container}")
+        offsets, sizes, names = group['offset'][()], group['size'][()], group['name'][()]
+        dataset = group['data']
+        buffer = np.empty(0, dtype=np.uint8)
+        wanted = np.sort(wanted).tolist()
+        while wanted:
+            # Take frames while the block from the first one's offset stays under block_bytes
+            start = int(offsets[wanted[0]])
+            n = 1
+            while n < len(wanted) and offsets[wanted[n]] + sizes[wanted[n]] - start <= block_bytes:
+                n += 1
+            block, wanted = wanted[:n], wanted[n:]
+            end = int(offsets[block[-1]] + sizes[block[-1]])
+            if len(buffer) < end - start:
+                buffer = np.empty(end - start, dtype=np.uint8)
+            dataset.read_direct(buffer, np.s_[start:end], np.s_[0:end - start])
+            view = memoryview(buffer)
+            for i in block:
+                offset = int(offsets[i]) - start
+                yield names[i].decode(), view[offset:offset + int(sizes[i])]
+
+
+def verify_container(container: str, paths: Sequence[str]) -> None:
+    """Check that a container holds exactly the given CBF files, byte for byte.
+
+    The container is reopened and every frame read back and decompressed. Its
+    frame numbers, names and sizes must match the files, and the sha256 of the
+    bytes read back must match both the digest stored when the container was
+    written and the digest of the file on disk.
+
+    Raises:
+        RuntimeError: On the first mismatch
+    """
+    import h5py
+
+    expected = {os.path.basename(path): path for path in paths}
+    with h5py.File(container, 'r') as h5:
+        group = h5[GROUP]
+        if 'sha256' not in group:
+            raise RuntimeError(f"{container} has no frame checksums")
+        stored = {name.decode(): bytes(digest) for name, digest in zip(group['name'][()], group['sha256'][()])}
+    if sorted(stored) != sorted(expected):
+        raise RuntimeError(f"{container} holds {len(stored)} frames, expected {len(expected)}")
+    for name, content in read_frames(container):
+        path = expected[name]
+        digest = hashlib.sha256(content).digest()
+        if digest != stored[name]:
+            raise RuntimeError(f"Frame {name} in {container} does not match its stored checksum")
+        with open(path, 'rb') as fp:
+            if hashlib.sha256(fp.read()).digest() != digest:
+                raise RuntimeError(f"Frame {name} in {container} differs from {path}")
+
+
+def extract_frames(container: str, frames: Optional[Sequence[int]], dest_dir: str) -> List[str]:
+    """Write the requested frames back out as CBF files in dest_dir, e.g. on node-local disk.
+
+    Returns:
+        List[str]: Paths of the written files, in frame order
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    paths = []
+    for name, content in read_frames(container, frames):
+        path = os.path.join(dest_dir, name)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        paths.append(path)
+    return paths
@@ -0,0 +1,71 @@
+"""Captured DIALS environment, cached on disk against the setup script's mtime."""
+from typing import Dict, Optional
+import hashlib
+import json
+import os
+import subprocess
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gladier-ssx')
+
+
+def _capture_environment(setup_script: str) -> Dict[str, str]:
+    """Source a setup script in bash once and return the resulting environment."""
+    result = subprocess.run(
+        ['/bin/bash', '-c', f'source "{setup_script}" > /dev/null 2>&1 && env -0'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to source {setup_script}: {result.stderr.decode(errors='replace')}")
+
+    env = {}
+    for entry in result.stdout.split(b'\0'):
+        if not entry:
+            continue
+        key, _, value = entry.decode(errors='surrogateescape').partition('=')
+        env[key] = value
+    # Shell bookkeeping that should not leak into the children we launch
+    for key in ('_', 'SHLVL', 'PWD', 'OLDPWD'):
+        env.pop(key, None)
+    return env
+
+
+def dials_environment(dials_path: str = '/dials', cache_dir: Optional[str] = None) -> Dict[str, str]:
+    """Return the environment produced by `source {dials_path}/dials`.
+
+    The environment is captured once and saved as JSON in cache_dir, keyed by
+    the setup script path. The cache entry is reused for as long as the
+    script's mtime and size are unchanged, so tools can launch DIALS programs
+    directly with shell=False instead of re-sourcing the script every call.
+
+    Args:
+        dials_path: Path to the dials installation (default: '/dials')
+        cache_dir: Directory holding the cached environments (default: ~/.cache/gladier-ssx)
+
+    Returns:
+        Dict[str, str]: Environment variables suitable for subprocess env=
+    """
+    setup_script = os.path.abspath(os.path.join(dials_path, 'dials'))
+    st = os.stat(setup_script)
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    key = hashlib.sha256(setup_script.encode()).hexdigest()[:16]
+    cache_file = os.path.join(cache_dir, f"dials_env_{key}.json")
+
+    try:
+        with open(cache_file, 'r') as fp:
+            cached = json.load(fp)
+        if (cached.get('script') == setup_script and cached.get('mtime_ns') == st.st_mtime_ns
+                and cached.get('size') == st.st_size):
+            return cached['env']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    env = _capture_environment(setup_script)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as fp:
+        json.dump({'script': setup_script, 'mtime_ns': st.st_mtime_ns,
+                   'size': st.st_size, 'env': env}, fp)
+    os.replace(tmp_file, cache_file)
+    return env
@@ -0,0 +1,166 @@
+"""Local registry of refined geometries keyed by detector distance, energy and beam centre.
+
+Registered files are copied into <registry dir>/geometries/ under their sha256,
+so a refined.expt that a later run rewrites or repoints does not change what
+an entry refers to, and an entry whose copy no longer matches its digest is
+never returned.
+"""
+from typing import Any, Dict, Optional
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_REGISTRY = os.path.join(os.path.expanduser('~'), '.cache', 'gladier-ssx', 'geometry_registry.json')
+
+# Photon energy in keV times wavelength in Angstrom
+HC_KEV_ANGSTROM = 12.398419843320026
+
+DEFAULT_TOLERANCES = {
+    'det_distance': 0.5,
+    'energy': 0.005,
+    'beamx': 0.2,
+    'beamy': 0.2,
+}
+
+
+def read_beamline_geometry(data_dir: str, run_num: Any, metadata: Optional[Dict[str, Any]] = None,
+                           beamx: Optional[float] = None, beamy: Optional[float] = None) -> Optional[Dict[str, float]]:
+    """The geometry create_phil writes into the phil of a run, as a registry key.
+
+    det_distance and energy come from beamline_run<run_num>.json, falling back to
+    the detector distance and wavelength of the master file metadata. The beam
+    centre comes from xy.json, else from beamx and beamy, else from the master
+    file, else the hard-coded -214.4, 218.2.
+
+    Args:
+        data_dir: Directory holding beamline_run<run_num>.json and xy.json
+        run_num: Beamline run number
+        metadata: Optional metadata of the run's first master file (see RunCatalog.first_master)
+        beamx: Optional beam x position given to create_phil
+        beamy: Optional beam y position given to create_phil
+
+    Returns:
+        Optional[Dict[str, float]]: The geometry, or None if the beamline JSON is missing or
+        the distance or energy is known from neither source
+    """
+    from .master_metadata import panel_origin
+
+    origin = (panel_origin(metadata) if metadata else None) or {}
+    try:
+        with open(os.path.join(data_dir, f"beamline_run{run_num}.json"), 'r') as fp:
+            beamline_input = json.load(fp)['beamline_input']
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        det_distance = float(beamline_input['det_distance'])
+    except (KeyError, TypeError, ValueError):
+        if 'det_distance' not in origin:
+            return None
+        det_distance = -origin['det_distance']
+    try:
+        energy = float(beamline_input['energy'])
+    except (KeyError, TypeError, ValueError):
+        if not (metadata or {}).get('wavelength'):
+            return None
+        energy = round(HC_KEV_ANGSTROM / metadata['wavelength'], 4)
+    geometry = {'det_distance': det_distance, 'energy': energy}
+
+    beamx = beamx if beamx is not None else origin.get('beamx', -214.400)
+    beamy = beamy if beamy is not None else origin.get('beamy', 218.200)
+    try:
+        with open(os.path.join(data_dir, 'xy.json'), 'r') as fp:
+            xy_data = json.load(fp)
+        beamx, beamy = xy_data['beamx'], xy_data['beamy']
+    except (OSError, ValueError, KeyError):
+        pass
+    geometry['beamx'] = float(beamx)
+    geometry['beamy'] = float(beamy)
+    return geometry
+
+
+@contextlib.contextmanager
+def _locked_registry(registry_path: str):
+    """Yield the registry entries under an exclusive lock, saving them afterwards."""
+    os.makedirs(os.path.dirname(os.path.abspath(registry_path)), exist_ok=True)
+    with open(f"{registry_path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = load_registry(registry_path)
+            yield entries
+            tmp_path = f"{registry_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as fp:
+                json.dump(entries, fp, indent=2)
+            os.replace(tmp_path, registry_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_registry(registry_path: str = DEFAULT_REGISTRY) -> list:
+    """Return all registered geometries, or an empty list if there is no registry yet."""
+    try:
+        with open(registry_path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return []
+
+
+def _sha256(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def find_geometry(geometry: Dict[str, float], registry_path: str = DEFAULT_REGISTRY,
+                  tolerances: Optional[Dict[str, float]] = None) -> Optional[str]:
+    """Return the closest registered refined geometry within tolerance, if any.
+
+    Entries whose stored copy is missing or no longer matches its sha256, and
+    entries made before copies were kept, are ignored. Among matches the one
+    with the smallest tolerance-normalised distance wins, newest first on ties.
+    """
+    tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+    matches = []
+    for entry in load_registry(registry_path):
+        try:
+            deltas = [abs(entry[k] - geometry[k]) / tolerances[k] for k in tolerances]
+        except (KeyError, TypeError):
+            continue
+        if max(deltas) <= 1.0 and entry.get('sha256') and entry.get('path'):
+            matches.append(((sum(d * d for d in deltas), -entry.get('registered', 0)), entry))
+    for _, entry in sorted(matches, key=lambda match: match[0]):
+        if _sha256(entry['path']) == entry['sha256']:
+            return entry['path']
+    return None
+
+
+def register_geometry(geometry: Dict[str, float], path: str,
+                      registry_path: str = DEFAULT_REGISTRY) -> str:
+    """Copy a refined geometry file into the registry and record it for later reuse.
+
+    The copy is named after its sha256, so registering the same content twice
+    replaces the earlier entry rather than adding one.
+
+    Returns:
+        str: Path of the registered copy
+    """
+    with open(path, 'rb') as fp:
+        content = fp.read()
+    digest = hashlib.sha256(content).hexdigest()
+    store = os.path.join(os.path.dirname(os.path.abspath(registry_path)), 'geometries')
+    os.makedirs(store, exist_ok=True)
+    stored = os.path.join(store, f"{digest}{os.path.splitext(path)[1]}")
+    if _sha256(stored) != digest:
+        tmp_path = f"{stored}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as fp:
+            fp.write(content)
+        os.replace(tmp_path, stored)
+    with _locked_registry(registry_path) as entries:
+        entries[:] = [entry for entry in entries if entry.get('sha256') != digest]
+        entries.append(dict(geometry, path=stored, sha256=digest, source=os.path.abspath(path),
+                            registered=time.time()))
+    return stored
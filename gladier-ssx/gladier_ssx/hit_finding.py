@@ -0,0 +1,300 @@
+"""Hit-finding prefilter that drops blank CBF frames before dials.stills_process.
+
+Frames are decoded with a NumPy implementation of the CBF byte-offset
+compression and scored by their spot pixels: unmasked pixels more than
+sigma_strong Poisson standard deviations above the frame's median that have a
+strong neighbour. A frame with at least min_strong_pixels of them counts as a
+hit. This is a deliberately loose version of the spot finder's threshold, run
+on the whole frame at once, so it keeps every frame dials.stills_process could
+index and throws away the ones with nothing on them.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import logging
+import os
+import pickle
+import re
+
+import numpy as np
+
+from .runner import run_logged
+
+logger = logging.getLogger(__name__)
+
+BINARY_START = b'\x0c\x1a\x04\xd5'
+_HEADER_FIELDS = {
+    'fast': rb'X-Binary-Size-Fastest-Dimension:\s*(\d+)',
+    'slow': rb'X-Binary-Size-Second-Dimension:\s*(\d+)',
+    'n_elements': rb'X-Binary-Number-of-Elements:\s*(\d+)',
+    'size': rb'X-Binary-Size:\s*(\d+)',
+}
+# Escape codes of the byte-offset scheme: the delta continues in the next 2, 4 or 8 bytes
+_ESCAPES = ((2, -0x8000), (4, -0x80000000), (8, None))
+# Run by dials.python: unpickle a mask of flex.bool panels and save it as one boolean array
+_MASK_TO_NUMPY = """
+import pickle, sys
+import numpy
+from dials.array_family import flex  # noqa: F401
+with open(sys.argv[1], 'rb') as fp:
+    mask = pickle.load(fp)
+panels = mask if isinstance(mask, (tuple, list)) else [mask]
+numpy.save(sys.argv[2], numpy.concatenate([panel.as_numpy_array().astype(bool) for panel in panels]))
+"""
+
+
+def decode_byte_offset(data: bytes, n_elements: int) -> np.ndarray:
+    """Decompress CBF byte-offset data into a flat int32 array.
+
+    Each pixel is stored as the difference from the previous one in one signed
+    byte, or after an 0x80 escape in 2, then 4, then 8 bytes. Deltas that fit in
+    a byte, nearly every pixel of a diffraction image, are decoded in one vector
+    operation; only escapes are walked in Python.
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    deltas = raw.view(np.int8).astype(np.int64)
+    drop_starts, drop_lengths = [], []
+    next_free = 0
+    for pos in np.flatnonzero(raw == 0x80).tolist():
+        if pos < next_free:
+            continue  # 0x80 inside a wider delta
+        offset = pos + 1
+        for width, escape in _ESCAPES:
+            value = int.from_bytes(data[offset:offset + width], 'little', signed=True)
+            offset += width
+            if value != escape:
+                break
+        deltas[pos] = value
+        drop_starts.append(pos + 1)
+        drop_lengths.append(offset - pos - 1)
+        next_free = offset
+    if drop_starts:
+        lengths = np.array(drop_lengths)
+        # Indices of every byte after an escape, built without a Python loop per byte
+        drop = (np.repeat(np.array(drop_starts) - np.cumsum(lengths) + lengths, lengths)
+                + np.arange(lengths.sum()))
+        keep = np.ones(len(deltas), dtype=bool)
+        keep[drop] = False
+        deltas = deltas[keep]
+    if len(deltas) < n_elements:
+        raise RuntimeError(f"Byte-offset data holds {len(deltas)} pixels, expected {n_elements}")
+    return np.cumsum(deltas[:n_elements]).astype(np.int32)
+
+
+def read_cbf(path: str) -> np.ndarray:
+    """Read the image of a byte-offset compressed CBF file as a (slow, fast) int32 array."""
+    with open(path, 'rb') as fp:
+        content = fp.read()
+    start = content.find(BINARY_START)
+    if start < 0:
+        raise RuntimeError(f"{path} has no binary section")
+    header = content[:start]
+    if b'x-CBF_BYTE_OFFSET' not in header:
+        raise RuntimeError(f"{path} is not byte-offset compressed")
+    fields = {}
+    for key, pattern in _HEADER_FIELDS.items():
+        match = re.search(pattern, header)
+        if not match:
+            raise RuntimeError(f"{path} has no {pattern.split(b':')[0].decode()} header")
+        fields[key] = int(match.group(1))
+    start += len(BINARY_START)
+    image = decode_byte_offset(content[start:start + fields['size']], fields['n_elements'])
+    return image.reshape(fields['slow'], fields['fast'])
+
+
+def _npy_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.npy"
+
+
+def _stat_key(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def load_mask(path: Optional[str]) -> Optional[np.ndarray]:
+    """Load a mask as a boolean array, True for pixels to use; None if path is None.
+
+    A .npy file is loaded directly, as is the <mask>.npy that mask_to_numpy
+    writes next to a DIALS mask pickle while it is newer than the pickle.
+    DIALS masks are a tuple with one flex.bool per panel, so the pickle
+    itself can only be read in the DIALS Python environment; the panels are
+    stacked along the slow axis. Masks are cached on their path, mtime and
+    size, so a mask rewritten in place is loaded again.
+
+    Raises:
+        RuntimeError: If the mask is missing or cannot be read here
+    """
+    if not path:
+        return None
+    npy = path if path.endswith('.npy') else _npy_path(path)
+    return _load_mask(path, npy, _stat_key(path), None if npy == path else _stat_key(npy))
+
+
+@functools.lru_cache(maxsize=4)
+def _load_mask(path: str, npy: str, path_key: Optional[Tuple[int, int]],
+               npy_key: Optional[Tuple[int, int]]) -> np.ndarray:
+    try:
+        if npy == path or os.stat(npy).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return np.load(npy).astype(bool)
+    except OSError:
+        pass
+    try:
+        with open(path, 'rb') as fp:
+            mask = pickle.load(fp)
+    except Exception as e:
+        raise RuntimeError(f"Cannot read mask {path} ({type(e).__name__}: {e}); "
+                           f"convert it with mask_to_numpy") from e
+    panels = mask if isinstance(mask, (tuple, list)) else [mask]
+    return np.concatenate([np.asarray(panel.as_numpy_array() if hasattr(panel, 'as_numpy_array') else panel,
+                                      dtype=bool) for panel in panels])
+
+
+def mask_to_numpy(path: str, env: Optional[Dict[str, str]] = None, log_dir: str = '.') -> str:
+    """Convert a DIALS mask pickle to <mask>.npy with dials.python, unless that is already current.
+
+    Args:
+        path: DIALS mask pickle
+        env: Environment of the DIALS installation, see dials_env.dials_environment
+        log_dir: Directory for the logs of the conversion
+
+    Returns:
+        str: Path of the .npy file
+
+    Raises:
+        RuntimeError: If the conversion fails
+    """
+    npy = _npy_path(path)
+    if os.path.isfile(npy) and os.stat(npy).st_mtime_ns >= os.stat(path).st_mtime_ns:
+        return npy
+    tmp_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp.npy"
+    try:
+        result = run_logged(['dials.python', '-c', _MASK_TO_NUMPY, path, tmp_path], log_dir=log_dir,
+                            name='mask_to_numpy', env=env, shell=False, stage='dials_stills')
+    except FileNotFoundError as e:
+        raise RuntimeError(f"Cannot convert mask {path}: dials.python is not on the PATH of the DIALS environment") from e
+    if result['returncode'] != 0 or not os.path.isfile(tmp_path):
+        raise RuntimeError(f"Converting mask {path} with dials.python failed:\n{result['stderr_tail']}")
+    os.replace(tmp_path, npy)
+    return npy
+
+
+def resolve_mask(path: str, required: bool = False, env: Optional[Dict[str, str]] = None,
+                 log_dir: str = '.') -> Optional[str]:
+    """Check a mask can be loaded before frames are scored, converting a DIALS pickle if need be.
+
+    Args:
+        path: Mask pickle or .npy file
+        required: The mask was configured explicitly, so a missing file is an error
+        env: Environment of the DIALS installation, used if the pickle needs converting
+        log_dir: Directory for the logs of the conversion
+
+    Returns:
+        Optional[str]: The mask file to score frames with, or None when an optional mask is missing
+
+    Raises:
+        RuntimeError: If a required mask is missing or any mask cannot be read or converted
+    """
+    if not os.path.isfile(path):
+        if required:
+            raise RuntimeError(f"Mask {path} does not exist")
+        logger.warning("No mask at %s, prefiltering with every non-negative pixel", path)
+        return None
+    try:
+        load_mask(path)
+        return path
+    except RuntimeError:
+        npy = mask_to_numpy(path, env, log_dir)
+    load_mask(npy)
+    return npy
+
+
+def strong_pixels(image: np.ndarray, mask: Optional[np.ndarray] = None, sigma_strong: float = 6.0,
+                  background_stride: int = 101) -> int:
+    """Count the strong pixels that have a strong neighbour, i.e. that belong to spots of two or more pixels.
+
+    A pixel is strong when it is more than sigma_strong Poisson sigmas above the
+    background, the median of every background_stride-th usable pixel. Requiring a
+    strong neighbour, as min_spot_size=2 does in the spot finder, discards the
+    isolated Poisson outliers that a megapixel frame has by the dozen. Negative
+    pixels (module gaps and dead pixels) and masked pixels are not used; a mask
+    of the wrong shape is ignored.
+    """
+    usable = mask if mask is not None and mask.shape == image.shape else None
+    sample = image.ravel()[::background_stride]
+    if usable is not None:
+        sample = sample[usable.ravel()[::background_stride]]
+    sample = sample[sample >= 0]
+    if not sample.size:
+        return 0
+    background = float(np.median(sample))
+    strong = image > background + sigma_strong * np.sqrt(max(background, 1.0))
+    if usable is not None:
+        strong &= usable
+    neighbour = np.zeros_like(strong)
+    neighbour[:, :-1] |= strong[:, 1:]
+    neighbour[:, 1:] |= strong[:, :-1]
+    neighbour[:-1] |= strong[1:]
+    neighbour[1:] |= strong[:-1]
+    return int(np.count_nonzero(strong & neighbour))
+
+
+def score_frame(path: str, mask_path: Optional[str] = None, sigma_strong: float = 6.0,
+                min_strong_pixels: int = 20) -> Dict[str, Any]:
+    """Score one CBF frame; runs in pool workers, so failures are reported rather than raised.
+
+    Frames that cannot be read are kept as hits, leaving the decision to DIALS.
+
+    Returns:
+        Dict[str, Any]: 'path', 'strong_pixels', 'hit' and, on failure, 'error'
+    """
+    try:
+        score = strong_pixels(read_cbf(path), load_mask(mask_path), sigma_strong)
+    except Exception as e:
+        return {'path': path, 'strong_pixels': None, 'hit': True, 'error': f"{type(e).__name__}: {e}"}
+    return {'path': path, 'strong_pixels': score, 'hit': score >= min_strong_pixels}
+
+
+def _score_frames(paths: List[str], mask_path: Optional[str], sigma_strong: float,
+                  min_strong_pixels: int) -> List[Dict[str, Any]]:
+    return [score_frame(path, mask_path, sigma_strong, min_strong_pixels) for path in paths]
+
+
+def prefilter_hits(paths: List[str], mask_path: Optional[str] = None, sigma_strong: float = 6.0,
+                   min_strong_pixels: int = 20, workers: Optional[int] = None) -> Tuple[List[str], Dict[str, Any]]:
+    """Score frames in a process pool and keep the hits.
+
+    Args:
+        paths: CBF files, in the order they should be processed
+        mask_path: Optional mask, checked with resolve_mask beforehand
+        sigma_strong: Sigmas above background for a pixel to count as strong
+        min_strong_pixels: Strong pixels needed for a frame to count as a hit
+        workers: Pool size (default: the number of cores); 1 scores in this process
+
+    Returns:
+        Tuple[List[str], Dict[str, Any]]: The hits in input order, and 'frames', 'hits',
+        'hit_rate', 'unreadable' and the per-frame 'scores'
+    """
+    # Load the mask here first so that an unreadable one fails the batch instead of every frame
+    load_mask(mask_path)
+    workers = min(workers or os.cpu_count() or 1, max(1, len(paths)))
+    score = functools.partial(_score_frames, mask_path=mask_path, sigma_strong=sigma_strong,
+                              min_strong_pixels=min_strong_pixels)
+    if workers == 1:
+        scores = score(paths)
+    else:
+        # One chunk of frames per task keeps the mask load and IPC off the per-frame cost
+        size = max(1, -(-len(paths) // (4 * workers)))
+        chunks = [paths[i:i + size] for i in range(0, len(paths), size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scores = [row for rows in pool.map(score, chunks) for row in rows]
+    hits = [row['path'] for row in scores if row['hit']]
+    return hits, {
+        'frames': len(paths),
+        'hits': len(hits),
+        'hit_rate': len(hits) / len(paths) if paths else 0.0,
+        'unreadable': sum(1 for row in scores if row.get('error')),
+        'scores': {os.path.basename(row['path']): row['strong_pixels'] for row in scores},
+    }
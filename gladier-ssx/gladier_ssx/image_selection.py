@@ -0,0 +1,99 @@
+"""Choice of master files for the initial geometry refinement and its convergence check."""
+from typing import Dict, List, Optional
+import glob
+import json
+import math
+import os
+
+STRATEGIES = ('first', 'largest', 'spread')
+
+
+def data_files(master_file: str, catalog=None) -> List[str]:
+    """The <prefix>_data_*.h5 files of a master file, sorted.
+
+    Args:
+        master_file: Path of the *_master.h5 file
+        catalog: Optional RunCatalog used to list the data files instead of globbing
+    """
+    pattern = f"{os.path.basename(master_file)[:-len('_master.h5')]}_data_*.h5"
+    if catalog is not None:
+        return catalog.glob(os.path.dirname(master_file) or '.', pattern)
+    return sorted(glob.glob(os.path.join(os.path.dirname(master_file), pattern)))
+
+
+def master_weights(master_files: List[str], catalog=None) -> Dict[str, int]:
+    """Estimate how informative each master file is from the size of its data files.
+
+    Eiger data files are compressed, so rasters with more diffraction take more
+    bytes per image; the total size of <prefix>_data_*.h5 is therefore a cheap
+    stand-in for image count times hit rate. Masters without data files fall
+    back to their own size.
+
+    Args:
+        master_files: Paths of the *_master.h5 files
+        catalog: Optional RunCatalog used to list the data files instead of globbing
+
+    Returns:
+        Dict[str, int]: Weight in bytes for each master file
+    """
+    weights = {}
+    for master_file in master_files:
+        weight = 0
+        for path in data_files(master_file, catalog) or [master_file]:
+            try:
+                weight += os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+        weights[master_file] = weight
+    return weights
+
+
+def select_master_files(master_files: List[str], n_files: int, strategy: str = 'first',
+                        weights: Optional[Dict[str, int]] = None) -> List[str]:
+    """Pick n_files master files for geometry refinement.
+
+    Strategies:
+        first: the first n_files in sorted order (the original behaviour)
+        largest: the n_files with the highest weight
+        spread: split the sorted files into n_files contiguous strata and take
+            the heaviest file of each, so the selection covers the whole raster
+            while skipping the emptiest rasters of each region
+
+    Returns:
+        List[str]: The selected files, in their original order
+    """
+    if strategy not in STRATEGIES:
+        raise RuntimeError(f"Unknown selection strategy {strategy!r}, expected one of {STRATEGIES}")
+    n_files = min(n_files, len(master_files))
+    if strategy == 'first' or n_files == len(master_files):
+        return master_files[:n_files]
+
+    weights = weights if weights is not None else master_weights(master_files)
+    if strategy == 'largest':
+        chosen = set(sorted(master_files, key=lambda path: -weights.get(path, 0))[:n_files])
+    else:
+        chosen = set()
+        for i in range(n_files):
+            stratum = master_files[i * len(master_files) // n_files:(i + 1) * len(master_files) // n_files]
+            chosen.add(max(stratum, key=lambda path: weights.get(path, 0)))
+    return [path for path in master_files if path in chosen]
+
+
+def load_refined_geometry(refined_expt: str) -> Dict[str, List[float]]:
+    """Read the detector panel origins from a refined.expt file."""
+    with open(refined_expt, 'r') as fp:
+        experiments = json.load(fp)
+    origins = [list(map(float, panel['origin']))
+               for detector in experiments.get('detector', [])
+               for panel in detector.get('panels', [])]
+    return {'origins': origins}
+
+
+def geometry_shift(previous: Dict[str, List[float]], current: Dict[str, List[float]]) -> float:
+    """Largest panel origin shift in mm between two refined geometries.
+
+    Returns inf when the geometries are not comparable, e.g. the panel count changed.
+    """
+    if not previous['origins'] or len(previous['origins']) != len(current['origins']):
+        return math.inf
+    return max(math.dist(a, b) for a, b in zip(previous['origins'], current['origins']))
@@ -0,0 +1,209 @@
+"""Append-only index of integrated pickles and the PRIME trigger policy built on it."""
+from typing import Any, Dict, Iterable, List, Optional
+import contextlib
+import fcntl
+import json
+import math
+import os
+
+
+def int_index_path(proc_dir: str, chip_name: str) -> str:
+    """Path of a chip's index of integrated pickles, kept next to the pickles in proc_dir."""
+    return os.path.join(proc_dir, f"{chip_name}_ints.txt")
+
+
+def integrated_pickles(proc_dir: str, images: Iterable[str]) -> List[str]:
+    """Existing int-<lattice>-<image>.pickle files dials.stills_process wrote in proc_dir for images.
+
+    Lattices are numbered from 0 per image, so this costs a stat per image plus
+    one per lattice found, however many pickles proc_dir holds.
+    """
+    found = []
+    for image in images:
+        stem = os.path.splitext(os.path.basename(image))[0]
+        lattice = 0
+        while True:
+            path = os.path.abspath(os.path.join(proc_dir, f"int-{lattice}-{stem}.pickle"))
+            if not os.path.isfile(path):
+                break
+            found.append(path)
+            lattice += 1
+    return found
+
+
+class IntIndex:
+    """Append-only list of integrated pickle paths, one per line.
+
+    dials_stills appends the pickles each batch wrote, so keeping the list
+    current costs O(new files) per batch and nothing per PRIME trigger. The
+    number of paths and the byte length of the list are kept in
+    <index>.state.json, which makes the count O(1) and lets append() cut off
+    a line torn by a writer that died mid-append. The list is only rewritten,
+    atomically, when pickles are removed from it. PRIME runs are given an
+    immutable snapshot() of the list rather than the list itself.
+    All updates hold an exclusive flock on <index>.lock.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.state_path = f"{index_path}.state.json"
+        self.lock_path = f"{index_path}.lock"
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def state(self) -> Optional[Dict[str, int]]:
+        """The recorded 'count' and byte 'offset' of the list, or None if it was never written."""
+        try:
+            with open(self.state_path, 'r') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, count: int, offset: int) -> None:
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as fp:
+            json.dump({'count': count, 'offset': offset}, fp)
+        os.replace(tmp_path, self.state_path)
+
+    def _read(self, offset: int) -> List[str]:
+        try:
+            with open(self.index_path, 'rb') as fp:
+                return fp.read(offset).decode().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def _rewrite(self, paths: List[str]) -> None:
+        content = "".join(f"{path}\n" for path in paths)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as fp:
+            fp.write(content)
+        os.replace(tmp_path, self.index_path)
+        self._save_state(len(paths), len(content.encode()))
+
+    def paths(self) -> List[str]:
+        """All indexed pickle paths in the order they were appended."""
+        state = self.state()
+        return self._read(state['offset']) if state else []
+
+    def __len__(self) -> int:
+        state = self.state()
+        return state['count'] if state else 0
+
+    def append(self, paths: Iterable[str]) -> List[str]:
+        """Append pickle paths, made absolute, without checking for ones already indexed.
+
+        Returns:
+            List[str]: The appended paths
+        """
+        new = [os.path.abspath(path) for path in paths]
+        if not new:
+            return new
+        with self._locked():
+            state = self.state() or {'count': 0, 'offset': 0}
+            content = "".join(f"{path}\n" for path in new).encode()
+            with open(self.index_path, 'ab') as fp:
+                # Drop anything past the recorded end, i.e. a torn append
+                fp.truncate(state['offset'])
+                fp.write(content)
+            self._save_state(state['count'] + len(new), state['offset'] + len(content))
+        return new
+
+    def remove(self, paths: Iterable[str]) -> int:
+        """Drop paths from the index (e.g. pickles create_phil moved aside), rewriting it once.
+
+        Returns:
+            int: Number of paths removed
+        """
+        gone = {os.path.abspath(path) for path in paths}
+        if not gone:
+            return 0
+        with self._locked():
+            state = self.state()
+            if not state:
+                return 0
+            indexed = self._read(state['offset'])
+            kept = [path for path in indexed if path not in gone]
+            if len(kept) != len(indexed):
+                self._rewrite(kept)
+        return len(indexed) - len(kept)
+
+    def update_from_dir(self, directory: str, prefix: str = 'int-', suffix: str = '.pickle') -> List[str]:
+        """Reconcile the index with the pickles in directory, which costs a full listing.
+
+        Used to build the index of a proc_dir that predates it; dials_stills keeps
+        it current afterwards. Pickles of directory that are not indexed are
+        appended in sorted order and indexed ones that have disappeared are dropped.
+
+        Returns:
+            List[str]: The newly appended paths
+        """
+        directory = os.path.abspath(directory)
+        with self._locked():
+            state = self.state() or {'count': 0, 'offset': 0}
+            indexed = self._read(state['offset'])
+            present = {os.path.join(directory, name) for name in os.listdir(directory)
+                       if name.startswith(prefix) and name.endswith(suffix)}
+            known = set(indexed)
+            new = sorted(present - known)
+            gone = {path for path in known - present
+                    if os.path.dirname(os.path.normpath(path)) == directory}
+            self._rewrite([path for path in indexed if path not in gone] + new)
+        return new
+
+    def snapshot(self, dest: str) -> int:
+        """Copy the current list to dest, which later appends and removals leave untouched.
+
+        Returns:
+            int: Number of paths in the snapshot
+        """
+        with self._locked():
+            state = self.state() or {'count': 0, 'offset': 0}
+            tmp_path = f"{dest}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as out:
+                if state['offset']:
+                    with open(self.index_path, 'rb') as fp:
+                        remaining = state['offset']
+                        while remaining:
+                            block = fp.read(min(remaining, 1 << 20))
+                            if not block:
+                                break
+                            out.write(block)
+                            remaining -= len(block)
+            os.replace(tmp_path, dest)
+        return state['count']
+
+
+def should_trigger(n_ints: int, last_count: int, min_new_frames: int = 1,
+                   min_new_fraction: float = 0.0) -> bool:
+    """Decide whether enough new frames arrived since the last PRIME run.
+
+    A run is due once at least min_new_frames new pickles exist and they are
+    at least min_new_fraction of the frames the last run used.
+    """
+    new = n_ints - last_count
+    threshold = max(min_new_frames, math.ceil(min_new_fraction * last_count), 1)
+    return new >= threshold
+
+
+def load_trigger_state(state_path: str) -> Dict[str, Any]:
+    """Read the PRIME trigger state, returning an empty state if missing or unreadable."""
+    try:
+        with open(state_path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_trigger_state(state_path: str, last_count: int, run_name: Optional[str] = None) -> None:
+    """Atomically record the int count used by the latest PRIME run."""
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as fp:
+        json.dump({'last_count': last_count, 'run_name': run_name}, fp)
+    os.replace(tmp_path, state_path)
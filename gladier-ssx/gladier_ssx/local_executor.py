@@ -0,0 +1,106 @@
+"""Run a Gladier tool chain on one host, overlapping stages that do not depend on each other.
+
+The hosted flow runs gladier_tools strictly in list order. Here the order is
+relaxed to the dependencies declared on the tool classes: each may list the
+artifacts it reads in ``consumes`` and the ones it writes in ``produces``
+(e.g. 'refined_batches'). A stage waits for the latest earlier stage producing
+each artifact it consumes; artifacts nobody produces are external inputs. A
+tool declaring neither is treated as a barrier, ordered after every earlier
+stage and before every later one, which reproduces the flow's order.
+
+Stages run in a process pool, one process per stage at a time, because the
+tools os.chdir() and that would leak between threads.
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import os
+
+
+def _stage_name(tool: Any) -> str:
+    return tool.funcx_functions[0].__name__
+
+
+def stage_graph(tools: Sequence[Any]) -> Dict[str, Set[str]]:
+    """Map each stage, named after its tool's first function, to the stages it depends on."""
+    deps: Dict[str, Set[str]] = {}
+    producers: Dict[str, str] = {}
+    barrier: Optional[str] = None
+    seen: List[str] = []
+    for tool in tools:
+        name = _stage_name(tool)
+        if name in deps:
+            raise RuntimeError(f"Stage {name} appears twice in the tool list")
+        consumes = getattr(tool, 'consumes', None)
+        produces = getattr(tool, 'produces', None)
+        if consumes is None and produces is None:
+            deps[name] = set(seen)
+            barrier = name
+        else:
+            deps[name] = {producers[artifact] for artifact in consumes or [] if artifact in producers}
+            if barrier:
+                deps[name].add(barrier)
+            for artifact in produces or []:
+                producers[artifact] = name
+        seen.append(name)
+    return deps
+
+
+def run_stage(functions: List[Callable], cwd: str, data: Dict[str, Any]) -> Any:
+    """Run a tool's functions in order from cwd; pool processes are reused, so reset it first."""
+    result = None
+    for func in functions:
+        os.chdir(cwd)
+        result = func(**data)
+    return result
+
+
+def run_local(tools: Sequence[Any], flow_input: Dict[str, Any], max_workers: Optional[int] = None,
+              stage_input: Optional[Dict[str, Dict[str, Any]]] = None, cwd: Optional[str] = None) -> Dict[str, Any]:
+    """Run a tool chain locally, starting every stage as soon as its dependencies finish.
+
+    Args:
+        tools: Gladier tool classes, e.g. SSXClient.gladier_tools
+        flow_input: The flow's 'input' mapping, given to every stage like $.input in the flow
+        max_workers: Number of stages run at once (default: the number of stages)
+        stage_input: Optional per-stage overrides merged over flow_input, keyed by stage name,
+            for keys such as output_dir that stages interpret differently
+        cwd: Directory every stage starts in (default: the current directory)
+
+    Returns:
+        Dict[str, Any]: The result of each stage keyed by stage name, in tool list order,
+        which collect_metrics and collect_spans accept like a flow run's status
+
+    Raises:
+        RuntimeError: If a stage raises; stages already running are allowed to finish
+            and no further stages are started
+    """
+    deps = stage_graph(tools)
+    functions = {_stage_name(tool): list(tool.funcx_functions) for tool in tools}
+    stage_input = stage_input or {}
+    cwd = os.path.abspath(cwd or os.getcwd())
+
+    results: Dict[str, Any] = {}
+    failures: Dict[str, BaseException] = {}
+    pending = dict(deps)
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers or len(deps) or 1) as pool:
+        while pending or running:
+            if not failures:
+                for name in [name for name, needs in pending.items() if needs <= results.keys()]:
+                    data = dict(flow_input, **stage_input.get(name, {}))
+                    running[pool.submit(run_stage, functions[name], cwd, data)] = name
+                    del pending[name]
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    failures[name] = e
+
+    if failures:
+        name, error = next(iter(failures.items()))
+        raise RuntimeError(f"Stage {name} failed: {error!r}; not started: {sorted(pending)}") from error
+    return {name: results[name] for name in deps}
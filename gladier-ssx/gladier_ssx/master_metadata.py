@@ -0,0 +1,88 @@
+"""Lightweight reader for the metadata of Eiger/NeXus master.h5 files.
+
+Only a handful of scalar datasets are read; image data is never touched.
+h5py is imported on first use, so callers fall back to other estimates
+when it is not installed or a file is not readable HDF5.
+"""
+from typing import Any, Dict, Optional
+
+DETECTOR = '/entry/instrument/detector'
+DETECTOR_SPECIFIC = f'{DETECTOR}/detectorSpecific'
+
+# Scalars read, with the factor converting them to the units returned
+_SCALARS = {
+    'det_distance': (f'{DETECTOR}/detector_distance', 1000.0),      # m -> mm
+    'beam_center_x': (f'{DETECTOR}/beam_center_x', 1.0),            # pixels
+    'beam_center_y': (f'{DETECTOR}/beam_center_y', 1.0),            # pixels
+    'x_pixel_size': (f'{DETECTOR}/x_pixel_size', 1000.0),           # m -> mm
+    'y_pixel_size': (f'{DETECTOR}/y_pixel_size', 1000.0),           # m -> mm
+    'wavelength': ('/entry/instrument/beam/incident_wavelength', 1.0),  # Angstrom
+}
+
+
+def _scalar(h5: Any, path: str) -> Optional[float]:
+    try:
+        return float(h5[path][()])
+    except (KeyError, TypeError, ValueError, OSError):
+        return None
+
+
+def _n_images(h5: Any) -> Optional[int]:
+    """nimages * ntrigger from detectorSpecific, else the frames of the /entry/data datasets."""
+    nimages = _scalar(h5, f'{DETECTOR_SPECIFIC}/nimages')
+    if nimages is not None:
+        return int(nimages * (_scalar(h5, f'{DETECTOR_SPECIFIC}/ntrigger') or 1))
+    try:
+        # External links to missing data files raise KeyError and are skipped
+        total = 0
+        for name in h5['/entry/data']:
+            try:
+                total += h5['/entry/data'][name].shape[0]
+            except (KeyError, OSError):
+                pass
+        return total or None
+    except KeyError:
+        return None
+
+
+def read_master_metadata(master_file: str) -> Optional[Dict[str, Any]]:
+    """Read image count, detector distance, beam centre and wavelength from a master file.
+
+    Returns:
+        Optional[Dict[str, Any]]: 'n_images', 'det_distance' (mm), 'beam_center_x' and
+        'beam_center_y' (pixels), 'x_pixel_size' and 'y_pixel_size' (mm) and 'wavelength'
+        (Angstrom), each None if absent, or None if the file cannot be read
+    """
+    try:
+        import h5py
+    except ImportError:
+        return None
+    try:
+        with h5py.File(master_file, 'r') as h5:
+            metadata = {key: _scalar(h5, path) for key, (path, _) in _SCALARS.items()}
+            for key, (_, factor) in _SCALARS.items():
+                if metadata[key] is not None:
+                    metadata[key] *= factor
+            metadata['n_images'] = _n_images(h5)
+    except OSError:
+        return None
+    return metadata
+
+
+def panel_origin(metadata: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    """Panel origin in mm as written in the dials phil: beamx, beamy and det_distance.
+
+    The fast axis runs along +x and the slow axis along -y, so the origin sits at
+    (-beam_center_x * x_pixel_size, +beam_center_y * y_pixel_size, -det_distance).
+    Returns None unless the beam centre and pixel sizes are all known.
+    """
+    needed = ('beam_center_x', 'beam_center_y', 'x_pixel_size', 'y_pixel_size')
+    if any(metadata.get(key) is None for key in needed):
+        return None
+    origin = {
+        'beamx': round(-metadata['beam_center_x'] * metadata['x_pixel_size'], 3),
+        'beamy': round(metadata['beam_center_y'] * metadata['y_pixel_size'], 3),
+    }
+    if metadata.get('det_distance') is not None:
+        origin['det_distance'] = -metadata['det_distance']
+    return origin
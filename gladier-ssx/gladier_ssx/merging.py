@@ -0,0 +1,187 @@
+"""The merge_all and run_prime steps, kept here so stream_refined_proc can run them in a process pool."""
+from typing import Any, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import os
+import shutil
+
+from .catalog import open_catalog
+from .dials_env import dials_environment
+from .runner import run_logged
+from .tracing import Span
+
+INPUTS_PHIL = 'inputs.phil'
+
+
+def _reduce(inputs: List[Tuple[str, str]], workdir: str, phil_file: str, env: Dict[str, str],
+            stage: str = 'merge_all') -> Dict[str, Any]:
+    """Run xia2.ssx_reduce in workdir on inputs given as key=value lines of a phil file.
+
+    Passing the inputs in a file keeps the command line the same length however
+    many batches are merged, well clear of ARG_MAX.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, INPUTS_PHIL), 'w') as fp:
+        fp.writelines(f"{key}={value}\n" for key, value in inputs)
+    cmd = ["xia2.ssx_reduce", INPUTS_PHIL, "--phil", phil_file]
+    result = run_logged(cmd, log_dir='.', name='xia2.ssx_reduce', cwd=workdir, env=env, shell=False,
+                        stage=stage, inputs=[value for _, value in inputs])
+    result['n_inputs'] = len(inputs)
+    return result
+
+
+def _partial_outputs(workdir: str) -> List[Tuple[str, str]]:
+    """experiments= and reflections= inputs for the scaled data a reduction left in workdir/DataFiles."""
+    inputs = []
+    for expt in sorted(glob.glob(os.path.join(workdir, 'DataFiles', '*.expt'))):
+        refl = expt[:-len('.expt')] + '.refl'
+        if os.path.isfile(refl):
+            inputs += [('experiments', expt), ('reflections', refl)]
+    return inputs
+
+
+def _sharded_reduce(batch_dirs: List[str], shard_size: int, max_jobs: int, phil_file: str,
+                    env: Dict[str, str], output_dir: str) -> Dict[str, Any]:
+    """Reduce batches in shards of shard_size side by side, then combine the partial results the same way.
+
+    Each level reduces groups of at most shard_size inputs in output_dir/shards/level<L>_<NNNN>/,
+    up to max_jobs at a time; the scaled output of every shard is an input of the next level.
+    The level with a single group runs in output_dir itself, so DataFiles/ ends up where a
+    single reduction puts it.
+    """
+    groups = [[('directory', batch_dir) for batch_dir in batch_dirs[i:i + shard_size]]
+              for i in range(0, len(batch_dirs), shard_size)]
+    shards = []
+    level = 0
+    while len(groups) > 1:
+        names = [os.path.join('shards', f"level{level}_{i:04d}") for i in range(len(groups))]
+        workdirs = [os.path.join(output_dir, name) for name in names]
+        for workdir in workdirs:
+            # Partial outputs are globbed, so nothing may be left from an earlier run
+            shutil.rmtree(workdir, ignore_errors=True)
+        with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+            results = list(pool.map(lambda args: _reduce(*args, phil_file, env), zip(groups, workdirs)))
+        for name, result in zip(names, results):
+            shards.append(dict(result, level=level, workdir=name))
+        failed = [result for result in results if result['returncode'] != 0]
+        if failed:
+            return dict(failed[0], shards=shards)
+        partials = []
+        for workdir in workdirs:
+            outputs = _partial_outputs(workdir)
+            if not outputs:
+                raise RuntimeError(f"xia2.ssx_reduce left no scaled .expt/.refl in {workdir}/DataFiles")
+            partials.append(outputs)
+        groups = [sum(partials[i:i + shard_size], []) for i in range(0, len(partials), shard_size)]
+        level += 1
+    result = _reduce(groups[0], output_dir, phil_file, env)
+    return dict(result, level=level, shards=shards)
+
+
+def merge_all(**data: Any) -> Dict[str, Any]:
+    """Merge refined batches with xia2.ssx_reduce; the merge_all tool (tools/merge_all.py) documents data."""
+    refined_dir = data.get('refined_dir', 'refined')
+    output_dir = data.get('output_dir', 'final_merge')
+    phil_file = os.path.abspath(data.get('phil_file', 'run.phil'))
+    dials_path = data.get('dials_path', '/dials')
+    shard_size = data.get('shard_size')
+    max_jobs = max(1, int(data.get('max_jobs', 1)))
+    span = Span('merge_all', shard_size=shard_size, max_jobs=max_jobs)
+    
+    # Create output directory
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # Collect batch_1 directories under refined/ref_*/ (sorted for consistent ordering)
+    batch_dirs = data.get('batch_dirs')
+    if batch_dirs is None:
+        with open_catalog(data.get('catalog')) as catalog:
+            batch_dirs = catalog.batch_dirs(refined_dir)
+    batch_dirs = [os.path.abspath(batch_dir) for batch_dir in batch_dirs]
+    
+    if not batch_dirs:
+        raise RuntimeError("No batch_1 directories found in refined/ref_*/")
+    if shard_size is not None and int(shard_size) < 2:
+        raise RuntimeError(f"shard_size must be at least 2, got {shard_size}")
+    
+    # Run in output_dir through cwd= rather than os.chdir, so the caller's directory is left alone,
+    # directly in the cached DIALS environment and streaming output to log files
+    output_dir = os.path.abspath(output_dir)
+    env = dials_environment(dials_path, data.get('env_cache_dir'))
+    if shard_size and len(batch_dirs) > int(shard_size):
+        result = _sharded_reduce(batch_dirs, int(shard_size), max_jobs, phil_file, env, output_dir)
+    else:
+        result = _reduce([('directory', batch_dir) for batch_dir in batch_dirs], output_dir, phil_file, env)
+    result['span'] = span.finish(n_batches=len(batch_dirs), n_shards=len(result.get('shards', [])))
+    return result
+
+
+def run_prime(**data: Any) -> Dict[str, Any]:
+    """Run PRIME on refined batches; the run_prime tool (tools/run_prime.py) documents data."""
+    refined_dir = data.get('refined_dir', 'refined')
+    output_dir = data.get('output_dir', 'prime_results')
+    unit_cell = data.get('unit_cell', '78.95,78.85,38.10,90,90,90')
+    space_group = data.get('space_group', 'P43212')
+    d_min = data.get('d_min', 1.5)
+    sigma_min = data.get('sigma_min', 2.0)
+    isigi_cutoff = data.get('isigi_cutoff', 1.5)
+    frame_accept_min_cc = data.get('frame_accept_min_cc', 0.3)
+    span = Span('run_prime')
+    
+    # Create output directory
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # Collect input batch directories (same logic as xia2.ssx_reduce, sorted for consistent ordering)
+    batch_dirs = data.get('batch_dirs')
+    if batch_dirs is None:
+        with open_catalog(data.get('catalog')) as catalog:
+            batch_dirs = catalog.batch_dirs(refined_dir)
+    
+    if not batch_dirs:
+        raise RuntimeError("No batch_1 directories found in refined/ref_*/")
+    
+    # Write input block with all directories
+    input_block = "input {\n"
+    for batch_dir in batch_dirs:
+        input_block += f"  directory = {batch_dir}\n"
+    input_block += "}\n"
+    
+    # Create the full prime.phil
+    prime_phil_content = f"""{input_block}
+
+output {{
+  prefix = {output_dir}/prime
+  log = {output_dir}/prime.log
+}}
+
+target_unit_cell = {unit_cell}
+target_space_group = {space_group}
+
+scaling {{
+  model = ml_iso
+}}
+
+merging {{
+  d_min = {d_min}
+  partiality_model = unity
+}}
+
+selection {{
+  sigma_min = {sigma_min}
+  isigi_cutoff = {isigi_cutoff}
+  frame_accept_min_cc = {frame_accept_min_cc}
+}}
+"""
+    
+    # Write prime.phil file
+    prime_phil_path = os.path.join(output_dir, "prime.phil")
+    with open(prime_phil_path, 'w') as f:
+        f.write(prime_phil_content)
+    
+    # Run PRIME
+    cmd = f"prime {prime_phil_path}"
+    
+    result = run_logged(cmd, log_dir=output_dir, name='prime', executable=None, stage='run_prime')
+    result['span'] = span.finish()
+    return result
@@ -0,0 +1,127 @@
+"""Resource accounting for subprocess launches and its aggregation per flow run.
+
+Every command started through run_logged is reaped here with os.wait4,
+which returns the rusage of that child and all the descendants it waited
+for. Unlike getrusage(RUSAGE_CHILDREN) this stays correct when a worker
+runs several children at once. /proc/<pid>/io is read while the child is
+still a zombie, so its I/O counters likewise include its reaped descendants.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+import os
+import socket
+import subprocess
+import time
+
+IO_FIELDS = ('rchar', 'wchar', 'read_bytes', 'write_bytes')
+
+
+def _read_proc_io(pid: int) -> Dict[str, Optional[int]]:
+    """Read the I/O counters of a process, None where /proc is unavailable."""
+    counters = dict.fromkeys(IO_FIELDS)
+    try:
+        with open(f"/proc/{pid}/io", 'r') as fp:
+            for line in fp:
+                key, _, value = line.partition(':')
+                if key in counters:
+                    counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
+def _available_cores() -> int:
+    """Number of cores this process, and so a child it starts, may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def wait_with_metrics(proc: subprocess.Popen, name: str, stage: str, started: float, t0: float,
+                      inputs: Optional[List[str]] = None, cores: Optional[int] = None) -> Dict[str, Any]:
+    """Wait for a child, reap it and return its metrics record.
+
+    proc.returncode is set as if proc.wait() had been called.
+
+    Args:
+        proc: The running child
+        name: Label of the launch, e.g. 'xia2.ssx' or the PRIME run name
+        stage: Pipeline stage the launch belongs to, e.g. 'run_refined_proc'
+        started: time.time() at which the child was launched
+        t0: time.monotonic() at which the child was launched, used for the wall time
+        inputs: Optional input files of the launch, kept for the timeline
+        cores: Number of cores the child was pinned to (default: the cores this process may use)
+
+    Returns:
+        dict: name, stage, host, pid, cores, inputs, returncode, started, wall_time,
+        user_time and system_time in seconds, max_rss_kb of the largest process in the
+        tree and the rchar/wchar/read_bytes/write_bytes counters
+    """
+    if hasattr(os, 'waitid'):
+        while True:
+            try:
+                os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+                break
+            except InterruptedError:
+                continue
+    io = _read_proc_io(proc.pid)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall_time = time.monotonic() - t0
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    return dict(
+        name=name,
+        stage=stage,
+        host=socket.gethostname(),
+        pid=proc.pid,
+        cores=cores or _available_cores(),
+        inputs=inputs,
+        returncode=proc.returncode,
+        started=started,
+        wall_time=wall_time,
+        user_time=usage.ru_utime,
+        system_time=usage.ru_stime,
+        max_rss_kb=usage.ru_maxrss,
+        **io,
+    )
+
+
+def collect_metrics(result: Any) -> List[Dict[str, Any]]:
+    """Find every metrics record nested anywhere in a tool result or flow output.
+
+    Records are recognised by their 'metrics' key and deduplicated by (host, pid, started),
+    since tools such as the PRIME scheduler repeat their last run at the top level.
+    """
+    found: Dict[tuple, Dict[str, Any]] = {}
+    stack = [result]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            record = item.get('metrics')
+            if isinstance(record, dict) and 'pid' in record:
+                found.setdefault((record.get('host'), record['pid'], record['started']), record)
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return sorted(found.values(), key=lambda record: record['started'])
+
+
+def summarize_metrics(records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Aggregate metrics records per stage, plus a 'total' entry.
+
+    Times and I/O counters are summed, max_rss_kb is the maximum and
+    cpu_utilisation is (user + system time) / wall time.
+    """
+    summary: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        for key in (record.get('stage', record['name']), 'total'):
+            entry = summary.setdefault(key, dict(
+                count=0, wall_time=0.0, user_time=0.0, system_time=0.0, max_rss_kb=0,
+                **dict.fromkeys(IO_FIELDS, 0)))
+            entry['count'] += 1
+            for field in ('wall_time', 'user_time', 'system_time') + IO_FIELDS:
+                entry[field] += record.get(field) or 0
+            entry['max_rss_kb'] = max(entry['max_rss_kb'], record.get('max_rss_kb') or 0)
+    for entry in summary.values():
+        cpu = entry['user_time'] + entry['system_time']
+        entry['cpu_utilisation'] = cpu / entry['wall_time'] if entry['wall_time'] else 0.0
+    return summary
@@ -0,0 +1,146 @@
+"""Core placement for concurrent DIALS, xia2 and PRIME jobs on a shared node.
+
+Jobs lease disjoint sets of cores from a node-wide ledger, are pinned to
+them with sched_setaffinity and are told to use exactly that many
+processes, so concurrent jobs stop competing for the same cores. The ledger
+is a JSON file in the node's temporary directory, updated under an flock, so
+jobs started by different tools and processes on the node see each other.
+Leases of processes that died are reclaimed on the next update.
+
+Pinning sets the affinity of the launching thread around the fork of the
+child, which inherits it. Linux applies sched_setaffinity(0) to the calling
+thread only, so other threads of the tool keep running on every core.
+"""
+from typing import Dict, Iterator, List, Optional, Sequence
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+_lease_counter = iter(range(1, 1 << 62))
+_counter_lock = threading.Lock()
+
+
+def default_ledger() -> str:
+    """Path of this user's core ledger in the node's temporary directory."""
+    return os.path.join(tempfile.gettempdir(), f"gladier-ssx-cores-{os.getuid()}.json")
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on, sorted."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(n_parts: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """Split cores into n_parts contiguous slices whose sizes differ by at most one.
+
+    With more parts than cores, every part gets a single core and cores are reused.
+    """
+    cores = list(cores if cores is not None else available_cores())
+    n_parts = max(1, n_parts)
+    if n_parts >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(n_parts)]
+    size, extra = divmod(len(cores), n_parts)
+    parts, start = [], 0
+    for i in range(n_parts):
+        end = start + size + (1 if i < extra else 0)
+        parts.append(cores[start:end])
+        start = end
+    return parts
+
+
+def job_nproc(n_jobs: int = 1, cores: Optional[Sequence[int]] = None) -> int:
+    """Cores per job when n_jobs jobs share this node's available cores, at least 1."""
+    return len(partition_cores(n_jobs, cores)[-1])
+
+
+def _alive(key: str) -> bool:
+    pid = int(key.split('.', 1)[0])
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextlib.contextmanager
+def _ledger(path: str) -> Iterator[Dict[str, List[int]]]:
+    """Load the ledger under an exclusive lock and write it back when the block ends."""
+    with open(path, 'a+') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            fp.seek(0)
+            try:
+                leases = json.loads(fp.read() or '{}')
+            except ValueError:
+                leases = {}
+            yield leases
+            fp.seek(0)
+            fp.truncate()
+            fp.write(json.dumps(leases))
+            fp.flush()
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def lease_cores(n_cores: int, ledger: Optional[str] = None,
+                cores: Optional[Sequence[int]] = None) -> Iterator[List[int]]:
+    """Lease n_cores cores of this node for the duration of the block.
+
+    Free cores are handed out first, lowest numbered first, so concurrent jobs get
+    disjoint sets. When the node is fully leased, the least shared cores are used,
+    which spreads any oversubscription evenly instead of piling it onto core 0.
+
+    Args:
+        n_cores: Number of cores wanted, capped at the cores available
+        ledger: Path of the ledger (default: default_ledger())
+        cores: Cores to choose from (default: available_cores())
+
+    Yields:
+        List[int]: The leased cores, sorted
+    """
+    ledger = ledger or default_ledger()
+    cores = list(cores if cores is not None else available_cores())
+    n_cores = max(1, min(n_cores, len(cores)))
+    with _counter_lock:
+        key = f"{os.getpid()}.{next(_lease_counter)}"
+
+    with _ledger(ledger) as leases:
+        for stale in [k for k in leases if not _alive(k)]:
+            del leases[stale]
+        use = {core: 0 for core in cores}
+        for leased in leases.values():
+            for core in leased:
+                if core in use:
+                    use[core] += 1
+        chosen = sorted(sorted(cores, key=lambda core: (use[core], core))[:n_cores])
+        leases[key] = chosen
+    try:
+        yield chosen
+    finally:
+        with _ledger(ledger) as leases:
+            leases.pop(key, None)
+
+
+@contextlib.contextmanager
+def pinned(cores: Optional[Sequence[int]]) -> Iterator[None]:
+    """Restrict the calling thread to cores for the duration of the block; children forked inside inherit it.
+
+    Does nothing when cores is None or the platform has no sched_setaffinity.
+    """
+    if not cores or not hasattr(os, 'sched_setaffinity'):
+        yield
+        return
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cores)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
@@ -0,0 +1,156 @@
+"""Headless, optional plotting stage for primalisys.
+
+matplotlib is imported lazily with the non-interactive Agg backend, so the
+decision path never pays for it. Plots can be drawn inline, later from the
+PRIME log, or in a separate background process.
+"""
+from typing import Any, Sequence
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+
+def _pyplot():
+    """Import pyplot on first use, forcing the non-interactive Agg backend."""
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plot_fits(fitting_list: Sequence[Any], gb_list: Sequence[float], png_fid: str) -> str:
+    """Render the primalisys 2x3 summary figure from fitted metrics.
+
+    Args:
+        fitting_list: (RES, I2_list, CC_list, NOBS_list, COMP_list, ISIGI_list) as used by the decision engine
+        gb_list: [good, bad] frame counts
+        png_fid: Path of the PNG to write
+
+    Returns:
+        str: Path of the written PNG
+    """
+    plt = _pyplot()
+    RES, I2_list, CC_list, NOBS_list, COMP_list, ISIGI_list = fitting_list
+
+    [I2,    I2_good,    I2_okay,    i2_pars,    I2_fit,    i2_good_idx,    i2_okay_idx]    = I2_list
+    [CC,    CC_good,    CC_okay,    cc_pars,    CC_fit,    cc_good_idx,    cc_okay_idx]    = CC_list
+    [NOBS,  NOBS_good,  NOBS_okay,  nobs_pars,  NOBS_fit,  nobs_good_idx,  nobs_okay_idx]  = NOBS_list
+    [COMP,  COMP_good,  COMP_okay,  comp_pars,  COMP_fit,  comp_good_idx,  comp_okay_idx]  = COMP_list
+    [ISIGI, ISIGI_good, ISIGI_okay, isigi_pars, ISIGI_fit, isigi_good_idx, isigi_okay_idx] = ISIGI_list
+
+    res_bins = np.linspace(0,19,20)
+    fig, axs = plt.subplots(2, 3, tight_layout=True, figsize=(12,8.7), facecolor='white' )
+    
+    res_labels = ['%1.2f'%x for x in RES.tolist()]
+
+    #########################################
+    axs[0][0].plot(CC_fit, lw=1, c='k')
+    axs[0][0].fill_between(np.linspace(0, cc_good_idx, 20), CC_good, 1000, facecolor='yellowgreen', edgecolor='yellowgreen', alpha=0.6)
+    axs[0][0].fill_between(np.linspace(cc_good_idx, cc_okay_idx, 20), CC_good, 1000, facecolor='goldenrod', edgecolor='goldenrod', alpha=0.6)
+    axs[0][0].fill_between(np.linspace(0, cc_okay_idx, 20), CC_okay, CC_good, facecolor='goldenrod', edgecolor='goldenrod', alpha=0.6)
+    axs[0][0].fill_between(np.linspace(cc_okay_idx, 19, 20), CC_okay, 1000, facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[0][0].fill_between(res_bins, 0, CC_okay, facecolor='darkred', edgecolor='darkred', alpha=0.6)
+
+    axs[0][0].plot(CC, lw=4, linestyle='None', c='k', marker='o')
+    axs[0][0].set_xticks(res_bins)
+    axs[0][0].set_xticklabels(res_labels, rotation=90, fontsize=10)
+    axs[0][0].set_xlim(0, 19)
+    axs[0][0].set_ylim(np.min(CC),np.max(CC))
+    axs[0][0].grid(True)
+    axs[0][0].set_title('CC1/2', fontsize=12)
+
+    #########################################
+    axs[0][1].plot(NOBS_fit, lw=1, c='k')
+    axs[0][1].fill_between(np.linspace(0, nobs_good_idx, 20),NOBS_good, 1000, facecolor='yellowgreen', edgecolor='yellowgreen', alpha=0.6)
+    axs[0][1].fill_between(np.linspace(nobs_good_idx, nobs_okay_idx, 20), NOBS_good, 1000, facecolor='goldenrod', edgecolor='goldenrod', alpha=0.6)
+    axs[0][1].fill_between(np.linspace(0, nobs_okay_idx, 20), NOBS_okay, NOBS_good, facecolor='goldenrod', edgecolor='goldenrod', alpha=0.6)
+    axs[0][1].fill_between(np.linspace(nobs_okay_idx, 19, 20), NOBS_okay, 1000, facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[0][1].fill_between(res_bins, 0, NOBS_okay, facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[0][1].plot(NOBS, lw=4, linestyle='None', c='k',  marker='o')
+    axs[0][1].set_xticks(res_bins)
+    axs[0][1].set_xticklabels(res_labels, rotation=90, fontsize=10)
+    axs[0][1].set_xlim(0, 19)
+    axs[0][1].set_ylim(np.min(NOBS), np.max(NOBS))
+    axs[0][1].grid(True)
+    axs[0][1].set_title('<N_obs>', fontsize=12)
+
+    #########################################
+    axs[0][2].plot(COMP_fit, lw=1, c='k')
+    axs[0][2].fill_between(np.linspace(0, comp_okay_idx, 20), COMP_okay, 102, facecolor='yellowgreen', edgecolor='yellowgreen', alpha=0.6)
+    axs[0][2].fill_between(np.linspace(comp_okay_idx, 20, 20), 0, 102, facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[0][2].fill_between(np.linspace(0, comp_okay_idx, 20), 0, COMP_okay, facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[0][2].plot(COMP, lw=4, linestyle='None', c='k', marker='o')
+    axs[0][2].set_xticks(res_bins)
+    axs[0][2].set_xticklabels(res_labels, rotation=90, fontsize=10)
+    axs[0][2].set_xlim(0, 19)
+    axs[0][2].set_ylim(np.min(COMP), 101)
+    axs[0][2].grid(True)
+    axs[0][2].set_title('Completeness', fontsize=12)
+
+    #########################################
+    axs[1][0].plot(I2_fit, lw=1, c='k')
+    axs[1][0].fill_between(np.linspace(0, i2_okay_idx, 20), I2_okay, I2_good, facecolor='yellowgreen', edgecolor='yellowgreen', alpha=0.6)
+    axs[1][0].fill_between(np.linspace(0, i2_okay_idx, 20), I2_okay, np.max(I2), facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[1][0].fill_between(np.linspace(0, i2_okay_idx, 20), 0, I2_good, facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[1][0].fill_between(np.linspace(i2_okay_idx, 19, 20), 0, np.max(I2), facecolor='darkred', edgecolor='darkred', alpha=0.6)
+    axs[1][0].plot(I2, lw=4, linestyle='None', c='k', marker='o')
+    axs[1][0].set_xticks(res_bins)
+    axs[1][0].set_xticklabels(res_labels, rotation=90, fontsize=10)
+    axs[1][0].set_xlim(0, 19)
+    axs[1][0].set_ylim(np.min(I2), np.max(I2))
+    axs[1][0].grid(True)
+    axs[1][0].set_title('<I**2>', fontsize=12)
+
+    #########################################
+    axs[1][1].plot(ISIGI_fit, lw=1, c='k')
+    axs[1][1].fill_between(np.linspace(0, isigi_good_idx, 20), ISIGI_good, 1000, facecolor='yellowgreen', edgecolor='yellowgreen', alpha=0.6)
+    axs[1][1].fill_between(np.linspace(isigi_good_idx, isigi_okay_idx, 20), ISIGI_good, 1000, facecolor='goldenrod', edgecolor='goldenrod', alpha=0.6)
+    axs[1][1].fill_between(np.linspace(0, isigi_okay_idx, 20), ISIGI_okay, ISIGI_good, facecolor='goldenrod', edgecolor='goldenrod', alpha=0.6)
+    axs[1][1].plot(ISIGI, lw=4, linestyle='None', c='k', marker='o')
+    axs[1][1].set_xticks(res_bins)
+    axs[1][1].set_xticklabels(res_labels, rotation=90, fontsize=10)
+    axs[1][1].set_xlim(0, 19)
+    axs[1][1].set_ylim(np.min(ISIGI), np.max(ISIGI))
+    axs[1][1].grid(True)
+    axs[1][1].set_title('<I/sigI>', fontsize=12)
+
+    #########################################
+    n = axs[1][2].pie(gb_list, colors=['yellowgreen','darkred'], explode=(0, 0.1), startangle=0)
+    n[0][0].set_alpha(0.6)
+    n[0][1].set_alpha(0.6)
+    axs[1][2].set_title('Good/Bad frames', fontsize=12)
+    plt.savefig(png_fid)
+    plt.close(fig)
+    return png_fid
+
+
+def plot_prime_log(log_fid: str, png_fid: str) -> str:
+    """Parse and fit a PRIME log, then render its primalisys figure.
+
+    This is the deferred form of the plotting step: it only needs the log,
+    so it can run any time after the decision has been written.
+    """
+    from .prime_fit import fit_metrics, metric_arrays
+    from .prime_log import parse_prime_log
+
+    parsed = parse_prime_log(log_fid)
+    array_list = metric_arrays(parsed['tables']['postref_cycle_3'])
+    fitting_list = (array_list[0],) + tuple(fit_metrics(array_list))
+    return plot_fits(fitting_list, [parsed['good_frames'], parsed['bad_frames']], png_fid)
+
+
+def plot_in_background(log_fid: str, png_fid: str) -> int:
+    """Run plot_prime_log in a detached Python process and return its pid without waiting.
+
+    The child's output goes to <png_fid>.log next to the figure.
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = (f"import sys; sys.path.insert(0, {package_root!r}); "
+            f"from {__name__} import plot_prime_log; "
+            f"plot_prime_log({os.path.abspath(log_fid)!r}, {os.path.abspath(png_fid)!r})")
+    with open(f"{png_fid}.log", 'w') as log:
+        proc = subprocess.Popen([sys.executable, '-c', code], stdout=log, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+    return proc.pid
@@ -0,0 +1,99 @@
+"""Analysis of every PRIME run under a tree, shared by primalisys_batch and its pool workers."""
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import os
+import re
+
+from .prime_decision import decision_engine
+from .prime_fit import fit_metrics, metric_arrays
+from .prime_log import parse_prime_log
+
+# prime.run writes <run_no>/log.txt, and dials_prime names runs <chip>_<n_ints>_prime
+RUN_DIR_RE = re.compile(r'^(?P<chip>.+)_(?P<n_ints>\d+)_prime$')
+
+TABLE_FIELDS = ['chip', 'n_ints', 'good_frames', 'bad_frames', 'decision', 'resolution',
+                'gb_opinion', 'i2_opinion', 'comp_opinion', 'malformed_lines', 'log', 'error']
+
+
+def find_prime_logs(prime_root: str, log_name: str = 'log.txt') -> List[Dict[str, Any]]:
+    """Find the logs of every <chip>_<N>_prime run under a tree.
+
+    Returns:
+        List[Dict[str, Any]]: 'chip', 'n_ints' and 'log' of each run, ordered by chip and int count
+    """
+    runs = []
+    for dirpath, dirnames, filenames in os.walk(prime_root):
+        match = RUN_DIR_RE.match(os.path.basename(dirpath))
+        if match and log_name in filenames:
+            runs.append({'chip': match.group('chip'), 'n_ints': int(match.group('n_ints')),
+                         'log': os.path.join(dirpath, log_name)})
+        dirnames.sort()
+    return sorted(runs, key=lambda run: (run['chip'], run['n_ints']))
+
+
+def analyze_prime_log(log_fid: str) -> Dict[str, Any]:
+    """Parse, fit and judge one PRIME log as primalisys does, without plotting.
+
+    Runs in pool workers, so failures are reported in the result rather than raised,
+    and the decision engine's console output is dropped.
+
+    Returns:
+        Dict[str, Any]: good/bad frame counts, the decision, its opinions and resolution
+        recommendation, or 'error' if the log could not be analyzed
+    """
+    row: Dict[str, Any] = {'log': log_fid}
+    try:
+        parsed = parse_prime_log(log_fid)
+        row.update(good_frames=parsed['good_frames'], bad_frames=parsed['bad_frames'],
+                   malformed_lines=parsed['malformed_lines'])
+        if 'postref_cycle_3' not in parsed['tables']:
+            raise RuntimeError("no postref_cycle_3 table in log")
+        array_list = metric_arrays(parsed['tables']['postref_cycle_3'])
+        fitting_list = (array_list[0],) + tuple(fit_metrics(array_list))
+        with contextlib.redirect_stdout(io.StringIO()):
+            decision_dict = decision_engine(fitting_list, [parsed['good_frames'], parsed['bad_frames']])
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+        return row
+    row.update(decision_dict)
+    row['resolution'] = float(row.pop('resolution recommendation'))
+    return row
+
+
+def analyze_prime_logs(logs: List[str], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """analyze_prime_log over many logs in a process pool, results in the order of logs.
+
+    Args:
+        logs: Paths of the PRIME logs
+        workers: Pool size (default: the number of cores); 1 analyzes in this process
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(logs) <= 1:
+        return [analyze_prime_log(log) for log in logs]
+    workers = min(workers, len(logs))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Each log takes milliseconds, so hand them out in chunks to keep IPC off the critical path
+        return list(pool.map(analyze_prime_log, logs, chunksize=max(1, len(logs) // (4 * workers))))
+
+
+def format_decision_table(rows: List[Dict[str, Any]]) -> str:
+    """Render the consolidated decisions as a fixed-width text table."""
+    lines = [f"{'chip':<16} {'n_ints':>8} {'good':>8} {'bad':>8} {'resolution':>10}  decision"]
+    for row in rows:
+        if row.get('error'):
+            lines.append(f"{row['chip']:<16} {row['n_ints']:>8} {'':>8} {'':>8} {'':>10}  ERROR {row['error']}")
+            continue
+        lines.append(f"{row['chip']:<16} {row['n_ints']:>8} {row['good_frames']:>8.0f} {row['bad_frames']:>8.0f} "
+                     f"{row['resolution']:>10.2f}  {row['decision']} ({row['gb_opinion']}; "
+                     f"I**2 {row['i2_opinion']}; completeness {row['comp_opinion']})")
+    return "\n".join(lines)
+
+
+def write_atomic(path: str, text: str) -> None:
+    """Write text to path through a temporary file and os.replace."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='') as fp:
+        fp.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,85 @@
+"""Decision engine turning fitted PRIME statistics into a primalisys recommendation."""
+from typing import Any, Dict, Sequence
+
+
+def decision_engine(fitting_list: Sequence[Any], gb_list: Sequence[float]) -> Dict[str, Any]:
+    """Judge the good/bad frame ratio, <I**2>, completeness and the resolution cut-off.
+
+    Args:
+        fitting_list: (RES, I2_list, CC_list, NOBS_list, COMP_list, ISIGI_list) as returned by fit_metrics
+        gb_list: [good, bad] frame counts
+
+    Returns:
+        Dict[str, Any]: 'decision', the three opinions and the 'resolution recommendation'
+    """
+    RES, I2_list, CC_list, NOBS_list, COMP_list, ISIGI_list = fitting_list  
+    [I2,    I2_good,     I2_okay,     i2_pars,     I2_fit,     i2_good_idx,     i2_okay_idx]    = I2_list
+    [CC,    CC_good,     CC_okay,     cc_pars,     CC_fit,     cc_good_idx,     cc_okay_idx]    = CC_list
+    [NOBS,  NOBS_good,   NOBS_okay,   nobs_pars,   NOBS_fit,   nobs_good_idx,   nobs_okay_idx]  = NOBS_list
+    [COMP,  COMP_good,   COMP_okay,   comp_pars,   COMP_fit,   comp_good_idx,   comp_okay_idx]  = COMP_list
+    [ISIGI, ISIGI_good,  ISIGI_okay,  isigi_pars,  ISIGI_fit,  isigi_good_idx,  isigi_okay_idx] = ISIGI_list
+
+    decision = 'None'
+    # GOOD/BAD Ratio, if there too many bad frames it means they need to be laundered through rejectoplot
+    # and rerun PRIME
+    good, bad = gb_list
+    print(good, bad)
+    print(bad/(good+bad))
+    if 1 - (bad/(good+bad)) > 0.7:
+        decision = 'None'
+        gb_opinion = 'Good/Bad Opinion is NOMINAL'
+    if 1 - (bad/(good+bad)) < 0.7:
+        decision = 'rejectoplot'
+        gb_opinion = 'Good/Bad Opinion is REJECTOPLOT'
+    print('----------------->', decision, gb_opinion) 
+
+    # I**2 should stay 2 and then rise but not above 3
+    # If I**2 hovers at 1.5 it means the data is twinned
+    # The I**2 fit uses exp3, the offset (c) is the third value retured
+    c = i2_pars[2]
+    print('c', c)
+    if 1.75 < c < 3.0:
+        i2_opinion = 'NOMINAL'
+    elif 1.75 > c:
+        i2_opinion = 'POSSIBLE TWINNING'
+    else:
+        i2_opinion = 'SOMETHING IS GOING ON WITH I**2'
+    print('----------------->', i2_opinion) 
+
+    # Completeness should be at 100 or 99.9
+    # The intecept should be 99.95 or higher
+    inter = comp_pars[3]
+    print('completeness intercept', inter)
+    if inter > 99.95:
+        comp_opinion = 'NOMINAL' 
+    else:
+        comp_opinion = 'SOMETHING IS GOING ON WITH COMPLETENESS'
+        decision = 'Rerun Prime'
+
+    print('\n\n\n')
+    print('        I**2 resolution suggestion: %1.2f (%1.2f)' %(RES[i2_okay_idx],    I2[i2_okay_idx])) 
+    print('       CC1/2 resolution suggestion: %1.2f (%1.2f)' %(RES[cc_okay_idx],    CC[cc_okay_idx])) 
+    print('Completeness resolution suggestion: %1.2f (%1.2f)' %(RES[comp_okay_idx],  COMP[comp_okay_idx])) 
+    print('       N-obs resolution suggestion: %1.2f (%1.2f)' %(RES[nobs_okay_idx],  NOBS[nobs_okay_idx])) 
+    print('       IsigI resolution suggestion: %1.2f (%1.2f)' %(RES[isigi_okay_idx], ISIGI[isigi_okay_idx])) 
+
+    i2_res = RES[i2_okay_idx]
+    cc_res = RES[cc_okay_idx]  
+    comp_res = RES[comp_okay_idx]
+    nobs_res = RES[nobs_okay_idx]
+    isigi_res = RES[isigi_okay_idx]
+
+    res_recom = ((3*cc_res) + (2*i2_res) + comp_res + nobs_res) / 7.0
+    print('   RECOMMEND resolution suggestion: %1.2f' %res_recom) 
+
+    if (res_recom - RES[-1]) > 0.02:
+        decision = 'Rerun Prime'
+    
+    decision_dict = {}
+    decision_dict['decision'] = decision
+    decision_dict['gb_opinion'] = gb_opinion
+    decision_dict['i2_opinion'] = i2_opinion
+    decision_dict['comp_opinion'] = comp_opinion
+    decision_dict['resolution recommendation'] = res_recom
+    
+    return decision_dict
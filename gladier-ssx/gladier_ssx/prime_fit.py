@@ -0,0 +1,207 @@
+"""Warm-started curve fitting of PRIME per-bin statistics for primalisys."""
+from typing import Any, Callable, List, Sequence, Tuple
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+N_BINS = 20
+RES_BINS = np.linspace(0, N_BINS - 1, N_BINS)
+
+# Candidate exponential rates scanned when building initial estimates
+_RATES = np.concatenate([-np.logspace(-3, 0.5, 48)[::-1], np.logspace(-3, 0.5, 48)])
+
+I2_GOOD, I2_OKAY = 1.75, 3.0
+CC_GOOD, CC_OKAY = 50, 30
+NOBS_GOOD, NOBS_OKAY = 20, 10
+COMP_GOOD, COMP_OKAY = 100.0, 99.0
+ISIGI_GOOD, ISIGI_OKAY = 0.5, 0.25
+
+
+def exp(x, a, b, c):
+    """Decaying exponential with offset, used for CC1/2 and <N_obs> against resolution."""
+    return a * np.exp(-b * x) + c
+
+
+def exp2(x, a, b, c, d):
+    """Saturating exponential used for completeness against bin index."""
+    return d - (a * np.exp(x*b - c))
+
+
+def exp3(x, a, b, c):
+    """Rising exponential with offset used for <I**2> against bin index."""
+    return (a * np.exp((x- 20) * b)) + c
+
+
+def exp4(x, a, b, c):
+    """Decaying exponential with offset used for <I/sigI> against bin index."""
+    return (a * np.exp(-(x+8) * b)) + c
+
+
+def _exp_jac(x, a, b, c):
+    e = np.exp(-b * x)
+    return np.stack([e, -a * x * e, np.ones_like(e)], axis=-1)
+
+
+def _exp2_jac(x, a, b, c, d):
+    e = np.exp(x*b - c)
+    return np.stack([-e, -a * x * e, a * e, np.ones_like(e)], axis=-1)
+
+
+def _exp3_jac(x, a, b, c):
+    e = np.exp((x - 20) * b)
+    return np.stack([e, a * (x - 20) * e, np.ones_like(e)], axis=-1)
+
+
+def _exp4_jac(x, a, b, c):
+    e = np.exp(-(x + 8) * b)
+    return np.stack([e, -a * (x + 8) * e, np.ones_like(e)], axis=-1)
+
+
+_JACOBIANS = {exp: _exp_jac, exp2: _exp2_jac, exp3: _exp3_jac, exp4: _exp4_jac}
+
+
+def get_index(array: np.ndarray, direction: str, val: float) -> int:
+    """Return the bin just before the fitted curve crosses val.
+
+    'greater than' looks for the first bin below val, 'less than' for the
+    first bin above it. If the curve never crosses, the last bin is returned.
+    """
+    array = np.asarray(array)
+    if direction == 'greater than':
+        hits = np.flatnonzero(array < val)
+    else:
+        hits = np.flatnonzero(array > val)
+    return int(hits[0]) - 1 if hits.size else N_BINS - 1
+
+
+def _linear_given_rate(shift: np.ndarray, y: np.ndarray) -> Tuple[float, float, float]:
+    """Fit y ~ coef * exp(rate * shift) + intercept for the best rate on a grid.
+
+    For a fixed rate the model is linear in coef and intercept, so every
+    candidate rate is solved in closed form at once and the rate with the
+    smallest squared error is kept.
+
+    Returns:
+        Tuple[float, float, float]: (rate, coef, intercept)
+    """
+    n = y.size
+    with np.errstate(over='ignore', invalid='ignore'):
+        basis = np.exp(_RATES[:, None] * shift[None, :])
+        s_e = basis.sum(axis=1)
+        s_ee = (basis * basis).sum(axis=1)
+        s_ey = basis @ y
+        s_y = y.sum()
+        det = n * s_ee - s_e * s_e
+        coef = (n * s_ey - s_e * s_y) / det
+        intercept = (s_y - coef * s_e) / n
+        sse = ((coef[:, None] * basis + intercept[:, None] - y[None, :]) ** 2).sum(axis=1)
+    sse[~np.isfinite(sse) | (np.abs(det) < 1e-12)] = np.inf
+    best = int(np.argmin(sse))
+    if not np.isfinite(sse[best]):
+        raise ValueError('no usable initial estimate')
+    return float(_RATES[best]), float(coef[best]), float(intercept[best])
+
+
+def initial_guess(model: Callable, x: np.ndarray, y: np.ndarray) -> List[float]:
+    """Closed-form initial parameters for one of the primalisys models."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if model is exp:
+        rate, coef, intercept = _linear_given_rate(x, y)
+        return [coef, -rate, intercept]
+    if model is exp3:
+        rate, coef, intercept = _linear_given_rate(x - 20, y)
+        return [coef, rate, intercept]
+    if model is exp4:
+        rate, coef, intercept = _linear_given_rate(-(x + 8), y)
+        return [coef, rate, intercept]
+    if model is exp2:
+        # a and c are degenerate (a * e^-c); keep the legacy c = 2
+        rate, coef, intercept = _linear_given_rate(x, y)
+        return [-coef * np.exp(2.0), rate, 2.0, intercept]
+    raise ValueError(f"No initial estimate for {model.__name__}")
+
+
+def fit_curve(model: Callable, x: np.ndarray, y: np.ndarray,
+              legacy_p0: Sequence[float]) -> Tuple[Any, np.ndarray, bool]:
+    """Fit a model, warm-started from closed-form estimates and with its analytic Jacobian.
+
+    The legacy fixed guess is tried only if the warm-started fit fails.
+
+    Returns:
+        Tuple: (parameters, fitted curve, success flag)
+    """
+    candidates = []
+    try:
+        candidates.append(initial_guess(model, x, y))
+    except ValueError:
+        pass
+    candidates.append(list(legacy_p0))
+
+    for p0 in candidates:
+        try:
+            with np.errstate(over='ignore', invalid='ignore'):
+                pars, _ = curve_fit(f=model, xdata=x, ydata=y, p0=p0, jac=_JACOBIANS.get(model))
+        except (RuntimeError, ValueError):
+            continue
+        fit = model(x, *pars)
+        if np.all(np.isfinite(fit)):
+            return pars, fit, True
+    return None, np.zeros(N_BINS), False
+
+
+def metric_arrays(postref_table: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """Pull the (RES, I2, CC, NOBS, COMP, ISIGI) columns out of a parsed PRIME table."""
+    return (
+        postref_table['Resolution'],
+        postref_table['<I**2>'],
+        postref_table['CC1/2'],
+        postref_table['<N_obs>'],
+        postref_table['Completeness'],
+        postref_table['<I/sigI>'],
+    )
+
+
+def fit_metrics(array_list: Sequence[np.ndarray]) -> Tuple[list, list, list, list, list]:
+    """Fit every primalisys metric and locate its threshold crossings.
+
+    Args:
+        array_list: (RES, I2, CC, NOBS, COMP, ISIGI) per-bin arrays
+
+    Returns:
+        Tuple: I2, CC, NOBS, COMP and ISIGI lists of
+        [data, good, okay, pars, fit, good_idx, okay_idx]
+    """
+    RES, I2, CC, NOBS, COMP, ISIGI = (np.asarray(a, dtype=float) for a in array_list)
+
+    i2_pars, I2_fit, ok = fit_curve(exp3, RES_BINS, I2, [1, 0.5, 2])
+    if not ok:
+        i2_pars = ['fit failed', 0, 2]
+    I2_list = [I2, I2_GOOD, I2_OKAY, i2_pars, I2_fit,
+               get_index(I2_fit, 'less than', I2_GOOD), get_index(I2_fit, 'less than', I2_OKAY)]
+
+    cc_pars, CC_fit, ok = fit_curve(exp, RES, CC, [0, 0, 1])
+    if not ok:
+        cc_pars = ['fit failed', 0, 0]
+    CC_list = [CC, CC_GOOD, CC_OKAY, cc_pars, CC_fit,
+               get_index(CC_fit, 'greater than', CC_GOOD), get_index(CC_fit, 'greater than', CC_OKAY)]
+
+    nobs_pars, NOBS_fit, ok = fit_curve(exp, RES, NOBS, [0, 0, 1])
+    if not ok:
+        nobs_pars = ['fit failed', 0, 0]
+    NOBS_list = [NOBS, NOBS_GOOD, NOBS_OKAY, nobs_pars, NOBS_fit,
+                 get_index(NOBS_fit, 'greater than', NOBS_GOOD), get_index(NOBS_fit, 'greater than', NOBS_OKAY)]
+
+    comp_pars, COMP_fit, ok = fit_curve(exp2, RES_BINS, COMP, [1, 0.2, 2, 100])
+    if not ok:
+        comp_pars = ['fit failed', 0, 0, 0]
+    COMP_list = [COMP, COMP_GOOD, COMP_OKAY, comp_pars, COMP_fit,
+                 get_index(COMP_fit, 'greater than', COMP_GOOD), get_index(COMP_fit, 'greater than', COMP_OKAY)]
+
+    isigi_pars, ISIGI_fit, ok = fit_curve(exp4, RES_BINS, ISIGI, [1, 0.6, 4])
+    if not ok:
+        isigi_pars = ['fit failed', 0, 0]
+    ISIGI_list = [ISIGI, ISIGI_GOOD, ISIGI_OKAY, isigi_pars, ISIGI_fit,
+                  get_index(ISIGI_fit, 'greater than', ISIGI_GOOD), get_index(ISIGI_fit, 'greater than', ISIGI_OKAY)]
+
+    return I2_list, CC_list, NOBS_list, COMP_list, ISIGI_list
@@ -0,0 +1,113 @@
+"""Single-pass streaming parser for PRIME log files."""
+from typing import Dict, Any, Iterable, List, Tuple
+import re
+
+import numpy as np
+
+SECTION_RE = re.compile(r'\b(mean_scaling|postref_cycle_\d+)\b')
+
+
+def _header_fields(line: str) -> List[str]:
+    """Turn a 'Bin Resolution Range ...' header into unique structured array field names."""
+    names = line.rstrip().replace('|', ' ').split()
+    # 'Resolution Range' is a single column once the bin edges are averaged
+    del names[2]
+    seen: Dict[str, int] = {}
+    fields = []
+    for name in names:
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        fields.append(name if count == 0 else f"{name}_{count + 1}")
+    return fields
+
+
+def _parse_row(line: str, n_fields: int) -> Tuple[float, ...]:
+    """Parse one per-bin row, averaging the bin edges into a single resolution value.
+
+    Rows look like ``01 50.00 - 6.65 100.00 6200 / 6200 62.00 ...``; the
+    reflection counts either side of '/' are dropped.
+    """
+    vals = line.split()
+    vals.remove('-')
+    vals.remove('/')
+    del vals[4:6]
+    row = [float(v) for v in vals]
+    row[1:3] = [(row[1] + row[2]) / 2.0]
+    if len(row) < n_fields:
+        raise ValueError(f"expected {n_fields} columns, found {len(row)}")
+    return tuple(row[:n_fields])
+
+
+def parse_prime_lines(lines: Iterable[str]) -> Dict[str, Any]:
+    """Parse PRIME log lines in a single pass.
+
+    Every statistics table (mean_scaling and each postref_cycle_N) is turned
+    into a NumPy structured array with one float field per column, e.g.
+    'Resolution', 'Completeness', '<N_obs>', 'CC1/2', '<I/sigI>' and '<I**2>'.
+    When a label appears more than once the last complete table wins. Only
+    the table being read is held in memory, so the cost of a log is constant
+    in memory and linear in time.
+
+    Args:
+        lines: Iterable of log lines, e.g. an open file
+
+    Returns:
+        dict: 'tables' mapping the section label to its structured array,
+        'good_frames' and 'bad_frames' (None if absent), and
+        'malformed_lines', the number of table rows that could not be parsed
+    """
+    tables: Dict[str, np.ndarray] = {}
+    good = None
+    bad = None
+    malformed = 0
+
+    label = None
+    fields: List[str] = []
+    rows: List[Tuple[float, ...]] = []
+
+    for line in lines:
+        if label is not None:
+            stripped = line.strip()
+            if not stripped:
+                if fields and rows:
+                    tables[label] = np.array(rows, dtype=[(f, 'f8') for f in fields])
+                label = None
+                continue
+            if stripped.startswith('---') or 'TOTAL' in stripped:
+                continue
+            if stripped.startswith('Bin'):
+                fields = _header_fields(stripped)
+                rows = []
+                continue
+            if fields:
+                try:
+                    rows.append(_parse_row(stripped, len(fields)))
+                except (ValueError, IndexError):
+                    malformed += 1
+                continue
+
+        match = SECTION_RE.search(line)
+        if match:
+            label = match.group(1)
+            fields = []
+            rows = []
+        elif 'No. good frames' in line:
+            good = float(line.split(':')[1])
+        elif 'No. bad cc frames' in line:
+            bad = float(line.split(':')[1])
+
+    if label is not None and fields and rows:
+        tables[label] = np.array(rows, dtype=[(f, 'f8') for f in fields])
+
+    return {
+        'tables': tables,
+        'good_frames': good,
+        'bad_frames': bad,
+        'malformed_lines': malformed,
+    }
+
+
+def parse_prime_log(log_path: str) -> Dict[str, Any]:
+    """Parse a PRIME log file from disk, see parse_prime_lines for the result layout."""
+    with open(log_path, 'r', errors='replace') as f:
+        return parse_prime_lines(f)
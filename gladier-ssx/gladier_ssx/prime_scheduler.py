@@ -0,0 +1,178 @@
+"""Per-chip PRIME scheduler that coalesces overlapping requests behind a file lock.
+
+At most one PRIME run executes per chip. A new request replaces whatever is
+still queued, and can cancel a superseded run that is already in flight.
+The caller holding the run lock drains the queue; every other caller just
+records its request and returns.
+
+Files kept in prime_dir for each chip:
+    <chip>_prime.run.lock      held (flock) for as long as a PRIME run executes
+    <chip>_prime.state.lock    held briefly while the queue files are updated
+    <chip>_prime_pending.json  the newest request not started yet, with its environment
+    <chip>_prime_running.json  the request currently running, with its pid and host and,
+                               once a newer request cancels it, that request's seq
+"""
+from typing import Any, Dict, List, Optional
+import contextlib
+import fcntl
+import json
+import os
+import signal
+import socket
+import time
+
+from .placement import lease_cores
+from .runner import run_logged
+
+
+def _paths(prime_dir: str, chip_name: str) -> Dict[str, str]:
+    base = os.path.join(prime_dir, f"{chip_name}_prime")
+    return {
+        'run_lock': f"{base}.run.lock",
+        'state_lock': f"{base}.state.lock",
+        'pending': f"{base}_pending.json",
+        'running': f"{base}_running.json",
+    }
+
+
+@contextlib.contextmanager
+def _locked(path: str):
+    """Hold an exclusive flock on path for the duration of the block."""
+    with open(path, 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, payload: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as fp:
+        json.dump(payload, fp)
+    os.replace(tmp_path, path)
+
+
+def _remove(path: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def _run_in_progress(run_lock_path: str) -> bool:
+    """Whether some caller holds the run lock, i.e. is executing the chip's queue.
+
+    The lock is only probed with LOCK_NB; the prober always goes on to take the
+    run lock itself, so a caller that finds it briefly held still gets its
+    request run.
+    """
+    with open(run_lock_path, 'a') as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(fp, fcntl.LOCK_UN)
+    return False
+
+
+def _cancel(running: Dict[str, Any]) -> bool:
+    """Terminate a running PRIME process group if it lives on this host.
+
+    Only called for a record whose run lock is held, so the pid is still the run's.
+    """
+    if running.get('host') != socket.gethostname() or not running.get('pid'):
+        return False
+    try:
+        os.killpg(running['pid'], signal.SIGTERM)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def submit_prime(prime_dir: str, chip_name: str, run_name: str, cmd: List[str], seq: int,
+                 env: Optional[Dict[str, str]] = None, cancel_superseded: bool = False,
+                 n_cores: Optional[int] = None) -> Dict[str, Any]:
+    """Queue a PRIME run for a chip and execute the queue if nobody else is.
+
+    Args:
+        prime_dir: Directory PRIME runs in, also holding the lock and queue files
+        chip_name: Chip the request belongs to; each chip has its own queue
+        run_name: Name of the run, used for its log files
+        cmd: Command to run, e.g. ['timeout', '1200', 'prime.run', '<phil>']
+        seq: Monotonic request number (e.g. the int count); higher numbers supersede lower ones
+        env: Optional environment for the PRIME process, queued with the request so that
+            it applies whichever caller ends up running it
+        cancel_superseded: Terminate an in-flight run with a lower seq (default: False)
+        n_cores: Optional number of cores leased from the node and pinned for the run, see placement
+
+    Returns:
+        dict: 'queued': True if another caller will run the request, otherwise
+        'queued': False, the records of every run executed under 'runs', and
+        the last run's record merged in at the top level
+    """
+    paths = _paths(prime_dir, chip_name)
+    request = {'run_name': run_name, 'cmd': cmd, 'seq': seq, 'submitted': time.time(), 'n_cores': n_cores,
+               'env': env}
+
+    with _locked(paths['state_lock']):
+        running = _read_json(paths['running'])
+        if running is not None and not _run_in_progress(paths['run_lock']):
+            # Left behind by a lock holder that died; its pid may belong to another process by now
+            _remove(paths['running'])
+            running = None
+        pending = _read_json(paths['pending'])
+        # A request no newer than the queued or running one adds nothing
+        if (pending is None or pending['seq'] <= seq) and (running is None or running['seq'] < seq):
+            _write_json(paths['pending'], request)
+        cancelled = bool(cancel_superseded and running and running['seq'] < seq and _cancel(running))
+        if cancelled:
+            # Recorded under the state lock, so the lock holder reads it when the run ends
+            _write_json(paths['running'], dict(running, cancelled_by=seq))
+
+    runs: List[Dict[str, Any]] = []
+    while True:
+        with open(paths['run_lock'], 'a') as run_lock:
+            try:
+                fcntl.flock(run_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # The lock holder re-checks the queue after every run, so our request is not lost
+                break
+            try:
+                while True:
+                    with _locked(paths['state_lock']):
+                        job = _read_json(paths['pending'])
+                        _remove(paths['pending'])
+                    if job is None:
+                        break
+
+                    def on_start(proc, job=job):
+                        with _locked(paths['state_lock']):
+                            _write_json(paths['running'], dict(job, pid=proc.pid, host=socket.gethostname()))
+
+                    # Cores are leased when the run starts, which may be long after it was requested
+                    with contextlib.ExitStack() as stack:
+                        cores = stack.enter_context(lease_cores(job['n_cores'])) if job.get('n_cores') else None
+                        result = run_logged(job['cmd'], log_dir=prime_dir, name=job['run_name'], cwd=prime_dir,
+                                            env=job.get('env'), shell=False, start_new_session=True, on_start=on_start,
+                                            stage='dials_prime', cores=cores)
+                    with _locked(paths['state_lock']):
+                        record = _read_json(paths['running']) or {}
+                        _remove(paths['running'])
+                    runs.append(dict(result, run_name=job['run_name'], seq=job['seq'],
+                                     cancelled='cancelled_by' in record, cancelled_by=record.get('cancelled_by')))
+            finally:
+                fcntl.flock(run_lock, fcntl.LOCK_UN)
+        # A request may have arrived between our last queue check and releasing the lock
+        if _read_json(paths['pending']) is None:
+            break
+
+    if not runs:
+        return {'queued': True, 'run_name': run_name, 'seq': seq, 'cancelled_running': cancelled}
+    return dict(runs[-1], queued=False, runs=runs, cancelled_running=cancelled)
@@ -0,0 +1,283 @@
+"""Steps shared by the xia2.ssx refinement tools.
+
+The manifest of refined master files, the initial and per-file refinements and
+the polling of a raster directory that is still being collected.
+"""
+from typing import Any, Dict, List, Optional
+import contextlib
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .catalog import open_catalog
+from .geometry_registry import DEFAULT_REGISTRY, find_geometry, read_beamline_geometry
+from .image_selection import (data_files, geometry_shift, load_refined_geometry, master_weights,
+                              select_master_files)
+from .placement import lease_cores
+from .runner import run_logged
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+ORDERS = ('longest_first', 'name')
+
+
+def file_digest(path: str) -> Optional[str]:
+    """Return the sha256 hex digest of a file, or None if it does not exist."""
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def master_signature(master_file: str, checksum: bool = False, catalog=None) -> Dict[str, Any]:
+    """Describe a master file and its data files by size and mtime, optionally adding its checksum.
+
+    The data files are included so a master file refined while its data was still
+    arriving is refined again once the data files have grown.
+    """
+    st = os.stat(master_file)
+    signature = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'data_files': {}}
+    for path in data_files(master_file, catalog):
+        try:
+            data_st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature['data_files'][os.path.basename(path)] = [data_st.st_size, data_st.st_mtime_ns]
+    if checksum:
+        signature['sha256'] = file_digest(master_file)
+    return signature
+
+
+def load_manifest(manifest_path: str) -> Dict[str, Any]:
+    """Load the refined-processing manifest, returning an empty one if missing or unreadable."""
+    try:
+        with open(manifest_path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_manifest(manifest_path: str, entries: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge entries into the refined-processing manifest on disk and return the result.
+
+    The manifest is re-read and rewritten under an flock on <manifest>.lock, through
+    a temporary file and os.replace, so concurrent flows sharing refined_dir keep
+    each other's entries and readers never see a partial file.
+    """
+    with open(f"{manifest_path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            manifest = load_manifest(manifest_path)
+            manifest.update(entries)
+            tmp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as fp:
+                json.dump(manifest, fp, indent=2, sort_keys=True)
+            os.replace(tmp_path, manifest_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return manifest
+
+
+def master_outdir(master_file: str, refined_dir: str) -> str:
+    """The refined/ref_<run> directory of a master file."""
+    return f"{refined_dir}/ref_{os.path.basename(master_file).replace('_master.h5', '')}"
+
+
+def manifest_current(manifest: Dict[str, Any], master_file: str, signature: Dict[str, Any],
+                      refined_dir: str) -> bool:
+    """True if the manifest records a successful run of master_file with this signature whose batch_1 still exists."""
+    entry = manifest.get(master_file)
+    return (entry is not None and entry.get('returncode') == 0
+            and {k: entry.get(k) for k in signature} == signature
+            and os.path.isdir(os.path.join(master_outdir(master_file, refined_dir), 'batch_1')))
+
+
+def run_geometry(data: Dict[str, Any], data_dir: str = '.', catalog_root: str = '.') -> Optional[Dict[str, float]]:
+    """The registry key of run data['run_num'], from the inputs create_phil renders its phil from.
+
+    The metadata of data['master_file'], else of the first master file of data_dir, fills in
+    what beamline_run<run_num>.json leaves out, and data's beamx and beamy override the
+    master file's beam centre, as they do in create_phil.
+    """
+    with open_catalog(data.get('catalog'), root=catalog_root) as catalog:
+        master_file = data.get('master_file') or catalog.first_master(data_dir)
+        metadata = catalog.master_metadata([master_file])[master_file] if master_file else None
+    return read_beamline_geometry(data_dir, data['run_num'], metadata, data.get('beamx'), data.get('beamy'))
+
+
+def registered_geometry(data: Dict[str, Any]) -> Optional[str]:
+    """The registered geometry matching the run's geometry, if run_num is given and reuse is on."""
+    if data.get('run_num') is None or not data.get('reuse_geometry', True):
+        return None
+    geometry = run_geometry(data, data.get('data_dir', '.'))
+    return geometry and find_geometry(
+        geometry, data.get('geometry_registry', DEFAULT_REGISTRY), data.get('geometry_tolerance')
+    ) or None
+
+
+def longest_first(master_files: List[str], catalog) -> List[str]:
+    """Order master files longest-processing-time first.
+
+    The cost of a file is its image count from the master metadata, or the size
+    of its data files when the metadata of any file cannot be read. Starting the
+    longest jobs first keeps one large file from running alone at the end.
+    """
+    metadata = catalog.master_metadata(master_files)
+    if all(metadata[f] and metadata[f].get('n_images') for f in master_files):
+        cost = {f: metadata[f]['n_images'] for f in master_files}
+    else:
+        cost = master_weights(master_files, catalog)
+    return sorted(master_files, key=lambda f: cost[f], reverse=True)
+
+
+def refine_master_file(master_file: str, refined_dir: str, phil_file: str,
+                        refined_geometry: str, nproc: Optional[int] = None, pin: bool = False) -> Dict[str, Any]:
+    """Run xia2.ssx on a single master file inside its refined/ref_<run> directory.
+
+    Args:
+        master_file: Path to the master.h5 file, relative to the working directory
+        refined_dir: Directory holding the ref_<run> output directories
+        phil_file: Path to the phil file, relative to the working directory
+        refined_geometry: Path to the reference geometry, absolute or relative to the ref_<run> directory
+        nproc: Optional number of cores handed to xia2.ssx
+        pin: Lease nproc cores of the node and pin xia2.ssx to them (default: False)
+
+    Returns:
+        dict: Per-file result with the command, return code, log paths and output tail
+    """
+    # Create output directory for this run
+    outdir = master_outdir(master_file, refined_dir)
+    os.makedirs(outdir, exist_ok=True)
+
+    # Construct the command
+    cmd_parts = [
+        "xia2.ssx",
+        f"image=../../{master_file}",
+        f"--phil ../../{phil_file}",
+        f"reference_geometry={refined_geometry}" if os.path.isabs(refined_geometry)
+        else f"reference_geometry=../../{refined_geometry}"
+    ]
+    if nproc:
+        cmd_parts.append(f"nproc={nproc}")
+
+    cmd = " ".join(cmd_parts)
+
+    # Execute the command from the output directory. cwd is used instead of
+    # os.chdir so several jobs can run side by side in the same process.
+    with contextlib.ExitStack() as stack:
+        cores = stack.enter_context(lease_cores(nproc or 1)) if pin else None
+        result = run_logged(cmd, log_dir='.', name='xia2.ssx', cwd=outdir, stage='run_refined_proc',
+                            inputs=[master_file], cores=cores)
+
+    return dict(
+        result,
+        master_file=master_file,
+        outdir=outdir,
+        success=result['returncode'] == 0,
+    )
+
+
+def refinement_result(future, master_file: str, refined_dir: str) -> Dict[str, Any]:
+    """The result of a refine_master_file future, or a failed job record if it raised.
+
+    One master file whose job could not be run (a missing phil, an unwritable
+    outdir, ...) then fails on its own instead of losing the results, and the
+    manifest entries, of every other job.
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        logger.exception("Refining %s failed", master_file)
+        return {'master_file': master_file, 'outdir': master_outdir(master_file, refined_dir), 'cmd': None,
+                'returncode': 1, 'success': False, 'error': f"{type(e).__name__}: {e}"}
+
+
+def refine_initial(selected_files: List[str], phil_file: str) -> Dict[str, Any]:
+    """Run xia2.ssx on the selected master files in the current directory."""
+    image_args = [f"image={master_file}" for master_file in selected_files]
+    cmd = " ".join(["xia2.ssx"] + image_args + [f"--phil {phil_file}"])
+    result = run_logged(cmd, log_dir='.', name='xia2.ssx', stage='run_initial_proc', inputs=selected_files)
+    result['n_files'] = len(selected_files)
+    return result
+
+
+def adaptive_refine(master_files: List[str], n_files: int, strategy: str, weights: Dict[str, int],
+                     phil_file: str, step: int, max_files: int, tolerance: float) -> Dict[str, Any]:
+    """Refine on growing selections until the refined geometry stops moving.
+
+    Paths are relative to the current directory. Each round refines n master files
+    in adaptive_<n>/, adding step files per round. Rounds stop once the panel origins
+    have moved by at most tolerance mm since the previous round, once max_files is
+    reached, or when xia2.ssx fails. geometry_refinement then becomes a symlink to
+    the last round's geometry_refinement/, replacing the directory an earlier
+    non-adaptive run left there.
+    """
+    rounds = []
+    previous = None
+    n = n_files
+    while True:
+        round_dir = f"adaptive_{n}"
+        os.makedirs(round_dir, exist_ok=True)
+        selected_files = select_master_files(master_files, n, strategy, weights)
+        os.chdir(round_dir)
+        try:
+            result = refine_initial([os.path.join('..', path) for path in selected_files], os.path.join('..', phil_file))
+        finally:
+            os.chdir('..')
+        result['output_dir'] = round_dir
+
+        refined_expt = os.path.join(round_dir, 'geometry_refinement', 'refined.expt')
+        current = None
+        if result['returncode'] == 0:
+            try:
+                current = load_refined_geometry(refined_expt)
+            except (OSError, ValueError, KeyError):
+                pass
+        result['shift'] = geometry_shift(previous, current) if previous and current else None
+        rounds.append(result)
+
+        converged = result['shift'] is not None and result['shift'] <= tolerance
+        if result['returncode'] != 0 or converged or n >= min(max_files, len(master_files)):
+            break
+        previous = current
+        n = min(n + step, max_files, len(master_files))
+
+    if os.path.isdir(os.path.join(round_dir, 'geometry_refinement')):
+        tmp_link = f"geometry_refinement.{os.getpid()}.tmp"
+        os.symlink(os.path.join(round_dir, 'geometry_refinement'), tmp_link)
+        old_dir = None
+        if os.path.isdir('geometry_refinement') and not os.path.islink('geometry_refinement'):
+            old_dir = f"geometry_refinement.{os.getpid()}.old"
+            os.rename('geometry_refinement', old_dir)
+        os.replace(tmp_link, 'geometry_refinement')
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    return dict(rounds[-1], converged=converged, rounds=rounds)
+
+
+def settled(master_file: str, settle_seconds: float, now: float) -> bool:
+    """True once a master file and its data files have not been modified for settle_seconds."""
+    paths = [master_file] + glob.glob(master_file.replace('_master.h5', '_data_*.h5'))
+    try:
+        return all(now - os.stat(path).st_mtime >= settle_seconds for path in paths)
+    except FileNotFoundError:
+        return False
+
+
+def wait_for_geometry(path: str, timeout: float, poll_interval: float) -> None:
+    """Block until the reference geometry exists."""
+    deadline = time.monotonic() + timeout
+    while not os.path.isfile(path):
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"No reference geometry at {path} after {timeout:.0f} s")
+        time.sleep(poll_interval)
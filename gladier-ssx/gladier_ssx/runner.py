@@ -0,0 +1,151 @@
+"""Shared subprocess runner that streams child output to rotating log files."""
+from typing import Dict, Any, Callable, List, Optional, Union
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+
+from .metrics import wait_with_metrics
+from .placement import pinned
+
+
+class RotatingLogWriter:
+    """Binary log writer that rotates the file once it grows past max_bytes.
+
+    Rotated files are renamed to <path>.1, <path>.2, ... keeping at most
+    backup_count of them, so disk usage per log is bounded as well.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, backup_count: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.paths: List[str] = [path]
+        self._fp = open(path, 'wb')
+        self._size = 0
+
+    def write(self, chunk: bytes) -> None:
+        """Write a chunk, rotating first if it would overflow the current file."""
+        if self.max_bytes and self._size and self._size + len(chunk) > self.max_bytes:
+            self._rotate()
+        self._fp.write(chunk)
+        self._size += len(chunk)
+
+    def _rotate(self) -> None:
+        self._fp.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+            rotated = [f"{self.path}.{i}" for i in range(1, self.backup_count + 1)]
+            self.paths = [self.path] + [p for p in rotated if os.path.exists(p)]
+        self._fp = open(self.path, 'wb')
+        self._size = 0
+
+    def close(self) -> None:
+        """Flush and close the current log file."""
+        self._fp.close()
+
+
+def _pump(pipe, writer: RotatingLogWriter, tail: deque) -> None:
+    """Copy a child pipe line by line into the log writer, keeping the last lines in tail.
+
+    Lines are read at most 64 KiB at a time so a child that never prints a
+    newline cannot make the reader buffer unbounded output.
+    """
+    with pipe:
+        for line in iter(lambda: pipe.readline(65536), b''):
+            writer.write(line)
+            tail.append(line)
+    writer.close()
+
+
+def run_logged(cmd: Union[str, List[str]], log_dir: str, name: str,
+               cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+               shell: bool = True, executable: Optional[str] = '/bin/bash',
+               tail_lines: int = 50, max_bytes: int = 64 * 1024 * 1024,
+               backup_count: int = 3, start_new_session: bool = False,
+               on_start: Optional[Callable[[subprocess.Popen], None]] = None,
+               stage: Optional[str] = None, inputs: Optional[List[str]] = None,
+               cores: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Run a command, streaming stdout and stderr to log files on disk.
+
+    Output is never accumulated in memory beyond the last tail_lines lines of
+    each stream, so memory use and the size of the returned record stay
+    constant however verbose the child is.
+
+    Args:
+        cmd: Command string (shell=True) or argument list (shell=False)
+        log_dir: Directory where the log files are written, relative paths are resolved against cwd
+        name: Base name of the logs, written as <name>.stdout.log and <name>.stderr.log
+        cwd: Optional working directory for the child
+        env: Optional environment for the child
+        shell: Run cmd through a shell (default: True)
+        executable: Shell used when shell=True (default: '/bin/bash')
+        tail_lines: Number of trailing lines of each stream kept in the result (default: 50)
+        max_bytes: Size at which a log file is rotated, 0 disables rotation (default: 64 MiB)
+        backup_count: Number of rotated files kept per stream (default: 3)
+        start_new_session: Start the child in its own session so its process group can be signalled (default: False)
+        on_start: Optional callback receiving the Popen object once the child has started
+        stage: Pipeline stage the launch is accounted to, e.g. 'run_refined_proc' (default: name)
+        inputs: Optional input files of the launch, recorded in its metrics
+        cores: Optional cores to pin the child and its descendants to, e.g. from placement.lease_cores
+
+    Returns:
+        dict: cmd, returncode, stdout_log/stderr_log paths, rotated log paths,
+        the stdout_tail/stderr_tail text and the child's resource usage under 'metrics'
+        (see gladier_ssx.metrics.wait_with_metrics)
+    """
+    if cwd and not os.path.isabs(log_dir):
+        log_dir = os.path.join(cwd, log_dir)
+    log_dir = os.path.normpath(log_dir)
+    os.makedirs(log_dir, exist_ok=True)
+
+    stdout_log = os.path.join(log_dir, f"{name}.stdout.log")
+    stderr_log = os.path.join(log_dir, f"{name}.stderr.log")
+    writers = {
+        'stdout': RotatingLogWriter(stdout_log, max_bytes, backup_count),
+        'stderr': RotatingLogWriter(stderr_log, max_bytes, backup_count),
+    }
+    tails = {
+        'stdout': deque(maxlen=tail_lines),
+        'stderr': deque(maxlen=tail_lines),
+    }
+
+    started, t0 = time.time(), time.monotonic()
+    with pinned(cores):
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=shell,
+            executable=executable if shell else None,
+            cwd=cwd,
+            env=env,
+            start_new_session=start_new_session,
+        )
+    pumps = [
+        threading.Thread(target=_pump, args=(proc.stdout, writers['stdout'], tails['stdout']), daemon=True),
+        threading.Thread(target=_pump, args=(proc.stderr, writers['stderr'], tails['stderr']), daemon=True),
+    ]
+    for pump in pumps:
+        pump.start()
+    if on_start is not None:
+        on_start(proc)
+    metrics = wait_with_metrics(proc, name, stage or name, started, t0, inputs, len(cores) if cores else None)
+    for pump in pumps:
+        pump.join()
+
+    return {
+        'cmd': cmd if isinstance(cmd, str) else " ".join(cmd),
+        'returncode': proc.returncode,
+        'stdout_log': stdout_log,
+        'stderr_log': stderr_log,
+        'logs': writers['stdout'].paths + writers['stderr'].paths,
+        'stdout_tail': b''.join(tails['stdout']).decode(errors='replace'),
+        'stderr_tail': b''.join(tails['stderr']).decode(errors='replace'),
+        'metrics': metrics,
+    }
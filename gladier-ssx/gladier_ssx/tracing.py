@@ -0,0 +1,135 @@
+"""Timeline export of a flow run in the Chrome trace event format.
+
+Tools return a 'span' record covering their own execution, and every
+command they launch through run_logged carries a 'metrics' record (see
+gladier_ssx.metrics). build_chrome_trace() turns both into trace events that open
+in chrome://tracing or https://ui.perfetto.dev: one process track per stage
+holding the stage span, with the launched jobs below it on as many lanes as
+were needed to run them side by side.
+"""
+from typing import Any, Dict, List, Optional
+import json
+import os
+import socket
+import time
+
+from .metrics import collect_metrics
+
+
+class Span:
+    """Wall-clock span of a tool call, finished into a plain record for the tool's result."""
+
+    def __init__(self, stage: str, **args: Any):
+        self.stage = stage
+        self.args = args
+        self.started = time.time()
+        self._t0 = time.monotonic()
+
+    def finish(self, **args: Any) -> Dict[str, Any]:
+        """Close the span and return its record, merging args into those given at the start."""
+        return {
+            'stage': self.stage,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'started': self.started,
+            'wall_time': time.monotonic() - self._t0,
+            'args': dict(self.args, **args),
+        }
+
+
+def collect_spans(result: Any) -> List[Dict[str, Any]]:
+    """Find every tool span nested anywhere in a tool result or flow output."""
+    found: Dict[tuple, Dict[str, Any]] = {}
+    stack = [result]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            span = item.get('span')
+            if isinstance(span, dict) and 'stage' in span:
+                found.setdefault((span['host'], span['pid'], span['started']), span)
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return sorted(found.values(), key=lambda span: span['started'])
+
+
+def _assign_lanes(records: List[Dict[str, Any]]) -> List[int]:
+    """Give each record the lowest lane that is free at its start, so overlapping jobs never share a lane."""
+    lane_ends: List[float] = []
+    lanes = []
+    for record in records:
+        end = record['started'] + record['wall_time']
+        for lane, lane_end in enumerate(lane_ends):
+            if lane_end <= record['started']:
+                lane_ends[lane] = end
+                break
+        else:
+            lane = len(lane_ends)
+            lane_ends.append(end)
+        lanes.append(lane)
+    return lanes
+
+
+def build_chrome_trace(result: Any) -> Dict[str, Any]:
+    """Build a Chrome trace from the spans and metrics records found in result.
+
+    Stages without a span of their own get one covering all of their jobs.
+    Timestamps are microseconds since the first event of the run.
+    """
+    spans = collect_spans(result)
+    records = collect_metrics(result)
+    stages: Dict[str, Dict[str, list]] = {}
+    for span in spans:
+        stages.setdefault(span['stage'], {'spans': [], 'records': []})['spans'].append(span)
+    for record in records:
+        stages.setdefault(record.get('stage', record['name']), {'spans': [], 'records': []})['records'].append(record)
+    if not stages:
+        return {'traceEvents': [], 'displayTimeUnit': 'ms'}
+
+    origin = min(item['started'] for stage in stages.values() for item in stage['spans'] + stage['records'])
+
+    def us(seconds: float) -> float:
+        return round(seconds * 1e6, 1)
+
+    events: List[Dict[str, Any]] = []
+    order = sorted(stages, key=lambda name: min(item['started'] for item in stages[name]['spans'] + stages[name]['records']))
+    for track, stage in enumerate(order, start=1):
+        stage_spans = stages[stage]['spans']
+        stage_records = stages[stage]['records']
+        if not stage_spans:
+            start = min(record['started'] for record in stage_records)
+            end = max(record['started'] + record['wall_time'] for record in stage_records)
+            stage_spans = [{'stage': stage, 'started': start, 'wall_time': end - start, 'args': {'derived': True}}]
+
+        events.append({'ph': 'M', 'name': 'process_name', 'pid': track, 'args': {'name': stage}})
+        events.append({'ph': 'M', 'name': 'process_sort_index', 'pid': track, 'args': {'sort_index': track}})
+        events.append({'ph': 'M', 'name': 'thread_name', 'pid': track, 'tid': 0, 'args': {'name': 'stage'}})
+        for span in stage_spans:
+            events.append({
+                'ph': 'X', 'name': stage, 'cat': 'stage', 'pid': track, 'tid': 0,
+                'ts': us(span['started'] - origin), 'dur': us(span['wall_time']),
+                'args': dict(span.get('args', {}), host=span.get('host'), os_pid=span.get('pid')),
+            })
+
+        lanes = _assign_lanes(stage_records)
+        for lane in range(max(lanes, default=-1) + 1):
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': track, 'tid': lane + 1,
+                           'args': {'name': f"jobs {lane + 1}"}})
+        for record, lane in zip(stage_records, lanes):
+            events.append({
+                'ph': 'X', 'name': record['name'], 'cat': 'job', 'pid': track, 'tid': lane + 1,
+                'ts': us(record['started'] - origin), 'dur': us(record['wall_time']),
+                'args': {key: record.get(key) for key in (
+                    'host', 'pid', 'cores', 'returncode', 'inputs', 'user_time', 'system_time',
+                    'max_rss_kb', 'read_bytes', 'write_bytes')},
+            })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'origin': origin}}
+
+
+def write_chrome_trace(result: Any, path: str) -> str:
+    """Write the Chrome trace of result to path and return the path."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as fp:
+        json.dump(build_chrome_trace(result), fp)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,65 @@
+"""Directory listings and master file metadata kept by gladier_ssx.catalog."""
+import os
+import sys
+
+import pytest
+
+from tool_source import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+from gladier_ssx.catalog import RunCatalog, open_catalog  # noqa: E402
+
+
+@pytest.fixture(params=[False, True], ids=['direct', 'cached'])
+def catalog(request, tmp_path):
+    # racy_window=0 so a listing is trusted straight away and the cached path is exercised
+    with RunCatalog(str(tmp_path / 'catalog.sqlite'), cache_listings=request.param, racy_window=0) as catalog:
+        yield catalog
+
+
+def test_glob_and_subdirs(catalog, tmp_path):
+    raster = tmp_path / 'raster'
+    fixtures.make_data_dir(str(tmp_path), n_masters=3)
+    open(raster / '.hidden_master.h5', 'w').close()
+
+    assert catalog.glob(str(raster), '*_master.h5') == [str(raster / f"r{i:05d}_master.h5") for i in range(3)]
+    assert catalog.glob(str(tmp_path / 'missing'), '*') == []
+    fixtures.make_refined_tree(str(tmp_path / 'refined'), 2)
+    os.makedirs(tmp_path / 'refined' / 'r00009')
+    assert catalog.subdirs(str(tmp_path / 'refined')) == ['r00000', 'r00001', 'r00009']
+    assert catalog.batch_dirs(str(tmp_path / 'refined')) == [
+        str(tmp_path / 'refined' / run / 'batch_1') for run in ('r00000', 'r00001')]
+
+
+def test_listing_follows_changes(catalog, tmp_path):
+    directory = tmp_path / 'raster'
+    os.makedirs(directory)
+    open(directory / 'a_master.h5', 'w').close()
+    assert catalog.glob(str(directory), '*_master.h5') == [str(directory / 'a_master.h5')]
+    open(directory / 'b_master.h5', 'w').close()
+    os.utime(directory, ns=(0, os.stat(directory).st_mtime_ns + 1))
+    assert catalog.glob(str(directory), '*_master.h5') == [str(directory / 'a_master.h5'),
+                                                           str(directory / 'b_master.h5')]
+
+
+def test_master_metadata_and_first_master(catalog, tmp_path):
+    os.makedirs(tmp_path / 'raster')
+    master = fixtures.make_master_h5(str(tmp_path / 'raster' / 'r00000_master.h5'), 7, wavelength=0.979)
+    open(tmp_path / 'raster' / 'r00001_master.h5', 'w').close()
+
+    assert catalog.first_master(str(tmp_path)) == master
+    metadata = catalog.master_metadata([master, str(tmp_path / 'raster' / 'r00001_master.h5')])
+    assert metadata[master]['n_images'] == 7 and metadata[master]['wavelength'] == pytest.approx(0.979)
+    assert metadata[str(tmp_path / 'raster' / 'r00001_master.h5')] is None
+
+
+def test_open_catalog_default_and_fallback(tmp_path):
+    with open_catalog(root=str(tmp_path)) as catalog:
+        assert catalog.index_path == os.path.join(str(tmp_path), '.ssx_catalog.sqlite')
+    assert os.path.isfile(tmp_path / '.ssx_catalog.sqlite')
+
+    with open_catalog(str(tmp_path / 'missing' / 'catalog.sqlite')) as catalog:
+        assert catalog.index_path == ':memory:'
+        assert catalog.glob(str(tmp_path), '.ssx_*') == [str(tmp_path / '.ssx_catalog.sqlite')]
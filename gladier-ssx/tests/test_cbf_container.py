@@ -0,0 +1,59 @@
+"""Writing CBF stills into an HDF5 container and reading them back byte for byte."""
+import os
+import sys
+
+import pytest
+
+from tool_source import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+from gladier_ssx.cbf_container import (container_frames, extract_frames, read_frames,  # noqa: E402
+                                       verify_container, write_container)
+
+
+@pytest.fixture
+def frames(tmp_path):
+    cbf_dir = str(tmp_path / 'cbf')
+    fixtures.make_cbf_frames(cbf_dir, 'chip', 1, 6, shape=(64, 64))
+    return sorted(os.path.join(cbf_dir, name) for name in os.listdir(cbf_dir) if name.endswith('.cbf'))
+
+
+def read(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def test_round_trip(frames, tmp_path):
+    container = str(tmp_path / 'chip_1.h5')
+    # A small chunk makes the writer flush several times
+    stats = write_container(frames[::-1], container, chunk_bytes=4096)
+
+    assert stats['frames'] == 6 and stats['bytes_in'] == sum(os.path.getsize(path) for path in frames)
+    assert container_frames(container) == [1, 2, 3, 4, 5, 6]
+    verify_container(container, frames)
+    assert {name: bytes(content) for name, content in read_frames(container, [2, 5], block_bytes=1)} == \
+        {os.path.basename(frames[i]): read(frames[i]) for i in (1, 4)}
+
+    extracted = extract_frames(container, None, str(tmp_path / 'out'))
+    assert [read(path) for path in extracted] == [read(path) for path in frames]
+
+
+def test_missing_frame_is_an_error(frames, tmp_path):
+    container = str(tmp_path / 'chip_1.h5')
+    write_container(frames, container)
+    with pytest.raises(RuntimeError):
+        list(read_frames(container, [7]))
+
+
+def test_verify_rejects_changed_and_missing_files(frames, tmp_path):
+    container = str(tmp_path / 'chip_1.h5')
+    write_container(frames, container)
+    with pytest.raises(RuntimeError):
+        verify_container(container, frames[:-1])
+    with open(frames[0], 'r+b') as fp:
+        fp.seek(-1, os.SEEK_END)
+        fp.write(b'!')
+    with pytest.raises(RuntimeError):
+        verify_container(container, frames)
@@ -0,0 +1,138 @@
+"""Geometry defaults create_phil takes from a master file, where it keeps the run catalog and how it keys phils."""
+import hashlib
+import json
+import os
+import sys
+
+from tool_source import ROOT, load_tool
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+from gladier_ssx.int_index import IntIndex  # noqa: E402
+
+create_phil = load_tool('create_phil')
+
+
+def make_data_dir(path, det_distance=None):
+    """A data directory with one master file and a beamline JSON, without xy.json."""
+    beamline = {'beamline_input': {'energy': '12.663'}, 'user_input': dict(fixtures.BEAMLINE_JSON['user_input'])}
+    if det_distance is not None:
+        beamline['beamline_input']['det_distance'] = det_distance
+    os.makedirs(os.path.join(path, 'raster'))
+    with open(os.path.join(path, 'beamline_run1.json'), 'w') as fp:
+        json.dump(beamline, fp)
+    fixtures.make_master_h5(os.path.join(path, 'raster', 'r00000_master.h5'), 10, detector_distance=0.2,
+                            beam_center=(2070.0, 2180.0), pixel_size=75e-6, wavelength=0.979)
+    return str(path)
+
+
+def phil_text(path):
+    with open(path) as fp:
+        return fp.read()
+
+
+def test_geometry_defaults_come_from_the_master_file(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data')
+    phil = phil_text(create_phil(data_dir=data_dir, proc_dir=str(tmp_path / 'proc'), run_num=1))
+
+    # 2070 and 2180 pixels of 0.075 mm, 0.2 m
+    assert 'origin    = -155.25, 163.5, -200.0' in phil
+    assert 'wavelength = 0.979' in phil
+
+
+def test_beamline_json_and_overrides_take_precedence(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data', det_distance='150')
+    phil = phil_text(create_phil(data_dir=data_dir, proc_dir=str(tmp_path / 'proc'), run_num=1, beamx=-100.0))
+
+    assert 'origin    = -100.0, 163.5, -150.0' in phil
+
+
+def test_catalog_is_kept_in_proc_dir(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data')
+    proc_dir = str(tmp_path / 'proc')
+    create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1)
+
+    assert os.path.isfile(os.path.join(proc_dir, '.ssx_catalog.sqlite'))
+    assert not os.path.exists(os.path.join(data_dir, '.ssx_catalog.sqlite'))
+
+
+def test_unusable_catalog_is_treated_as_none(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data')
+    catalog = str(tmp_path / 'missing' / 'catalog.sqlite')
+    phil = phil_text(create_phil(data_dir=data_dir, proc_dir=str(tmp_path / 'proc'), run_num=1, catalog=catalog))
+
+    assert 'wavelength = 0.979' in phil
+    assert not os.path.exists(catalog)
+
+
+def test_unchanged_request_keeps_the_phil(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data')
+    proc_dir = str(tmp_path / 'proc')
+    phil = create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1)
+    target = os.readlink(phil)
+    mtime = os.stat(os.path.join(proc_dir, target)).st_mtime_ns
+
+    assert create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1) == phil
+    assert os.readlink(phil) == target
+    assert os.stat(os.path.join(proc_dir, target)).st_mtime_ns == mtime
+    # Touched inputs that render the same phil keep its key
+    os.utime(os.path.join(data_dir, 'beamline_run1.json'))
+    create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1)
+    assert os.readlink(phil) == target
+
+
+def test_changed_phil_moves_outputs_of_the_old_one(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data')
+    proc_dir = str(tmp_path / 'proc')
+    phil = create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1, chip_name='chip')
+    old_key = os.readlink(phil)[len('process_1.'):-len('.phil')]
+    outputs = ['int-0-chip_1_00001.pickle', 'log-chip_1_00001.0.log', 'idx-chip_1_00001_integrated.refl']
+    kept = ['int-0-other_1_00001.pickle', 'int-0-chip_2_00001.pickle', 'chip_ints.txt']
+    for name in outputs + kept[:-1]:
+        open(os.path.join(proc_dir, name), 'w').close()
+    index = IntIndex(os.path.join(proc_dir, 'chip_ints.txt'))
+    index.append([os.path.join(proc_dir, 'int-0-chip_1_00001.pickle'),
+                  os.path.join(proc_dir, 'int-0-chip_2_00001.pickle')])
+
+    create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1, chip_name='chip', unit_cell='80,80,40,90,90,90')
+
+    assert os.readlink(phil) != f"process_1.{old_key}.phil"
+    assert 'unit_cell = 80 80 40 90 90 90' in phil_text(phil)
+    assert sorted(os.listdir(os.path.join(proc_dir, 'stale', old_key))) == sorted(outputs)
+    assert all(os.path.exists(os.path.join(proc_dir, name)) for name in kept)
+    assert index.paths() == [os.path.join(proc_dir, 'int-0-chip_2_00001.pickle')]
+
+
+def test_legacy_phil_is_keyed_and_its_outputs_moved(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data')
+    proc_dir = str(tmp_path / 'proc')
+    os.makedirs(proc_dir)
+    legacy_text = "# written before phils were keyed\n"
+    with open(os.path.join(proc_dir, 'process_1.phil'), 'w') as fp:
+        fp.write(legacy_text)
+    open(os.path.join(proc_dir, 'int-0-chip_1_00001.pickle'), 'w').close()
+
+    phil = create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1)
+
+    legacy_key = hashlib.sha256(legacy_text.encode()).hexdigest()[:12]
+    assert os.path.islink(phil) and os.readlink(phil) != f"process_1.{legacy_key}.phil"
+    assert phil_text(os.path.join(proc_dir, f"process_1.{legacy_key}.phil")) == legacy_text
+    assert os.listdir(os.path.join(proc_dir, 'stale', legacy_key)) == ['int-0-chip_1_00001.pickle']
+    assert not [name for name in os.listdir(proc_dir) if name.endswith('.tmp')]
+
+
+def test_legacy_phil_with_the_same_text_becomes_a_link(tmp_path):
+    data_dir = make_data_dir(tmp_path / 'data')
+    proc_dir = str(tmp_path / 'proc')
+    phil = create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1)
+    text = phil_text(phil)
+    os.remove(phil)
+    with open(phil, 'w') as fp:
+        fp.write(text)
+    open(os.path.join(proc_dir, 'int-0-chip_1_00001.pickle'), 'w').close()
+
+    create_phil(data_dir=data_dir, proc_dir=proc_dir, run_num=1)
+    assert os.path.islink(phil) and phil_text(phil) == text
+    assert os.path.exists(os.path.join(proc_dir, 'int-0-chip_1_00001.pickle'))
+    assert not os.path.exists(os.path.join(proc_dir, 'stale'))
@@ -0,0 +1,136 @@
+"""Every funcx_functions entry run from its source alone, as Globus Compute ships it to the endpoint.
+
+The function's source is cut out of its tool module and exec'd in a clean
+interpreter that has gladier_ssx installed but neither gladier nor tools/, then
+called on stand-in data with the DIALS programs replaced by benchmarks/standin.py.
+The signatures' typing annotations are left unevaluated; the bodies have to
+import everything else they use.
+"""
+import builtins
+import glob
+import json
+import os
+import subprocess
+import sys
+import symtable
+
+import pytest
+
+from tool_source import ROOT, SOURCES, payload
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+
+DRIVER = """
+import json, os, sys
+spec = json.load(open(sys.argv[1]))
+sys.path.insert(0, spec['site'])
+try:
+    import tools
+except ImportError:
+    pass
+else:
+    raise SystemExit('tools/ is importable, so this run proves nothing')
+namespace = {'__name__': '__main__'}
+exec(compile(spec['source'], spec['name'], 'exec'), namespace)
+os.chdir(spec['cwd'])
+result = namespace[spec['name']](**spec['data'])
+with open(spec['output'], 'w') as fp:
+    json.dump(result, fp, default=str)
+"""
+
+
+def global_names(table):
+    """Names a function body and the scopes nested in it look up as module globals."""
+    names = {symbol.get_name() for symbol in table.get_symbols()
+             if symbol.is_global() and symbol.is_referenced()}
+    for child in table.get_children():
+        names |= global_names(child)
+    return names
+
+
+@pytest.mark.parametrize('name', sorted(SOURCES))
+def test_body_uses_no_module_globals(name):
+    (function,) = [child for child in symtable.symtable(payload(name), name, 'exec').get_children()
+                   if child.get_name() == name]
+    assert global_names(function) - set(dir(builtins)) == set()
+
+
+@pytest.fixture(scope='module')
+def endpoint_runs(tmp_path_factory):
+    """Run every funcx function in order in its own clean interpreter, as the SSX flows chain them."""
+    root = str(tmp_path_factory.mktemp('endpoint'))
+    site = os.path.join(root, 'site-packages')
+    os.makedirs(site)
+    os.symlink(os.path.join(ROOT, 'gladier_ssx'), os.path.join(site, 'gladier_ssx'))
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('PATH', os.environ['PATH'])
+        dials_path = fixtures.make_bin(os.path.join(root, 'dials'))
+        env = {'PATH': os.environ['PATH'], 'HOME': root}
+
+    env_cache = os.path.join(root, 'env_cache')
+    data_dir = fixtures.make_data_dir(os.path.join(root, 'data'), n_masters=4)
+    cbf_dir = fixtures.make_cbfs(os.path.join(root, 'cbf'), 'chip', 1, 10)
+    with open(os.path.join(cbf_dir, 'beamline_run1.json'), 'w') as fp:
+        json.dump(fixtures.BEAMLINE_JSON, fp)
+    proc_dir = os.path.join(root, 'proc')
+    prime_dir = os.path.join(root, 'prime')
+    end_marker = os.path.join(root, 'collection_done')
+    open(end_marker, 'w').close()
+    # The stand-in xia2.ssx writes no geometry for stream_refined_proc to wait for
+    geometry = os.path.join(root, 'refined.expt')
+    open(geometry, 'w').close()
+    batch = {'data_dir': cbf_dir, 'run_num': 1, 'chip_name': 'chip', 'cbf_num': 10, 'stills_batch_size': 10}
+    dials = {'dials_path': dials_path, 'env_cache_dir': env_cache}
+
+    runs = {}
+
+    def run(name, cwd=root, **data):
+        spec_path = os.path.join(root, f"{name}.json")
+        output = os.path.join(root, f"{name}.result.json")
+        with open(spec_path, 'w') as fp:
+            json.dump({'site': site, 'source': payload(name), 'name': name, 'cwd': cwd,
+                       'data': data, 'output': output}, fp)
+        proc = subprocess.run([sys.executable, '-I', '-c', DRIVER, spec_path], cwd=root, env=env,
+                              capture_output=True, text=True, timeout=120)
+        result = None
+        if proc.returncode == 0:
+            with open(output) as fp:
+                result = json.load(fp)
+        runs[name] = {'returncode': proc.returncode, 'stderr': proc.stderr, 'result': result}
+
+    run('create_phil', data_dir=cbf_dir, proc_dir=proc_dir, run_num=1, chip_name='chip')
+    run('repack_cbf', container_dir=os.path.join(root, 'containers'), **batch)
+    run('dials_stills', proc_dir=proc_dir, filename='chip_1_00010.cbf', **batch, **dials)
+    run('dials_prime', data_dir=cbf_dir, proc_dir=proc_dir, prime_dir=prime_dir, run_num=1,
+        chip_name='chip', **dials)
+    logs = glob.glob(os.path.join(prime_dir, 'chip_*_prime', 'log.txt'))
+    run('primalisys', prime_dir=prime_dir, upload_dir=prime_dir, prime_input=logs[0] if logs else 'missing',
+        plot='none')
+    run('primalisys_batch', prime_root=prime_dir, upload_dir=os.path.join(root, 'upload'), workers=1)
+    run('run_initial_proc', data_dir=data_dir, run_num=1, reuse_geometry=False,
+        geometry_registry=os.path.join(root, 'registry.json'))
+    run('run_refined_proc', cwd=data_dir, max_jobs=2, reuse_geometry=False, refined_geometry=geometry)
+    run('merge_all', cwd=data_dir, **dials)
+    run('run_prime', cwd=data_dir)
+    run('stream_refined_proc', cwd=data_dir, reuse_geometry=False, refined_geometry=geometry, merge_every=1,
+        poll_interval=0.05, settle_seconds=0, end_marker=end_marker, **dials)
+    return runs
+
+
+@pytest.mark.parametrize('name', sorted(SOURCES))
+def test_runs_from_source_in_clean_interpreter(endpoint_runs, name):
+    assert name in endpoint_runs, f"{name} has no stand-in input in endpoint_runs"
+    run = endpoint_runs[name]
+    assert run['returncode'] == 0, run['stderr']
+
+
+def test_chained_runs_did_their_work(endpoint_runs):
+    assert endpoint_runs['dials_stills']['result']['n_integrated'] == 10
+    assert endpoint_runs['run_refined_proc']['result']['succeeded'] == 4
+    assert endpoint_runs['merge_all']['result']['returncode'] == 0
+    stream = endpoint_runs['stream_refined_proc']['result']
+    assert stream['skipped'] == 4
+    assert all('error' not in merge['merge_all'] for merge in stream['merges'])
@@ -0,0 +1,82 @@
+"""Registering refined geometries by content and keying them as create_phil renders the phil."""
+import json
+import os
+import sys
+
+from tool_source import ROOT, load_tool
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+from gladier_ssx.geometry_registry import find_geometry, register_geometry  # noqa: E402
+from gladier_ssx.refinement import run_geometry  # noqa: E402
+
+GEOMETRY = {'det_distance': 200.0, 'energy': 12.663, 'beamx': -214.4, 'beamy': 218.2}
+
+
+def write(path, text):
+    with open(path, 'w') as fp:
+        fp.write(text)
+    return str(path)
+
+
+def test_registered_geometry_is_a_copy(tmp_path):
+    registry = str(tmp_path / 'registry' / 'registry.json')
+    refined = write(tmp_path / 'refined.expt', 'first')
+    stored = register_geometry(GEOMETRY, refined, registry)
+    write(refined, 'rewritten by a later run')
+
+    assert find_geometry(GEOMETRY, registry) == stored
+    with open(stored) as fp:
+        assert fp.read() == 'first'
+
+
+def test_registering_the_same_content_keeps_one_entry(tmp_path):
+    registry = str(tmp_path / 'registry.json')
+    register_geometry(GEOMETRY, write(tmp_path / 'a.expt', 'same'), registry)
+    register_geometry(GEOMETRY, write(tmp_path / 'b.expt', 'same'), registry)
+
+    with open(registry) as fp:
+        assert len(json.load(fp)) == 1
+
+
+def test_modified_copy_is_rejected(tmp_path):
+    registry = str(tmp_path / 'registry.json')
+    stored = register_geometry(GEOMETRY, write(tmp_path / 'refined.expt', 'first'), registry)
+    write(stored, 'tampered')
+
+    assert find_geometry(GEOMETRY, registry) is None
+
+
+def test_key_matches_the_phil_create_phil_renders(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    os.makedirs(os.path.join(data_dir, 'raster'))
+    # No det_distance in the beamline JSON and no xy.json: both come from the master file
+    with open(os.path.join(data_dir, 'beamline_run1.json'), 'w') as fp:
+        json.dump({'beamline_input': {'energy': '12.663'}, 'user_input': fixtures.BEAMLINE_JSON['user_input']}, fp)
+    fixtures.make_master_h5(os.path.join(data_dir, 'raster', 'r00000_master.h5'), 10, detector_distance=0.2,
+                            beam_center=(2070.0, 2180.0), pixel_size=75e-6, wavelength=0.979)
+    proc_dir = str(tmp_path / 'proc')
+    with open(load_tool('create_phil')(data_dir=data_dir, proc_dir=proc_dir, run_num=1, beamy=150.0)) as fp:
+        phil = fp.read()
+
+    geometry = run_geometry({'run_num': 1, 'beamy': 150.0}, data_dir, proc_dir)
+    assert geometry == {'det_distance': 200.0, 'energy': 12.663, 'beamx': -155.25, 'beamy': 150.0}
+    assert (f"origin    = {geometry['beamx']}, {geometry['beamy']}, {-geometry['det_distance']}") in phil
+
+
+def test_explicit_refined_geometry_is_not_replaced(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    fixtures.make_bin(str(tmp_path / 'dials'))
+    data_dir = fixtures.make_data_dir(str(tmp_path / 'data'), n_masters=1)
+    registry = str(tmp_path / 'registry.json')
+    register_geometry(GEOMETRY, write(tmp_path / 'registered.expt', 'registered'), registry)
+    explicit = write(tmp_path / 'explicit.expt', 'explicit')
+    monkeypatch.chdir(data_dir)
+    run_refined_proc = load_tool('run_refined_proc')
+
+    result = run_refined_proc(run_num=1, geometry_registry=registry, refined_geometry=explicit)
+    assert f"reference_geometry={explicit}" in result['jobs'][0]['cmd']
+
+    result = run_refined_proc(run_num=1, geometry_registry=registry, force=True)
+    assert f"reference_geometry={find_geometry(GEOMETRY, registry)}" in result['jobs'][0]['cmd']
@@ -0,0 +1,56 @@
+"""CBF byte-offset decoding in gladier_ssx.hit_finding, against the reference encoder in benchmarks/fixtures, and mask loading."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from tool_source import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+from gladier_ssx.hit_finding import decode_byte_offset, load_mask, read_cbf  # noqa: E402
+
+INT32 = np.iinfo(np.int32)
+
+
+@pytest.mark.parametrize('values, escape', [
+    ([0, 5, -3, 127, -1, 0], b'\x80'),
+    ([0, 200, -300, 32767, -32767], b'\x80'),
+    ([0, 40000, -70000, 1 << 30, -(1 << 30)], b'\x80\x00\x80'),
+    ([INT32.min, INT32.max, INT32.min, 0, INT32.max], b'\x80\x00\x80\x00\x00\x00\x80'),
+], ids=['int8', 'int16', 'int32', 'int64'])
+def test_round_trip(values, escape):
+    image = np.array(values, dtype=np.int32)
+    data = fixtures.encode_byte_offset(image)
+    assert escape in data
+    np.testing.assert_array_equal(decode_byte_offset(data, len(image)), image)
+
+
+def test_round_trip_random_image():
+    rng = np.random.default_rng(0)
+    image = rng.poisson(3, 4096).astype(np.int32)
+    spikes = rng.choice(image.size, 50, replace=False)
+    image[spikes] = rng.integers(INT32.min, INT32.max, 50, dtype=np.int64)
+    np.testing.assert_array_equal(decode_byte_offset(fixtures.encode_byte_offset(image), image.size), image)
+
+
+def test_short_data_is_an_error():
+    with pytest.raises(RuntimeError):
+        decode_byte_offset(fixtures.encode_byte_offset(np.arange(10)), 11)
+
+
+def test_read_cbf(tmp_path):
+    image = np.arange(-600, 600, dtype=np.int32).reshape(30, 40)
+    path = fixtures.write_cbf(str(tmp_path / 'chip_1_00001.cbf'), image)
+    np.testing.assert_array_equal(read_cbf(path), image)
+
+
+def test_mask_rewritten_in_place_is_loaded_again(tmp_path):
+    path = str(tmp_path / 'mask.npy')
+    np.save(path, np.ones((2, 3), dtype=bool))
+    assert load_mask(path).all()
+
+    np.save(path, np.zeros((3, 3), dtype=bool))
+    assert load_mask(path).shape == (3, 3) and not load_mask(path).any()
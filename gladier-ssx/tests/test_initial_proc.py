@@ -0,0 +1,28 @@
+"""Adaptive initial refinement in run_initial_proc, with benchmarks/standin.py as xia2.ssx."""
+import os
+import sys
+
+from tool_source import ROOT, load_tool
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+
+
+def test_adaptive_run_replaces_an_earlier_geometry_refinement(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    fixtures.make_bin(str(tmp_path / 'dials'))
+    data_dir = fixtures.make_data_dir(str(tmp_path / 'data'), n_masters=6)
+    output_dir = os.path.join(data_dir, 'initial_refinement')
+    # Left by an earlier non-adaptive run
+    os.makedirs(os.path.join(output_dir, 'geometry_refinement'))
+    open(os.path.join(output_dir, 'geometry_refinement', 'refined.expt'), 'w').close()
+    monkeypatch.chdir(data_dir)
+
+    result = load_tool('run_initial_proc')(data_dir=data_dir, adaptive=True, n_files=2, max_files=6,
+                                           reuse_geometry=False)
+
+    assert result['returncode'] == 0 and len(result['rounds']) >= 2
+    link = os.path.join(output_dir, 'geometry_refinement')
+    assert os.path.islink(link) and os.readlink(link) == os.path.join(result['output_dir'], 'geometry_refinement')
+    assert not [name for name in os.listdir(output_dir) if name.startswith('geometry_refinement.')]
@@ -0,0 +1,73 @@
+"""The append-only index of integrated pickles and the PRIME trigger policy in gladier_ssx.int_index."""
+import os
+
+from gladier_ssx.int_index import (IntIndex, integrated_pickles, load_trigger_state, save_trigger_state,
+                                   should_trigger)
+
+
+def touch(path):
+    open(path, 'w').close()
+    return os.path.abspath(path)
+
+
+def test_append_remove_and_snapshot(tmp_path):
+    index = IntIndex(str(tmp_path / 'chip_ints.txt'))
+    assert len(index) == 0 and index.paths() == []
+
+    paths = [str(tmp_path / f"int-0-chip_1_{n:05d}.pickle") for n in range(4)]
+    index.append(paths[:3])
+    index.append(paths[3:])
+    assert len(index) == 4 and index.paths() == paths
+
+    snapshot = str(tmp_path / 'snapshot.txt')
+    assert index.snapshot(snapshot) == 4
+    assert index.remove([paths[1], str(tmp_path / 'not-indexed.pickle')]) == 1
+    assert index.paths() == [paths[0]] + paths[2:]
+    with open(snapshot) as fp:
+        assert fp.read().splitlines() == paths
+
+
+def test_torn_append_is_cut_off(tmp_path):
+    index = IntIndex(str(tmp_path / 'chip_ints.txt'))
+    index.append([str(tmp_path / 'int-0-a.pickle')])
+    # A writer that died mid-append left a partial line past the recorded end
+    with open(index.index_path, 'a') as fp:
+        fp.write('/partial/int-0-b.pic')
+    assert index.paths() == [str(tmp_path / 'int-0-a.pickle')]
+    index.append([str(tmp_path / 'int-0-c.pickle')])
+    assert index.paths() == [str(tmp_path / 'int-0-a.pickle'), str(tmp_path / 'int-0-c.pickle')]
+
+
+def test_update_from_dir(tmp_path):
+    kept = touch(tmp_path / 'int-0-chip_1_00001.pickle')
+    gone = str(tmp_path / 'int-0-chip_1_00002.pickle')
+    elsewhere = '/elsewhere/int-0-chip_1_00003.pickle'
+    index = IntIndex(str(tmp_path / 'chip_ints.txt'))
+    index.append([kept, gone, elsewhere])
+    new = touch(tmp_path / 'int-1-chip_1_00001.pickle')
+    touch(tmp_path / 'idx-chip_1_00001.refl')
+
+    assert index.update_from_dir(str(tmp_path)) == [new]
+    assert index.paths() == [kept, elsewhere, new]
+
+
+def test_integrated_pickles(tmp_path):
+    first = touch(tmp_path / 'int-0-chip_1_00001.pickle')
+    second = touch(tmp_path / 'int-1-chip_1_00001.pickle')
+    touch(tmp_path / 'int-3-chip_1_00001.pickle')
+    assert integrated_pickles(str(tmp_path), ['/data/chip_1_00001.cbf', '/data/chip_1_00002.cbf']) == \
+        [first, second]
+
+
+def test_trigger_policy(tmp_path):
+    assert should_trigger(1, 0)
+    assert not should_trigger(5, 5)
+    assert not should_trigger(109, 100, min_new_frames=10)
+    assert should_trigger(110, 100, min_new_frames=10)
+    assert not should_trigger(140, 100, min_new_fraction=0.5)
+    assert should_trigger(150, 100, min_new_fraction=0.5)
+
+    state = str(tmp_path / 'trigger.json')
+    assert load_trigger_state(state) == {}
+    save_trigger_state(state, 150, 'chip_3_prime')
+    assert load_trigger_state(state) == {'last_count': 150, 'run_name': 'chip_3_prime'}
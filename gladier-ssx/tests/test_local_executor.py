@@ -0,0 +1,81 @@
+"""Dependency ordering of gladier_ssx.local_executor, on stand-in tool classes."""
+import json
+import os
+import time
+
+import pytest
+
+from gladier_ssx.local_executor import run_local, stage_graph
+
+
+def make_tool(name, consumes=None, produces=None, seconds=0.0, fail=False):
+    """A tool class whose single function records when it ran in <name>.json of the current directory."""
+    def func(**data):
+        started = time.time()
+        time.sleep(seconds)
+        if fail:
+            raise ValueError(f"{name} failed")
+        with open(f"{name}.json", 'w') as fp:
+            json.dump({'started': started, 'finished': time.time()}, fp)
+        return {'stage': name, 'input': data.get('value')}
+    func.__name__ = func.__qualname__ = name
+    globals()[name] = func  # picklable by name for the process pool
+    attrs = {'funcx_functions': [func]}
+    if consumes is not None:
+        attrs['consumes'] = consumes
+    if produces is not None:
+        attrs['produces'] = produces
+    return type(name.title(), (), attrs)
+
+
+def test_stage_graph_follows_artifacts_and_barriers():
+    tools = [make_tool('phil', [], ['phil']),
+             make_tool('initial', ['phil'], ['geometry']),
+             make_tool('stills', ['phil'], ['ints']),
+             make_tool('refined', ['phil', 'geometry'], ['batches']),
+             make_tool('barrier'),
+             make_tool('prime', ['ints', 'external'], ['prime_log'])]
+
+    assert stage_graph(tools) == {
+        'phil': set(),
+        'initial': {'phil'},
+        'stills': {'phil'},
+        'refined': {'phil', 'initial'},
+        'barrier': {'phil', 'initial', 'stills', 'refined'},
+        'prime': {'stills', 'barrier'},
+    }
+
+
+def test_stage_graph_takes_the_latest_producer():
+    tools = [make_tool('first', [], ['ints']), make_tool('second', ['ints'], ['ints']),
+             make_tool('reader', ['ints'], [])]
+    assert stage_graph(tools)['reader'] == {'second'}
+
+
+def test_duplicate_stage_is_an_error():
+    with pytest.raises(RuntimeError):
+        stage_graph([make_tool('twice', [], []), make_tool('twice', [], [])])
+
+
+def test_run_local_starts_stages_after_their_dependencies(tmp_path):
+    tools = [make_tool('slow_source', [], ['a'], seconds=0.3),
+             make_tool('independent', [], ['b']),
+             make_tool('dependent', ['a'], ['c'])]
+    results = run_local(tools, {'value': 1}, max_workers=3, stage_input={'dependent': {'value': 2}},
+                        cwd=str(tmp_path))
+
+    assert list(results) == ['slow_source', 'independent', 'dependent']
+    assert results['dependent'] == {'stage': 'dependent', 'input': 2}
+    times = {}
+    for name in results:
+        with open(tmp_path / f"{name}.json") as fp:
+            times[name] = json.load(fp)
+    assert times['dependent']['started'] >= times['slow_source']['finished']
+    assert times['independent']['finished'] < times['slow_source']['finished']
+
+
+def test_failed_stage_stops_its_dependents(tmp_path):
+    tools = [make_tool('broken', [], ['a'], fail=True), make_tool('after_broken', ['a'], [])]
+    with pytest.raises(RuntimeError, match='broken'):
+        run_local(tools, {}, cwd=str(tmp_path))
+    assert not os.path.exists(tmp_path / 'after_broken.json')
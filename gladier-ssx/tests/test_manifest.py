@@ -0,0 +1,63 @@
+"""The manifest of refined master files kept by gladier_ssx.refinement."""
+import os
+import sys
+import threading
+
+from tool_source import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+from gladier_ssx.refinement import (load_manifest, manifest_current, master_outdir,  # noqa: E402
+                                    master_signature, update_manifest)
+
+
+def test_signature_follows_master_and_data_files(tmp_path):
+    fixtures.make_data_dir(str(tmp_path), n_masters=1)
+    master = str(tmp_path / 'raster' / 'r00000_master.h5')
+    signature = master_signature(master)
+    assert list(signature['data_files']) == ['r00000_data_000001.h5']
+    assert 'sha256' in master_signature(master, checksum=True)
+
+    # Data still arriving after the master file was refined
+    with open(tmp_path / 'raster' / 'r00000_data_000001.h5', 'ab') as fp:
+        fp.write(b'\0' * 10)
+    assert master_signature(master) != signature
+
+
+def test_manifest_current(tmp_path):
+    refined_dir = str(tmp_path / 'refined')
+    master = 'raster/r00000_master.h5'
+    signature = {'size': 1, 'mtime_ns': 2, 'data_files': {}, 'phil': 'a', 'geometry': 'b'}
+    manifest = {master: dict(signature, returncode=0, cmd='xia2.ssx')}
+    # batch_1 of the earlier run is gone
+    assert not manifest_current(manifest, master, signature, refined_dir)
+
+    os.makedirs(os.path.join(master_outdir(master, refined_dir), 'batch_1'))
+    assert master_outdir(master, refined_dir) == f"{refined_dir}/ref_r00000"
+    assert manifest_current(manifest, master, signature, refined_dir)
+    assert not manifest_current(manifest, master, dict(signature, phil='changed'), refined_dir)
+    assert not manifest_current({master: dict(manifest[master], returncode=1)}, master, signature, refined_dir)
+    assert not manifest_current({}, master, signature, refined_dir)
+
+
+def test_concurrent_updates_keep_every_entry(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    assert load_manifest(path) == {}
+
+    def add(start):
+        for n in range(start, start + 20):
+            update_manifest(path, {f"r{n:05d}": {'returncode': 0}})
+
+    threads = [threading.Thread(target=add, args=(start,)) for start in (0, 20, 40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(load_manifest(path)) == [f"r{n:05d}" for n in range(60)]
+
+
+def test_unreadable_manifest_is_empty(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text('{"torn')
+    assert load_manifest(str(path)) == {}
@@ -0,0 +1,62 @@
+"""Sharded merging in gladier_ssx.merging, with benchmarks/standin.py as xia2.ssx_reduce."""
+import json
+import os
+import sys
+
+import pytest
+
+from tool_source import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+from gladier_ssx.merging import merge_all  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    dials_path = fixtures.make_bin(str(tmp_path / 'dials'))
+    data_dir = fixtures.make_data_dir(str(tmp_path / 'data'), n_masters=0)
+    fixtures.make_refined_tree(os.path.join(data_dir, 'refined'), 5)
+    monkeypatch.chdir(data_dir)
+    return {'dials_path': dials_path, 'env_cache_dir': str(tmp_path / 'env_cache')}
+
+
+def scaled_batches(path):
+    with open(path) as fp:
+        return json.load(fp)['n_batches']
+
+
+def test_sharded_merge_covers_every_batch(data_dir):
+    cwd = os.getcwd()
+    result = merge_all(shard_size=2, max_jobs=2, **data_dir)
+    output_dir = os.path.abspath('final_merge')
+
+    assert result['returncode'] == 0
+    # 5 batches in shards of 2: three shards, then two, then the final merge
+    assert [shard['level'] for shard in result['shards']] == [0, 0, 0, 1, 1]
+    assert result['level'] == 2
+    assert [shard['n_inputs'] for shard in result['shards']] == [2, 2, 1, 4, 2]
+    assert scaled_batches(os.path.join(output_dir, 'DataFiles', 'scaled.expt')) == 5
+    assert scaled_batches(os.path.join(output_dir, 'shards', 'level0_0002', 'DataFiles', 'scaled.expt')) == 1
+    assert os.getcwd() == cwd
+
+
+def test_unsharded_merge(data_dir):
+    result = merge_all(**data_dir)
+    assert result['returncode'] == 0 and result['n_inputs'] == 5 and 'shards' not in result
+    assert scaled_batches(os.path.join('final_merge', 'DataFiles', 'scaled.expt')) == 5
+
+
+def test_failed_shard_stops_the_merge(data_dir, monkeypatch):
+    monkeypatch.setenv('SSX_STANDIN_XIA2_SSX_REDUCE_FAIL', '1')
+    result = merge_all(shard_size=2, **data_dir)
+    assert result['returncode'] != 0
+    assert {shard['level'] for shard in result['shards']} == {0}
+    assert not os.path.exists(os.path.join('final_merge', 'DataFiles'))
+
+
+def test_shard_size_below_two_is_an_error(data_dir):
+    with pytest.raises(RuntimeError):
+        merge_all(shard_size=1, **data_dir)
@@ -0,0 +1,47 @@
+"""Core partitioning and leasing in gladier_ssx.placement."""
+import json
+import os
+import subprocess
+import sys
+
+from gladier_ssx.placement import job_nproc, lease_cores, partition_cores, pinned
+
+
+def test_partition_cores():
+    assert partition_cores(3, range(8)) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert partition_cores(1, [4, 5]) == [[4, 5]]
+    # More parts than cores: one core each, reused
+    assert partition_cores(3, [0, 1]) == [[0], [1], [0]]
+    assert job_nproc(3, range(8)) == 2
+    assert job_nproc(16, range(8)) == 1
+
+
+def test_concurrent_leases_are_disjoint(tmp_path):
+    ledger = str(tmp_path / 'ledger.json')
+    with lease_cores(3, ledger, cores=range(8)) as first, lease_cores(3, ledger, cores=range(8)) as second:
+        assert first == [0, 1, 2] and second == [3, 4, 5]
+        with open(ledger) as fp:
+            assert sorted(json.load(fp).values()) == [first, second]
+        # Oversubscribed: the least used cores are shared
+        with lease_cores(4, ledger, cores=range(8)) as third:
+            assert third == [0, 1, 6, 7]
+    with open(ledger) as fp:
+        assert json.load(fp) == {}
+
+
+def test_leases_of_dead_processes_are_reclaimed(tmp_path):
+    ledger = str(tmp_path / 'ledger.json')
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    with open(ledger, 'w') as fp:
+        json.dump({f"{dead.pid}.1": [0, 1]}, fp)
+    with lease_cores(2, ledger, cores=range(4)) as cores:
+        assert cores == [0, 1]
+
+
+def test_pinned_restores_affinity():
+    before = os.sched_getaffinity(0)
+    core = min(before)
+    with pinned([core]):
+        assert os.sched_getaffinity(0) == {core}
+    assert os.sched_getaffinity(0) == before
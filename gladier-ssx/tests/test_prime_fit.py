@@ -0,0 +1,80 @@
+"""Fitting PRIME statistics with gladier_ssx.prime_fit."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from tool_source import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import prime_logs  # noqa: E402
+from gladier_ssx import prime_fit  # noqa: E402
+from gladier_ssx.prime_log import parse_prime_lines  # noqa: E402
+
+RES = np.linspace(25.0, 1.6, prime_fit.N_BINS)
+
+
+@pytest.mark.parametrize('model, x, pars, legacy_p0', [
+    (prime_fit.exp, RES, [-80.0, 0.4, 95.0], [0, 0, 1]),
+    (prime_fit.exp3, prime_fit.RES_BINS, [1.2, 0.15, 1.0], [1, 0.5, 2]),
+    (prime_fit.exp4, prime_fit.RES_BINS, [3.0, 0.1, 0.2], [1, 0.6, 4]),
+], ids=['exp', 'exp3', 'exp4'])
+def test_fit_curve_recovers_parameters(model, x, pars, legacy_p0):
+    fitted, fit, ok = prime_fit.fit_curve(model, x, model(x, *pars), legacy_p0)
+    assert ok
+    np.testing.assert_allclose(fitted, pars, rtol=1e-4)
+    np.testing.assert_allclose(fit, model(x, *pars), rtol=1e-6, atol=1e-8)
+
+
+def test_get_index():
+    curve = np.array([90.0, 70.0, 55.0, 40.0, 20.0])
+    assert prime_fit.get_index(curve, 'greater than', 50) == 2
+    assert prime_fit.get_index(curve[::-1], 'less than', 50) == 1
+    assert prime_fit.get_index(curve, 'greater than', 10) == prime_fit.N_BINS - 1
+
+
+def test_fit_metrics_on_a_prime_table():
+    table = parse_prime_lines(prime_logs.prime_log_lines(2000, noise=0.0))['tables']['postref_cycle_3']
+    for metric in prime_fit.fit_metrics(prime_fit.metric_arrays(table)):
+        data, good, okay, pars, fit, good_idx, okay_idx = metric
+        assert not isinstance(pars[0], str), pars
+        assert len(fit) == prime_fit.N_BINS and np.all(np.isfinite(fit))
+        assert -1 <= good_idx < prime_fit.N_BINS and -1 <= okay_idx < prime_fit.N_BINS
+
+
+def identifiable(model, pars):
+    """Parameters a fit pins down; exp2 depends on a and c only through a * e^-c."""
+    pars = np.asarray(pars, dtype=float)
+    if model is prime_fit.exp2:
+        a, b, c, d = pars
+        return np.array([a * np.exp(-c), b, d])
+    return pars
+
+
+@pytest.mark.parametrize('curve', prime_logs.fit_curves(), ids=lambda curve: curve[0])
+def test_agrees_with_legacy_curve_fit(curve):
+    name, model, x, y, pars, legacy_p0 = curve
+    legacy = prime_logs.legacy_fit(model, x, y, legacy_p0)
+    fitted, _, ok = prime_fit.fit_curve(model, x, y, legacy_p0)
+
+    assert legacy is not None and ok
+    np.testing.assert_allclose(identifiable(model, fitted), identifiable(model, legacy), rtol=1e-4)
+    np.testing.assert_allclose(identifiable(model, fitted), identifiable(model, pars), rtol=0.1)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_never_worse_than_legacy_curve_fit_on_prime_tables(seed):
+    table = parse_prime_lines(prime_logs.prime_log_lines(3000, seed=seed))['tables']['postref_cycle_3']
+    RES, I2, CC, NOBS, COMP, ISIGI = prime_fit.metric_arrays(table)
+    fits = [(prime_fit.exp3, prime_fit.RES_BINS, I2, [1, 0.5, 2]), (prime_fit.exp, RES, CC, [0, 0, 1]),
+            (prime_fit.exp, RES, NOBS, [0, 0, 1]), (prime_fit.exp2, prime_fit.RES_BINS, COMP, [1, 0.2, 2, 100]),
+            (prime_fit.exp4, prime_fit.RES_BINS, ISIGI, [1, 0.6, 4])]
+    for model, x, y, legacy_p0 in fits:
+        with np.errstate(over='ignore', invalid='ignore'):
+            legacy = prime_logs.legacy_fit(model, x, y, legacy_p0)
+        fitted, fit, ok = prime_fit.fit_curve(model, x, y, legacy_p0)
+        assert ok
+        if legacy is not None and np.all(np.isfinite(model(x, *legacy))):
+            assert ((fit - y) ** 2).sum() <= ((model(x, *legacy) - y) ** 2).sum() * (1 + 1e-6)
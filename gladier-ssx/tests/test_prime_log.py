@@ -0,0 +1,47 @@
+"""Parsing PRIME logs with gladier_ssx.prime_log, on the synthetic logs of benchmarks/prime_logs."""
+import os
+import sys
+
+from tool_source import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import prime_logs  # noqa: E402
+from gladier_ssx.prime_log import parse_prime_lines, parse_prime_log  # noqa: E402
+
+
+def test_tables_and_frame_counts(tmp_path):
+    path = prime_logs.write_prime_log(str(tmp_path / 'log.txt'), 1000, n_bins=20, n_cycles=3,
+                                      bad_fraction=0.1, per_frame=True)
+    parsed = parse_prime_log(path)
+
+    assert sorted(parsed['tables']) == ['mean_scaling', 'postref_cycle_1', 'postref_cycle_2', 'postref_cycle_3']
+    table = parsed['tables']['postref_cycle_3']
+    assert len(table) == 20
+    assert {'Resolution', 'Completeness', '<N_obs>', 'CC1/2', '<I/sigI>', '<I**2>'} <= set(table.dtype.names)
+    # Resolution is the mean of the bin edges, falling across the table
+    d_lo, d_hi = prime_logs.resolution_bins(20)[0]
+    assert abs(table['Resolution'][0] - (d_lo + d_hi) / 2) < 0.01
+    assert (table['Resolution'][1:] < table['Resolution'][:-1]).all()
+    assert parsed['good_frames'] == 900 and parsed['bad_frames'] == 100
+    assert parsed['malformed_lines'] == 0
+
+
+def test_malformed_rows_are_counted_and_skipped():
+    lines = prime_logs.prime_log_lines(1000, n_cycles=1, malformed=0.3, seed=1)
+    parsed = parse_prime_lines(lines)
+
+    assert parsed['malformed_lines'] > 0
+    assert len(parsed['tables']['postref_cycle_1']) + len(parsed['tables']['mean_scaling']) \
+        == 40 - parsed['malformed_lines']
+
+
+def test_last_table_with_a_label_wins():
+    first = prime_logs.prime_table('postref_cycle_1', 100, n_bins=5)
+    second = prime_logs.prime_table('postref_cycle_1', 100, n_bins=8)
+    assert len(parse_prime_lines(first + second)['tables']['postref_cycle_1']) == 8
+
+
+def test_log_without_tables():
+    parsed = parse_prime_lines(["PRIME log", "nothing to see"])
+    assert parsed == {'tables': {}, 'good_frames': None, 'bad_frames': None, 'malformed_lines': 0}
@@ -0,0 +1,103 @@
+"""Coalescing and cancellation in gladier_ssx.prime_scheduler, with sleep standing in for prime.run."""
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from gladier_ssx.prime_scheduler import submit_prime  # noqa: E402
+
+
+def _submit_in_thread(prime_dir, seq, seconds, **kwargs):
+    """Start submit_prime in a thread and wait until its run has started."""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(
+        submit_prime(prime_dir, 'chip', f"chip_{seq}_prime", ['sleep', str(seconds)], seq, **kwargs)))
+    thread.start()
+    running = os.path.join(prime_dir, 'chip_prime_running.json')
+    deadline = time.time() + 10
+    while not os.path.exists(running):
+        assert time.time() < deadline, "the first run never started"
+        time.sleep(0.01)
+    return thread, result
+
+
+def test_overlapping_requests_coalesce(tmp_path):
+    prime_dir = str(tmp_path)
+    thread, first = _submit_in_thread(prime_dir, 1, 0.5)
+    queued = [submit_prime(prime_dir, 'chip', f"chip_{seq}_prime", ['sleep', '0.1'], seq) for seq in (2, 3, 4)]
+    thread.join()
+
+    assert all(result['queued'] for result in queued)
+    # Requests 2 and 3 were replaced by 4 before the first run finished
+    assert [run['seq'] for run in first['runs']] == [1, 4]
+    assert all(run['returncode'] == 0 for run in first['runs'])
+    assert not os.path.exists(os.path.join(prime_dir, 'chip_prime_pending.json'))
+    assert not os.path.exists(os.path.join(prime_dir, 'chip_prime_running.json'))
+
+
+def test_request_not_newer_than_running_is_dropped(tmp_path):
+    prime_dir = str(tmp_path)
+    thread, first = _submit_in_thread(prime_dir, 5, 0.3)
+    again = submit_prime(prime_dir, 'chip', 'chip_5_prime', ['sleep', '0.1'], 5)
+    thread.join()
+
+    assert again['queued']
+    assert [run['seq'] for run in first['runs']] == [5]
+
+
+def test_cancel_superseded_terminates_running(tmp_path):
+    prime_dir = str(tmp_path)
+    thread, first = _submit_in_thread(prime_dir, 1, 30)
+    newer = submit_prime(prime_dir, 'chip', 'chip_2_prime', ['sleep', '0.1'], 2, cancel_superseded=True)
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert newer['queued'] and newer['cancelled_running']
+    assert [run['seq'] for run in first['runs']] == [1, 2]
+    assert first['runs'][0]['cancelled'] and first['runs'][0]['cancelled_by'] == 2
+    assert first['runs'][1]['returncode'] == 0
+
+
+def test_queued_request_runs_with_its_own_env(tmp_path):
+    prime_dir = str(tmp_path)
+    thread, first = _submit_in_thread(prime_dir, 1, 0.3, env={'PATH': os.environ['PATH'], 'PRIME_REQUEST': 'first'})
+    queued = submit_prime(prime_dir, 'chip', 'chip_2_prime', ['sh', '-c', 'echo "$PRIME_REQUEST" > request.txt'], 2,
+                          env={'PATH': os.environ['PATH'], 'PRIME_REQUEST': 'second'})
+    thread.join()
+
+    assert queued['queued']
+    assert [run['seq'] for run in first['runs']] == [1, 2]
+    with open(os.path.join(prime_dir, 'request.txt')) as fp:
+        assert fp.read().strip() == 'second'
+
+
+def test_sigterm_exit_status_alone_is_not_a_cancellation(tmp_path):
+    result = submit_prime(str(tmp_path), 'chip', 'chip_1_prime', ['sh', '-c', 'exit 143'], 1)
+
+    assert result['returncode'] == 143
+    assert not result['cancelled'] and result['cancelled_by'] is None
+
+
+def test_stale_running_record_is_cleared_not_killed(tmp_path):
+    prime_dir = str(tmp_path)
+    # A record left by a holder that died, naming a pid now used by an unrelated process
+    bystander = subprocess.Popen(['sleep', '30'], start_new_session=True)
+    try:
+        with open(os.path.join(prime_dir, 'chip_prime_running.json'), 'w') as fp:
+            json.dump({'run_name': 'chip_9_prime', 'seq': 1, 'pid': bystander.pid,
+                       'host': socket.gethostname()}, fp)
+        result = submit_prime(prime_dir, 'chip', 'chip_2_prime', ['sleep', '0.1'], 2, cancel_superseded=True)
+
+        assert bystander.poll() is None
+        assert not result['cancelled_running']
+        assert [run['seq'] for run in result['runs']] == [2]
+        assert not os.path.exists(os.path.join(prime_dir, 'chip_prime_running.json'))
+    finally:
+        os.killpg(bystander.pid, signal.SIGTERM)
+        bystander.wait()
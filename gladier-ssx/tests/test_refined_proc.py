@@ -0,0 +1,49 @@
+"""A refinement job that raises fails on its own in run_refined_proc and stream_refined_proc."""
+import json
+import os
+import sys
+
+import pytest
+
+from tool_source import ROOT, load_tool
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Three master files, the outdir of r00001 blocked by a regular file so its job raises."""
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    fixtures.make_bin(str(tmp_path / 'dials'))
+    data_dir = fixtures.make_data_dir(str(tmp_path / 'data'), n_masters=3)
+    os.makedirs(os.path.join(data_dir, 'refined'))
+    open(os.path.join(data_dir, 'refined', 'ref_r00001'), 'w').close()
+    open(os.path.join(data_dir, 'refined.expt'), 'w').close()
+    monkeypatch.chdir(data_dir)
+    return data_dir
+
+
+def check_jobs(result, data_dir):
+    jobs = {job['master_file']: job for job in result['jobs']}
+    failed = jobs['raster/r00001_master.h5']
+    assert not failed['success'] and failed['returncode'] != 0 and 'FileExistsError' in failed['error']
+    assert result['succeeded'] == 2 and result['failed'] == 1
+
+    with open(os.path.join(data_dir, 'refined', 'manifest.json')) as fp:
+        manifest = json.load(fp)
+    assert sorted(manifest) == sorted(jobs)
+    assert manifest['raster/r00001_master.h5']['returncode'] != 0
+
+
+def test_run_refined_proc_records_a_job_that_raised(data_dir):
+    result = load_tool('run_refined_proc')(max_jobs=2, refined_geometry='refined.expt')
+    check_jobs(result, data_dir)
+
+
+def test_stream_refined_proc_records_a_job_that_raised(data_dir):
+    result = load_tool('stream_refined_proc')(max_jobs=2, refined_geometry='refined.expt', settle_seconds=0,
+                                              poll_interval=0.05, idle_timeout=0, merge_prime=False,
+                                              merge_every=100)
+    check_jobs(result, data_dir)
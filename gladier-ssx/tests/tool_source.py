@@ -0,0 +1,43 @@
+"""The funcx functions of tools/ as Globus Compute ships them: their source, without their modules.
+
+Loading a tool this way needs neither gladier nor tools/ to be importable, only gladier_ssx.
+"""
+import ast
+import glob
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def funcx_sources():
+    """Map the name of every funcx_functions entry in tools/ to its source."""
+    sources = {}
+    for path in sorted(glob.glob(os.path.join(ROOT, 'tools', '*.py'))):
+        with open(path) as fp:
+            text = fp.read()
+        tree = ast.parse(text)
+        functions = {node.name: node for node in tree.body if isinstance(node, ast.FunctionDef)}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'funcx_functions'
+                                                    for target in node.targets):
+                for element in node.value.elts:
+                    sources[element.id] = ast.get_source_segment(text, functions[element.id])
+    return sources
+
+
+SOURCES = funcx_sources()
+
+
+def payload(name):
+    """Source of a funcx function, with its signature's typing annotations left unevaluated."""
+    return f"from __future__ import annotations\n{SOURCES[name]}\n"
+
+
+def load_tool(name):
+    """Define a funcx function from its source alone in a fresh namespace and return it."""
+    namespace = {'__name__': f"tools_source.{name}"}
+    exec(compile(payload(name), name, 'exec'), namespace)
+    return namespace[name]
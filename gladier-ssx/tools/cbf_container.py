@@ -0,0 +1,78 @@
+from gladier import GladierBaseTool, generate_flow_definition
+from typing import Dict, Any
+
+
+def repack_cbf(**data: Dict[str, Any]) -> Dict[str, Any]:
+    """Repack a batch of CBF stills into one chunked, compressed HDF5 container.
+
+    The batch is chosen like dials_stills does: stills_batch_size frames ending at
+    cbf_num. Reading the container back is a few large requests instead of an
+    open and a stat per image, on the parallel filesystem and in transfers. The
+    CBF bytes are kept unchanged, so frames extracted from the container are
+    identical to the originals; dials_stills does this when given the container
+    and the CBF files are gone (or prefer_container is set). Processing from the
+    CBF files stays the default, as extracting to scratch is still the slower
+    path (see the cbf_container benchmark).
+
+    Args:
+        data: Dictionary containing the following keys:
+            - data_dir: Path where the raw (cbf) data is stored
+            - run_num: Run number in the CBF names
+            - chip_name: Name of the chip in the CBF names
+            - cbf_num: Last frame of the batch
+            - stills_batch_size: Frames in the batch
+            - container_dir: Optional directory for the containers (default: data_dir/containers)
+            - chunk_bytes: Optional HDF5 chunk size in bytes (default: 1 MiB)
+            - compression: Optional h5py compression filter, 'gzip', 'lzf' or None (default: 'gzip')
+            - compression_level: Optional gzip level (default: 1)
+            - remove_cbfs: Optional, delete the CBF files once the container is written and verify_container
+              has checked every frame against them (default: False)
+
+    Returns:
+        Dict[str, Any]: The 'container' path, 'frames', 'bytes_in', 'bytes_out' and the span of this call
+    """
+    import os
+
+    from gladier_ssx.cbf_container import verify_container, write_container
+    from gladier_ssx.tracing import Span
+
+    data_dir = data['data_dir']
+    run_num = data['run_num']
+    chip_name = data['chip_name']
+    cbf_num = data['cbf_num']
+    batch_size = data['stills_batch_size']
+    container_dir = data.get('container_dir') or os.path.join(data_dir, 'containers')
+    span = Span('repack_cbf', chip_name=chip_name, cbf_num=cbf_num)
+
+    cbf_start = cbf_num - batch_size + 1
+    input_files = [f"{data_dir}/{chip_name}_{run_num}_{str(n).zfill(5)}.cbf"
+                   for n in range(cbf_start, cbf_num + 1)]
+    missing = [path for path in input_files if not os.path.isfile(path)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} CBF files of the batch are missing, first {missing[0]}")
+
+    os.makedirs(container_dir, exist_ok=True)
+    container = os.path.join(container_dir, f"{chip_name}_{run_num}_{cbf_start:05d}_{cbf_num:05d}.h5")
+    stats = write_container(input_files, container, data.get('chunk_bytes', 1 << 20),
+                            data.get('compression', 'gzip'), data.get('compression_level', 1),
+                            {'chip_name': chip_name, 'run_num': run_num})
+    if data.get('remove_cbfs', False):
+        verify_container(container, input_files)
+        for path in input_files:
+            os.remove(path)
+    return dict(stats, container=container, removed_cbfs=data.get('remove_cbfs', False),
+                span=span.finish(**stats))
+
+
+@generate_flow_definition
+class RepackCbf(GladierBaseTool):
+    flow_input = {}
+    required_input = [
+        'data_dir',
+        'run_num',
+        'chip_name',
+        'cbf_num',
+        'stills_batch_size',
+        'funcx_endpoint_compute',
+    ]
+    funcx_functions = [repack_cbf]
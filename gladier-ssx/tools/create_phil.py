@@ -2,10 +2,12 @@ from gladier import GladierBaseTool, generate_flow_definition
 from typing import Dict, Any
 
 def create_phil(**data: Dict[str, Any]) -> str:
-    """Create a phil file for dials-stills if one doesn't already exist.
+    """Create a phil file for dials-stills unless an identical one already exists.
     
     The Phil file uses a template set directly on the script and can be updated according to new options on dials.
     This function reads beamline JSON data and creates a phil file with appropriate parameters.
+    Phil files are content addressed: each is written as process_<run_num>.<key>.phil, where key
+    hashes the rendered phil text, and process_<run_num>.phil is a symlink to the current one.
     
     Args:
         data: Dictionary containing the following keys:
@@ -13,20 +15,42 @@ def create_phil(**data: Dict[str, Any]) -> str:
             - proc_dir: Path to where dials will run and save results
             - run_num: Set the beamline json being used for this particular phil
             - unit_cell: Optional unit cell parameter to override JSON value
-            - beamx: Optional beam x position (default: -214.400)
-            - beamy: Optional beam y position (default: 218.200)
-            - nproc: Optional number of processors (default: 32)
+            - beamx: Optional beam x position (default: from the master file, else -214.400)
+            - beamy: Optional beam y position (default: from the master file, else 218.200)
+            - master_file: Optional master.h5 whose metadata supplies the beam centre, detector
+              distance and wavelength (default: the first *_master.h5 in data_dir or data_dir/raster)
+            - nproc: Optional mp.nproc written into the phil (default: none; dials_stills sets mp.nproc
+              from the cores of the node it launches on)
             - mask: Optional mask file path (default: 'mask.pickle')
+            - catalog: Path to the run catalog index (default: '.ssx_catalog.sqlite' in proc_dir)
+            - chip_name: Optional chip name, narrows which outputs are invalidated when the phil changes
             
     Returns:
         str: Path to the created phil file
         
     Note:
-        If a file xy.json exists in the data_dir it will override beamx and beamy variables
+        If a file xy.json exists in the data_dir it will override beamx and beamy variables.
+        The beamline JSON's det_distance takes precedence over the master file's.
+        The size and mtime of beamline_run<run_num>.json, xy.json and the master file, the
+        overrides and the mask path of the last request are kept in
+        proc_dir/process_<run_num>.request.json, so an unchanged request costs only a few stats
+        and a readlink; the master file is found through the run catalog (see gladier_ssx.catalog)
+        and its metadata read only when the phil has to be rendered. Otherwise the phil is rendered
+        again, and only when the text differs from the current phil are proc_dir outputs made
+        with it moved to proc_dir/stale/<old key>/: the files of frames <chip_name>_<run_num>_NNNNN
+        (int-0-<frame>.pickle, log-<frame>.*.log, idx-<frame>_*.refl, ...), of any chip if
+        chip_name is not given. A process_<run_num>.phil that is a regular file, written before
+        phils were keyed, is keyed on its text in the same way and kept as process_<run_num>.<key>.phil.
     """
+    import hashlib
     import json
+    import logging
     import os
+    import re
     from string import Template
+    from gladier_ssx.catalog import open_catalog
+    from gladier_ssx.int_index import IntIndex
+    from gladier_ssx.master_metadata import panel_origin
 
     data_dir = data['data_dir']
     proc_dir = data['proc_dir']
@@ -37,14 +61,12 @@ def create_phil(**data: Dict[str, Any]) -> str:
         
     phil_name = f"{proc_dir}/process_{run_num}.phil"
 
-    if os.path.isfile(phil_name):
-        return phil_name
-    
     ##Getting optional variables
     unit_cell = data.get('unit_cell', None)
-    beamx = data.get('beamx', -214.400)
-    beamy = data.get('beamy', 218.200)
-    nproc = data.get('nproc', 32)
+    master_file = data.get('master_file')
+    ##Only an explicit nproc goes into the phil: a default resolved here would tie the phil, and
+    ##its key, to the cores of whichever worker happened to run create_phil
+    nproc = data.get('nproc')
     mask_file = data.get('mask', 'mask.pickle')
 
     ##opening existing files
@@ -52,6 +74,65 @@ def create_phil(**data: Dict[str, Any]) -> str:
     xy_json = os.path.join(data_dir,'xy.json')
     mask = os.path.join(data_dir,mask_file)
 
+    def stat_signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def master_record(path):
+        return [path, stat_signature(path)] if path else None
+
+    ##Everything the template is rendered from, as of the last request
+    request = {'beamline_json': stat_signature(beamline_json),
+               'xy_json': stat_signature(xy_json),
+               'mask': mask,
+               'overrides': {'unit_cell': unit_cell, 'beamx': data.get('beamx'), 'beamy': data.get('beamy'),
+                             'nproc': nproc}}
+    request_path = os.path.join(proc_dir, f"process_{run_num}.request.json")
+
+    try:
+        current_name = os.readlink(phil_name)
+    except OSError:
+        current_name = None
+    legacy = current_name is None and os.path.isfile(phil_name)
+    if legacy:
+        ##A process_<run_num>.phil written before phils were keyed is keyed on its text like the rendered ones
+        with open(phil_name, 'rb') as fp:
+            current_name = f"process_{run_num}.{hashlib.sha256(fp.read()).hexdigest()[:12]}.phil"
+
+    try:
+        with open(request_path, 'r') as fp:
+            last_request = json.load(fp)
+    except (OSError, ValueError):
+        last_request = None
+    if (last_request is not None and not legacy and os.path.isfile(phil_name)
+            and all(last_request.get(k) == v for k, v in dict(request, phil=current_name).items())):
+        ##The master file the geometry defaults came from must be unchanged too
+        recorded = last_request.get('master')
+        if master_file is not None:
+            unchanged = recorded == master_record(master_file)
+        elif recorded:
+            unchanged = recorded == master_record(recorded[0])
+        else:
+            with open_catalog(data.get('catalog'), root=proc_dir) as catalog:
+                unchanged = catalog.first_master(data_dir) is None
+        if unchanged:
+            return phil_name
+
+    ##Geometry defaults from the master file metadata, when there is one
+    with open_catalog(data.get('catalog'), root=proc_dir) as catalog:
+        if master_file is None:
+            master_file = catalog.first_master(data_dir)
+        metadata = catalog.master_metadata([master_file])[master_file] if master_file else None
+    request['master'] = master_record(master_file)
+    origin = (panel_origin(metadata) if metadata else None) or {}
+    beamx = data.get('beamx', origin.get('beamx', -214.400))
+    beamy = data.get('beamy', origin.get('beamy', 218.200))
+    det_distance = origin.get('det_distance')
+    wavelength = metadata.get('wavelength') if metadata else None
+
     beamline_data = None
 
     try:
@@ -78,10 +159,11 @@ def create_phil(**data: Dict[str, Any]) -> str:
 
     template_data = {'det_distance': det_distance,
                      'unit_cell': unit_cell,
-                     'nproc': nproc,
+                     'mp_nproc': f"mp.nproc = {nproc}" if nproc else "#mp.nproc is set by dials_stills at launch",
                      'space_group': space_group,
                      'beamx': beamx,
                      'beamy': beamy,
+                     'beam': f"\n  beam {{\n    wavelength = {wavelength}\n  }}" if wavelength else "",
                      'mask': mask}
 
     template_phil = Template("""spotfinder.lookup.mask=$mask
@@ -89,11 +171,11 @@ integration.lookup.mask=$mask
 spotfinder.filter.min_spot_size=2
 significance_filter.enable=True
 #significance_filter.isigi_cutoff=1.0
-mp.nproc = $nproc
+$mp_nproc
 mp.method=multiprocessing
 output.composite_output=False
 refinement.parameterisation.detector.fix=none
-geometry {
+geometry {$beam
   detector {
       panel {
                 fast_axis = 0.9999673162585729, -0.0034449798523932267, -0.007314268824966957
@@ -113,8 +195,55 @@ indexing {
 }""")
     phil_data = template_phil.substitute(template_data)
 
-    with open(phil_name, 'w') as fp:
-        fp.write(phil_data)
+    ##Key the phil on its text, so inputs that were touched but render the same phil keep it
+    key = hashlib.sha256(phil_data.encode()).hexdigest()[:12]
+    keyed_name = f"process_{run_num}.{key}.phil"
+    keyed_path = os.path.join(proc_dir, keyed_name)
+    if not os.path.isfile(keyed_path):
+        tmp_phil = f"{keyed_path}.{os.getpid()}.tmp"
+        with open(tmp_phil, 'w') as fp:
+            fp.write(phil_data)
+        os.replace(tmp_phil, keyed_path)
+
+    ##Point process_<run_num>.phil at the new phil, keeping a legacy phil under its key
+    if legacy:
+        try:
+            os.link(phil_name, os.path.join(proc_dir, current_name))
+        except FileExistsError:
+            pass
+    if legacy or current_name != keyed_name or not os.path.isfile(phil_name):
+        tmp_link = f"{phil_name}.{os.getpid()}.tmp"
+        os.symlink(keyed_name, tmp_link)
+        os.replace(tmp_link, phil_name)
+
+    ##Outputs of this run made with the previous phil are stale
+    if current_name and current_name.startswith(f"process_{run_num}.") and current_name != keyed_name:
+        old_key = current_name[len(f"process_{run_num}."):-len('.phil')]
+        chip_name = data.get('chip_name')
+        ##Files named after a frame of this run: the frame name, starting the file name or after a
+        ##'-' prefix, followed by '.', '_' or nothing
+        frame_re = re.compile(r'(?:^|-)' + (re.escape(chip_name) if chip_name else r'[^-]+')
+                              + rf'_{re.escape(str(run_num))}_\d{{5,}}(?:[._]|$)')
+        stale_dir = os.path.join(proc_dir, 'stale', old_key)
+        with os.scandir(proc_dir) as it:
+            entries = [entry.name for entry in it if entry.is_file()]
+        stale = [name for name in entries if frame_re.search(name) and not name.startswith('process_')]
+        if stale:
+            os.makedirs(stale_dir, exist_ok=True)
+            for name in stale:
+                os.replace(os.path.join(proc_dir, name), os.path.join(stale_dir, name))
+            ##Moved pickles leave the int indexes dials_stills keeps in proc_dir
+            moved_ints = [os.path.join(proc_dir, name) for name in stale
+                          if name.startswith('int-') and name.endswith('.pickle')]
+            for name in entries:
+                if moved_ints and name.endswith('_ints.txt'):
+                    IntIndex(os.path.join(proc_dir, name)).remove(moved_ints)
+            logging.getLogger(__name__).info("Moved %d outputs made with %s to %s", len(stale), current_name, stale_dir)
+
+    tmp_request = f"{request_path}.{os.getpid()}.tmp"
+    with open(tmp_request, 'w') as fp:
+        json.dump(dict(request, phil=keyed_name), fp)
+    os.replace(tmp_request, request_path)
     return phil_name 
 
 @generate_flow_definition(modifiers={
@@ -123,6 +252,8 @@ indexing {
                            }
 })
 class CreatePhil(GladierBaseTool):
+    consumes = []
+    produces = ['phil']
     flow_input = {}
     required_input = [
         'data_dir',
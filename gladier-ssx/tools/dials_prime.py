@@ -1,7 +1,7 @@
 from gladier import GladierBaseTool, generate_flow_definition
-from typing import Dict, Any, Tuple
+from typing import Dict, Any
 
-def dials_prime(**data: Dict[str, Any]) -> Tuple[str, str, str]:
+def dials_prime(**data: Dict[str, Any]) -> Dict[str, Any]:
     """Run the PRIME tool on the int-list.
     
     This function changes directory to the prime directory, creates a phil file for prime.run,
@@ -17,21 +17,41 @@ def dials_prime(**data: Dict[str, Any]) -> Tuple[str, str, str]:
             - unit_cell: Optional unit cell parameter to override JSON value
             - prime_dmin: Optional dmin value (default: 2.1)
             - dials_path: Optional path to dials installation (default: '/dials')
+            - prime_min_new_frames: Optional number of new integrated frames needed to start PRIME (default: 1)
+            - prime_min_new_fraction: Optional fraction of the previous run's frame count that must be new (default: 0.0)
+            - prime_cancel_superseded: Optional, terminate an in-flight PRIME run when a newer one is requested (default: False)
+            - env_cache_dir: Optional directory holding the cached DIALS environment (default: ~/.cache/gladier-ssx)
             - timeout: Optional timeout for prime execution (default: 1200)
+            - prime_nproc: Optional n_processors for prime.run (default: the node's cores split jobs_per_node ways)
+            - jobs_per_node: Optional number of jobs expected to share the node (default: 1)
+            - pin_cores: Optional, pin prime.run to prime_nproc cores leased from the node when it starts (default: False)
             
     Returns:
-        Tuple[str, str, str]: (command, stdout, stderr) from the prime.run execution
+        Dict[str, Any]: Command, return code, log paths and output tail of the prime.run execution,
+        or a record with 'skipped': True when too few new frames arrived since the last run,
+        or 'queued': True when the chip's current PRIME run will pick this request up
         
     Note:
+        - Integrated pickles are tracked in the append-only <proc_dir>/<chip_name>_ints.txt, which
+          dials_stills extends; it is built with one listing of proc_dir if it does not exist yet
+        - Each run gets an immutable copy of it, <prime_dir>/<chip_name>_<n_ints>_ints.txt, so the
+          run named <chip_name>_<n_ints>_prime sees exactly n_ints frames
+        - The int count of the last successful run is kept in <prime_dir>/<chip_name>_prime_state.json
+          and only updated once PRIME succeeded, so a failed run is retried at the next trigger
+        - At most one PRIME run executes per chip; newer requests replace queued ones (see prime_scheduler)
         - Copies the prime's log into the images dir (not implemented)
         - Zips the prime dir and copies that into the images dir (not implemented)
     """
     import os
     import json
-    import subprocess
-    from subprocess import PIPE
     from string import Template
-    import glob 
+    from gladier_ssx.int_index import IntIndex, int_index_path, should_trigger, load_trigger_state, save_trigger_state
+    from gladier_ssx.dials_env import dials_environment
+    from gladier_ssx.placement import job_nproc
+    from gladier_ssx.prime_scheduler import submit_prime
+    from gladier_ssx.tracing import Span
+
+    span = Span('dials_prime')
 
     data_dir = data['data_dir']
     proc_dir = data['proc_dir']
@@ -43,30 +63,33 @@ def dials_prime(**data: Dict[str, Any]) -> Tuple[str, str, str]:
     unit_cell = data.get('unit_cell', None)
     dmin = data.get('prime_dmin', 2.1)
 
-    int_filenames =  sorted(glob.glob(os.path.join(proc_dir,'int-*.pickle')))
-
-    try:
-        len(int_filenames)>0
-    except RuntimeError:
-        print('No ints were found')
-        
-
     if not os.path.exists(prime_dir):
         os.mkdir(prime_dir)
 
-    int_file_name = chip_name + '_' + str(len(int_filenames)) + '_ints.txt'
-    proc_ints_file = os.path.join(prime_dir,int_file_name)
+    # dials_stills keeps the int index current; only a proc_dir that predates it is listed
+    int_index = IntIndex(int_index_path(proc_dir, chip_name))
+    if int_index.state() is None and os.path.isdir(proc_dir):
+        int_index.update_from_dir(proc_dir)
+    n_ints = len(int_index)
 
-    if os.path.exists(proc_ints_file):
-        raise RuntimeError('Prime already running with this values.')
+    if n_ints == 0:
+        print('No ints were found')
 
-    with open(proc_ints_file,'w+') as f:
-        for intfile in sorted(int_filenames):
-            f.write(str(intfile) + "\n")
+    state_file = os.path.join(prime_dir, chip_name + '_prime_state.json')
+    last_count = load_trigger_state(state_file).get('last_count', 0)
+    if not should_trigger(n_ints, last_count,
+                          data.get('prime_min_new_frames', 1),
+                          data.get('prime_min_new_fraction', 0.0)):
+        return {'skipped': True, 'n_ints': n_ints, 'last_count': last_count,
+                'span': span.finish(n_ints=n_ints, skipped=True)}
+
+    # Frames may have been appended since the count above, so the run is named after its snapshot
+    snapshot_tmp = os.path.join(prime_dir, f"{chip_name}_ints.{os.getpid()}.snapshot")
+    n_ints = int_index.snapshot(snapshot_tmp)
+    prime_run_name = chip_name + '_' + str(n_ints) + '_prime'
+    proc_ints_file = os.path.join(prime_dir, f"{chip_name}_{n_ints}_ints.txt")
+    os.replace(snapshot_tmp, proc_ints_file)
 
-    
-    prime_run_name = chip_name + '_' + str(len(int_filenames)) + '_prime'
-    
     os.chdir(prime_dir)
     beamline_json = os.path.join(data_dir,f"beamline_run{run_num}.json")
     beamline_data = None 
@@ -88,11 +111,13 @@ def dials_prime(**data: Dict[str, Any]) -> Tuple[str, str, str]:
 
     os.chdir(prime_dir)
 
+    nproc = data.get('prime_nproc') or job_nproc(data.get('jobs_per_node', 1))
     template_data = {"dmin": dmin, 
             "int_file": proc_ints_file, 
             "unit_cell": unit_cell,
             "space_group": space_group, 
-            "run_name": prime_run_name}
+            "run_name": prime_run_name,
+            "nproc": nproc}
 
     template_prime = Template("""data = $int_file 
 run_no = $run_name
@@ -141,25 +166,35 @@ indexing_ambiguity {
          n_sample_frames = 1000
          n_selected_frames = 100
 }
-n_processors = 32
+n_processors = $nproc
 n_bins = 20
 """)
 
     prime_data = template_prime.substitute(template_data)
 
-    prime_phil =     prime_run_name = chip_name + '_' + str(len(int_filenames)) + '_prime.phil'
+    prime_phil = prime_run_name + '.phil'
     with open(prime_phil, 'w') as fp:
         fp.write(prime_data)
 
     # run prime
     timeout = data.get('timeout', 1200)
     dials_path = data.get('dials_path','/dials')
-    cmd = f"source {dials_path}/dials && timeout {timeout} prime.run {prime_phil}"
-
-    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                             shell=True, executable='/bin/bash')
-    
-    return cmd, str(res.stdout), str(res.stderr)
+    cmd = ['timeout', str(timeout), 'prime.run', prime_phil]
+
+    env = dials_environment(dials_path, data.get('env_cache_dir'))
+    result = submit_prime(prime_dir, chip_name, prime_run_name, cmd, n_ints, env=env,
+                          cancel_superseded=data.get('prime_cancel_superseded', False),
+                          n_cores=nproc if data.get('pin_cores', False) else None)
+
+    # Record the newest successful run, whichever request it was; queued requests are
+    # recorded by the caller that runs them
+    succeeded = [run for run in result.get('runs', []) if run['returncode'] == 0]
+    if succeeded:
+        latest = max(succeeded, key=lambda run: run['seq'])
+        if latest['seq'] > load_trigger_state(state_file).get('last_count', 0):
+            save_trigger_state(state_file, latest['seq'], latest['run_name'])
+    result['span'] = span.finish(n_ints=n_ints)
+    return result
 
 
 @generate_flow_definition(modifiers={
@@ -1,7 +1,7 @@
 from gladier import GladierBaseTool, generate_flow_definition
-from typing import Dict, Any, Tuple
+from typing import Dict, Any
 
-def dials_stills(**data: Dict[str, Any]) -> Tuple[str, str, str]:
+def dials_stills(**data: Dict[str, Any]) -> Dict[str, Any]:
     """Run dials-stills processing on CBF files.
     
     This function processes a batch of CBF files using dials.stills_process with
@@ -16,13 +16,51 @@ def dials_stills(**data: Dict[str, Any]) -> Tuple[str, str, str]:
             - cbf_num: Gives the # of the trigger for this flow
             - stills_batch_size: Gives the amount of cbf's processed on this instance
             - dials_path: Optional path to dials installation (default: '/dials')
+            - env_cache_dir: Optional directory holding the cached DIALS environment (default: ~/.cache/gladier-ssx)
             - timeout: Optional timeout for faster/slower failure (default: 1200)
+            - pin_cores: Optional, lease cores of the node, pin dials.stills_process to them and
+              override the phil's mp.nproc to match (default: False)
+            - nproc: Optional mp.nproc, as given to create_phil, and number of cores leased when pinning
+              (default: the cores of this node split jobs_per_node ways, passed as mp.nproc at launch)
+            - jobs_per_node: Optional number of stills jobs expected to share a node (default: 1)
+            - container: Optional HDF5 container written by repack_cbf holding the batch; its frames are
+              extracted to scratch_dir and processed when CBF files of the batch are missing from data_dir
+            - prefer_container: Optional, extract from the container even when the CBF files exist; this is
+              slower than reading the CBF files for now (default: False)
+            - scratch_dir: Optional parent of the directory frames are extracted to, best on node-local
+              disk (default: the system temporary directory); the directory is removed afterwards
+            - prefilter: Optional, drop frames without diffraction before dials.stills_process
+              (see gladier_ssx.hit_finding; default: False)
+            - mask: Optional mask file in data_dir used by the prefilter, a DIALS pickle (converted with
+              dials.python) or a .npy file; an explicit mask that cannot be read fails the batch
+              (default: 'mask.pickle', skipped with a warning if missing)
+            - prefilter_sigma: Optional sigmas above background of a strong pixel (default: 6.0)
+            - prefilter_min_strong_pixels: Optional strong pixels that make a frame a hit (default: 20)
+            - prefilter_workers: Optional prefilter process pool size (default: the number of cores)
             
     Returns:
-        Tuple[str, str, str]: (command, stdout, stderr) from the dials.stills_process execution
+        Dict[str, Any]: Command, return code, log paths and output tail of the dials.stills_process execution,
+        plus the hit rate under 'prefilter' when prefiltering and the number of integrated pickles
+        under 'n_integrated'. dials.stills_process is not run when no frame of the batch is a hit.
+
+    Note:
+        Pickles the run wrote are appended to the chip's int index, <proc_dir>/<chip_name>_ints.txt
+        (see gladier_ssx.int_index), which dials_prime hands to PRIME. Pickles that already existed
+        before the run, i.e. from an earlier attempt at the same batch, are already indexed.
     """
+    import contextlib
     import os
-    import subprocess
+    import shutil
+    import tempfile
+    from gladier_ssx.cbf_container import extract_frames
+    from gladier_ssx.dials_env import dials_environment
+    from gladier_ssx.hit_finding import prefilter_hits, resolve_mask
+    from gladier_ssx.int_index import IntIndex, int_index_path, integrated_pickles
+    from gladier_ssx.placement import job_nproc, lease_cores
+    from gladier_ssx.runner import run_logged
+    from gladier_ssx.tracing import Span
+
+    span = Span('dials_stills', filename=data['filename'])
 
     data_dir = data['data_dir']
     proc_dir = data['proc_dir']
@@ -36,20 +74,57 @@ def dials_stills(**data: Dict[str, Any]) -> Tuple[str, str, str]:
     cbf_start = cbf_num - batch_size + 1
     cbf_end = cbf_num
 
-    input_files = f"{chip_name}_{run_num}_{{{str(cbf_start).zfill(5)}..{str(cbf_end).zfill(5)}}}.cbf"
+    input_files = [f"{data_dir}/{chip_name}_{run_num}_{str(n).zfill(5)}.cbf"
+                   for n in range(cbf_start, cbf_end + 1)]
 
     timeout = data.get('timeout', 1200)
 
     logname = 'log-' + data['filename'].replace('.cbf','')
     
     dials_path = data.get('dials_path','/dials')
-    cmd = f'source {dials_path}/dials && timeout {timeout} dials.stills_process {phil_name} {data_dir}/{input_files} > {logname}.txt'
 
-    os.chdir(proc_dir) 
-    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                             shell=True, executable='/bin/bash')
-    
-    return cmd, str(res.stdout), str(res.stderr)
+    with contextlib.ExitStack() as stack:
+        use_container = data.get('container') and (
+            data.get('prefer_container', False) or not all(os.path.isfile(path) for path in input_files))
+        if use_container:
+            scratch = tempfile.mkdtemp(prefix=f"stills_{chip_name}_{cbf_num}_", dir=data.get('scratch_dir'))
+            stack.callback(shutil.rmtree, scratch, ignore_errors=True)
+            input_files = extract_frames(data['container'], range(cbf_start, cbf_end + 1), scratch)
+
+        env = dials_environment(dials_path, data.get('env_cache_dir'))
+        prefilter = None
+        if data.get('prefilter', False):
+            mask_path = resolve_mask(os.path.join(data_dir, data.get('mask', 'mask.pickle')),
+                                     required='mask' in data, env=env, log_dir=proc_dir)
+            input_files, prefilter = prefilter_hits(
+                input_files,
+                mask_path=mask_path,
+                sigma_strong=data.get('prefilter_sigma', 6.0),
+                min_strong_pixels=data.get('prefilter_min_strong_pixels', 20),
+                workers=data.get('prefilter_workers'))
+            if not input_files:
+                return {'cmd': None, 'returncode': 0, 'skipped': True, 'prefilter': prefilter,
+                        'span': span.finish(frames=prefilter['frames'], hits=0)}
+
+        cmd = ['timeout', str(timeout), 'dials.stills_process', phil_name] + input_files
+        cores = None
+        nproc = data.get('nproc') or job_nproc(data.get('jobs_per_node', 1))
+        if data.get('pin_cores', False):
+            cores = stack.enter_context(lease_cores(nproc))
+            cmd.insert(4, f"mp.nproc={len(cores)}")
+        elif not data.get('nproc'):
+            # create_phil leaves mp.nproc out of the phil unless it is given explicitly
+            cmd.insert(4, f"mp.nproc={nproc}")
+        existing = set(integrated_pickles(proc_dir, input_files))
+        result = run_logged(cmd, log_dir='.', name=logname, cwd=proc_dir, env=env, shell=False,
+                            stage='dials_stills', inputs=input_files, cores=cores)
+    integrated = integrated_pickles(proc_dir, input_files)
+    IntIndex(int_index_path(proc_dir, chip_name)).append(path for path in integrated if path not in existing)
+    result['n_integrated'] = len(integrated)
+    if prefilter is not None:
+        result['prefilter'] = prefilter
+    result['span'] = span.finish(frames=batch_size, hits=len(input_files))
+    return result
 
 
 @generate_flow_definition(modifiers={
@@ -1,11 +1,8 @@
 from gladier import GladierBaseTool, generate_flow_definition
-from typing import Dict, Any, Optional
-import os
-import subprocess
-from subprocess import PIPE
+from typing import Dict, Any
 
 
-def merge_all(**data: Dict[str, Any]) -> tuple[str, str, str]:
+def merge_all(**data: Dict[str, Any]) -> Dict[str, Any]:
     """Merge all refined SSX batches using xia2.ssx_reduce.
     
     This tool collects batch_1 directories under refined/ref_*/ and merges them
@@ -17,64 +14,27 @@ def merge_all(**data: Dict[str, Any]) -> tuple[str, str, str]:
             - output_dir: Path where the merged results will be stored (default: 'final_merge')
             - phil_file: Path to the phil file to use for merging (default: 'run.phil')
             - dials_path: Path to dials installation (default: '/dials')
+            - catalog: Path to the run catalog index (default: '.ssx_catalog.sqlite')
+            - batch_dirs: Optional batch directories to merge instead of every refined/ref_*/batch_1
+            - env_cache_dir: Directory holding the cached DIALS environment (default: ~/.cache/gladier-ssx)
+            - shard_size: Optional, merge in shards of this many batches and combine the partial
+              results hierarchically, shard_size at a time (default: unset, one reduction of every batch)
+            - max_jobs: Maximum number of shards reduced side by side (default: 1)
             
     Returns:
-        tuple: (command, stdout, stderr) from the xia2.ssx_reduce execution
+        dict: Command, return code, log paths and output tail of the final xia2.ssx_reduce execution.
+        Sharded merges add the record of every shard reduction under 'shards' and the number of
+        levels below the final one under 'level'; if a shard fails, its record is returned instead
+        of the final one.
+
+    Note:
+        The batches are passed to xia2.ssx_reduce as directory= lines of inputs.phil in the
+        reduction's directory rather than on the command line. Shards run in
+        output_dir/shards/level<L>_<NNNN>/.
     """
-    refined_dir = data.get('refined_dir', 'refined')
-    output_dir = data.get('output_dir', 'final_merge')
-    phil_file = data.get('phil_file', 'run.phil')
-    dials_path = data.get('dials_path', '/dials')
-    
-    # Create output directory
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # Change to output directory
-    os.chdir(output_dir)
-    
-    # Collect batch_1 directories under refined/ref_*/
-    batch_dirs = []
-    for ref_dir in os.listdir(f"../{refined_dir}"):
-        ref_path = os.path.join(f"../{refined_dir}", ref_dir)
-        if os.path.isdir(ref_path):
-            batch_path = os.path.join(ref_path, "batch_1")
-            if os.path.exists(batch_path):
-                batch_dirs.append(batch_path)
-    
-    if not batch_dirs:
-        raise RuntimeError("No batch_1 directories found in refined/ref_*/")
-    
-    # Sort directories for consistent ordering
-    batch_dirs.sort()
-    
-    # Build xia2.ssx_reduce command arguments
-    reduce_args = []
-    for batch_dir in batch_dirs:
-        reduce_args.append(f"directory={batch_dir}")
-    
-    # Construct the full command
-    cmd_parts = [
-        f"source {dials_path}/dials",
-        "&&",
-        "xia2.ssx_reduce"
-    ] + reduce_args + [
-        f"--phil ../{phil_file}"
-    ]
-    
-    cmd = " ".join(cmd_parts)
-    
-    # Execute the command
-    result = subprocess.run(
-        cmd,
-        stdout=PIPE,
-        stderr=PIPE,
-        shell=True,
-        executable='/bin/bash',
-        text=True
-    )
-    
-    return cmd, result.stdout, result.stderr
+    from gladier_ssx.merging import merge_all as merge_all_impl
+
+    return merge_all_impl(**data)
 
 
 @generate_flow_definition(modifiers={
@@ -86,6 +46,8 @@ def merge_all(**data: Dict[str, Any]) -> tuple[str, str, str]:
 class MergeAll(GladierBaseTool):
     """Gladier tool for merging refined SSX batches using xia2.ssx_reduce."""
     
+    consumes = ['phil', 'refined_batches']
+    produces = ['merged']
     flow_input = {}
     required_input = [
         'refined_dir',
@@ -0,0 +1,71 @@
+from gladier import GladierBaseTool, generate_flow_definition
+from typing import Dict, Any
+
+
+def primalisys_batch(**data: Dict[str, Any]) -> Dict[str, Any]:
+    """Analyze every PRIME run under a tree in parallel and tabulate the decisions.
+
+    This is primalisys for a whole shift: each <chip>_<N>_prime/log.txt found under
+    prime_root is parsed, fitted and judged in a process pool, and the results are
+    collected into one table ordered by chip and frame count, so the resolution
+    recommendations can be followed as frames accumulate. No figures are drawn.
+
+    Args:
+        data: Dictionary containing the following keys:
+            - prime_root: Directory searched recursively for PRIME runs
+            - upload_dir: Path where the consolidated table is written
+            - log_name: Optional name of the log inside each run directory (default: 'log.txt')
+            - workers: Optional process pool size (default: the number of cores)
+
+    Returns:
+        Dict[str, Any]: 'rows' of the table, the paths of primalysis_batch.json and
+        primalysis_batch.csv in the upload directory, and the span of this call
+    """
+    import csv
+    import io
+    import json
+    import os
+
+    from gladier_ssx.prime_batch import (TABLE_FIELDS, analyze_prime_logs, find_prime_logs,
+                                         format_decision_table, write_atomic)
+    from gladier_ssx.tracing import Span
+
+    span = Span('primalisys_batch')
+    prime_root = data['prime_root']
+    upload_dir = data['upload_dir']
+
+    runs = find_prime_logs(prime_root, data.get('log_name', 'log.txt'))
+    if not runs:
+        raise RuntimeError(f"No <chip>_<N>_prime runs with logs found under {prime_root}")
+
+    results = analyze_prime_logs([run['log'] for run in runs], data.get('workers'))
+    rows = [dict(run, **result) for run, result in zip(runs, results)]
+
+    os.makedirs(upload_dir, exist_ok=True)
+    json_path = os.path.join(upload_dir, 'primalysis_batch.json')
+    write_atomic(json_path, json.dumps(rows, indent=2))
+
+    csv_text = io.StringIO()
+    writer = csv.DictWriter(csv_text, fieldnames=TABLE_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+    csv_path = os.path.join(upload_dir, 'primalysis_batch.csv')
+    write_atomic(csv_path, csv_text.getvalue())
+
+    print(format_decision_table(rows))
+    n_failed = sum(1 for row in rows if row.get('error'))
+    return {'rows': rows, 'json': json_path, 'csv': csv_path,
+            'span': span.finish(n_logs=len(rows), n_failed=n_failed)}
+
+
+@generate_flow_definition
+class PrimalisysBatch(GladierBaseTool):
+    flow_input = {}
+    required_input = [
+        'prime_root',
+        'upload_dir',
+        'funcx_endpoint_compute',
+    ]
+    funcx_functions = [
+        primalisys_batch
+    ]
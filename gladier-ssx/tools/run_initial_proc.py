@@ -1,12 +1,8 @@
 from gladier import GladierBaseTool, generate_flow_definition
-from typing import Dict, Any, List
-import os
-import subprocess
-from subprocess import PIPE
-import glob
+from typing import Dict, Any
 
 
-def run_initial_proc(**data: Dict[str, Any]) -> tuple[str, str, str]:
+def run_initial_proc(**data: Dict[str, Any]) -> Dict[str, Any]:
     """Process first N master files as a group using a single xia2.ssx command.
     
     This tool processes the first N master.h5 files as a group using xia2.ssx.
@@ -17,61 +13,100 @@ def run_initial_proc(**data: Dict[str, Any]) -> tuple[str, str, str]:
             - raster_dir: Path to the raster directory containing master.h5 files
             - output_dir: Path where the initial refinement results will be stored (default: 'initial_refinement')
             - n_files: Number of master files to process (default: 2)
+            - selection: How master files are chosen: 'first', 'largest' or 'spread' (default: 'first').
+              'largest' and 'spread' weigh each raster by the size of its data files, a proxy for hits
+            - adaptive: Keep adding files until the refined geometry stops changing (default: False)
+            - adaptive_step: Files added per adaptive round (default: n_files)
+            - max_files: Upper bound on the files used by adaptive refinement (default: 4 * n_files)
+            - convergence_tolerance: Largest panel origin shift in mm counted as converged (default: 0.05)
             - phil_file: Path to the phil file to use for processing (default: 'run.phil')
             - dials_path: Path to dials installation (default: '/dials')
+            - catalog: Path to the run catalog index (default: '.ssx_catalog.sqlite' in output_dir)
+            - run_num: Beamline run whose beamline_run<run_num>.json describes the geometry (optional)
+            - master_file: Optional master.h5 whose metadata completes the geometry, as in create_phil
+            - beamx, beamy: Optional beam centre overrides given to create_phil
+            - reuse_geometry: Skip processing when the geometry registry holds a matching refined geometry (default: True)
+            - geometry_registry: Path to the geometry registry (default: ~/.cache/gladier-ssx/geometry_registry.json)
+            - geometry_tolerance: Optional per-key tolerances for det_distance, energy, beamx and beamy
             
     Returns:
-        tuple: (command, stdout, stderr) from the xia2.ssx execution
+        dict: Command, return code, log paths and output tail of the xia2.ssx execution,
+        or 'skipped': True and the matching 'reference_geometry' when a registered geometry is reused.
+        Adaptive runs return the last round's record with 'converged' and every round under 'rounds'
+
+    Note:
+        Geometries are looked up and registered only when run_num is given, keyed on the
+        detector distance, energy and beam centre create_phil puts in the phil: those of
+        beamline_run<run_num>.json and xy.json, completed by beamx, beamy and the metadata of
+        master_file or the first master file. A successful run registers a copy of
+        output_dir/geometry_refinement/refined.expt, which is what 'reference_geometry' names.
+        Adaptive rounds run in output_dir/adaptive_<n>/ and output_dir/geometry_refinement
+        becomes a symlink to the last round's geometry_refinement.
     """
+    import os
+
+    from gladier_ssx.catalog import open_catalog
+    from gladier_ssx.geometry_registry import DEFAULT_REGISTRY, find_geometry, register_geometry
+    from gladier_ssx.image_selection import master_weights, select_master_files
+    from gladier_ssx.refinement import adaptive_refine, refine_initial, run_geometry
+    from gladier_ssx.tracing import Span
+
     data_dir = data['data_dir']
     raster_dir = data.get('raster_dir', 'raster')
     output_dir = data.get('output_dir', 'initial_refinement')
     n_files = data.get('n_files', 2)
     phil_file = data.get('phil_file', 'run.phil')
+    strategy = data.get('selection', 'first')
+    span = Span('run_initial_proc', n_files=n_files, selection=strategy)
     
     os.chdir(data_dir)
-    # Create output directory
+
+    # Create output directory, which holds the catalog rather than data_dir
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
+    catalog = open_catalog(data.get('catalog'), root=output_dir)
+
+    # Reuse a refined geometry from an earlier run with the same detector setup
+    registry = data.get('geometry_registry', DEFAULT_REGISTRY)
+    geometry = None
+    if data.get('run_num') is not None:
+        geometry = run_geometry(data, '.', output_dir)
+    if geometry and data.get('reuse_geometry', True):
+        reference_geometry = find_geometry(geometry, registry, data.get('geometry_tolerance'))
+        if reference_geometry:
+            return {'skipped': True, 'reference_geometry': reference_geometry, 'geometry': geometry,
+                    'span': span.finish(skipped=True)}
     
     # Change to output directory
     os.chdir(output_dir)
     
     # Find master.h5 files in raster directory
-    master_files = glob.glob(f"../{raster_dir}/*_master.h5")
-    master_files.sort()
+    with catalog:
+        master_files = catalog.glob(f"../{raster_dir}", "*_master.h5")
+        weights = master_weights(master_files, catalog) if strategy != 'first' else None
     
     if not master_files:
         raise RuntimeError(f"No master.h5 files found in {raster_dir}/")
     
-    # Take first N files
-    selected_files = master_files[:n_files]
-    
-    # Build image arguments
-    image_args = []
-    for master_file in selected_files:
-        image_args.append(f"image={master_file}")
-    
-    # Construct the full command
-    cmd_parts = [
-        "xia2.ssx"
-    ] + image_args + [
-        f"--phil ../{phil_file}"
-    ]
-    
-    cmd = " ".join(cmd_parts)
-    
-    # Execute the command
-    result = subprocess.run(
-        cmd,
-        stdout=PIPE,
-        stderr=PIPE,
-        shell=True,
-        executable='/bin/bash',
-        text=True
-    )
-    
-    return cmd, result.stdout, result.stderr
+    if data.get('adaptive', False):
+        result = adaptive_refine(
+            master_files, n_files, strategy, weights, f"../{phil_file}",
+            step=data.get('adaptive_step', n_files),
+            max_files=data.get('max_files', 4 * n_files),
+            tolerance=data.get('convergence_tolerance', 0.05),
+        )
+    else:
+        # Do not write into the output of an earlier adaptive round
+        if os.path.islink('geometry_refinement'):
+            os.remove('geometry_refinement')
+        # Execute the command, streaming its output to log files
+        result = refine_initial(select_master_files(master_files, n_files, strategy, weights), f"../{phil_file}")
+
+    refined_expt = os.path.join('geometry_refinement', 'refined.expt')
+    if geometry and result['returncode'] == 0 and os.path.isfile(refined_expt):
+        result['reference_geometry'] = register_geometry(geometry, refined_expt, registry)
+    result['span'] = span.finish()
+    return result
 
 
 @generate_flow_definition(modifiers={
@@ -82,6 +117,8 @@ def run_initial_proc(**data: Dict[str, Any]) -> tuple[str, str, str]:
 })
 class RunInitialProc(GladierBaseTool):
     """Gladier tool for initial processing of master files using xia2.ssx."""
+    consumes = ['phil']
+    produces = ['initial_geometry']
     flow_input = {}
     required_input = [
         'compute_endpoint',
@@ -1,17 +1,14 @@
 from gladier import GladierBaseTool, generate_flow_definition
-from typing import Dict, Any, List
-import os
-import subprocess
-from subprocess import PIPE
-import glob
+from typing import Dict, Any
 
 
-def run_refined_proc(**data: Dict[str, Any]) -> tuple[str, str, str]:
+def run_refined_proc(**data: Dict[str, Any]) -> Dict[str, Any]:
     """Re-run xia2.ssx on all master.h5 files using refined unit cell.
-    
+
     This tool processes each master.h5 file individually using xia2.ssx with
     a refined geometry file. Results are stored in refined/ref_*/ directories.
-    
+    Up to max_jobs xia2.ssx processes are run side by side.
+
     Args:
         data: Dictionary containing the following keys:
             - raster_dir: Path to the raster directory containing master.h5 files
@@ -19,76 +16,145 @@ def run_refined_proc(**data: Dict[str, Any]) -> tuple[str, str, str]:
             - refined_geometry: Path to the refined geometry file (default: '../../initial_refinement/geometry_refinement/refined.expt')
             - phil_file: Path to the phil file to use for processing (default: 'run.phil')
             - dials_path: Path to dials installation (default: '/dials')
-            
+            - max_jobs: Maximum number of concurrent xia2.ssx jobs (default: 1)
+            - nproc_per_job: Optional number of cores given to each xia2.ssx job
+              (default: unset, or the node's cores split max_jobs ways when pin_cores is set)
+            - pin_cores: Pin each job to its own nproc_per_job cores of the node (default: False)
+            - order: 'longest_first' to start the files with the most images first, or 'name' (default: 'longest_first')
+            - force: Reprocess every master file, ignoring the manifest (default: False)
+            - checksum: Key master files by sha256 as well as size/mtime (default: False)
+            - catalog: Path to the run catalog index (default: '.ssx_catalog.sqlite')
+            - data_dir: Directory holding beamline_run<run_num>.json, xy.json and the master file
+              whose metadata completes the registry key (default: '.')
+            - master_file: Optional master.h5 whose metadata completes the registry key, as in create_phil
+            - beamx, beamy: Optional beam centre overrides given to create_phil
+            - run_num: Beamline run used to look up a registered reference geometry (optional)
+            - reuse_geometry: Use a matching geometry from the geometry registry (default: True)
+            - geometry_registry: Path to the geometry registry (default: ~/.cache/gladier-ssx/geometry_registry.json)
+            - geometry_tolerance: Optional per-key tolerances for det_distance, energy, beamx and beamy
+
     Returns:
-        tuple: (command, stdout, stderr) from the xia2.ssx execution
+        dict: Per-file results under 'jobs' plus 'succeeded', 'failed' and 'skipped' counts
+        and the summed resource usage of the jobs run under 'metrics'. A job that raised
+        instead of running xia2.ssx is recorded with 'success': False, a non-zero
+        'returncode' and the exception under 'error'
+
+    Note:
+        A manifest.json in refined_dir records, per master file, its size/mtime
+        (and checksum), the size/mtime of its data files, the phil file hash and the
+        reference geometry hash of the last run. Files whose entry still matches and
+        whose batch_1 output exists are skipped. Entries are merged into the manifest
+        under a lock, so flows sharing refined_dir keep each other's entries.
+
+        When run_num is given but refined_geometry is not, the geometry registry is
+        searched for a refined geometry matching the run's detector distance, energy
+        and beam centre, taken as create_phil takes them. A match is used as the
+        reference geometry, so the initial refinement stage can be skipped.
     """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    from gladier_ssx.catalog import open_catalog
+    from gladier_ssx.metrics import collect_metrics, summarize_metrics
+    from gladier_ssx.placement import job_nproc
+    from gladier_ssx.refinement import (MANIFEST_NAME, ORDERS, file_digest, load_manifest, longest_first,
+                                        manifest_current, master_outdir, master_signature, refine_master_file,
+                                        refinement_result, registered_geometry, update_manifest)
+    from gladier_ssx.tracing import Span
+
     raster_dir = data.get('raster_dir', 'raster')
     refined_dir = data.get('refined_dir', 'refined')
     refined_geometry = data.get('refined_geometry', '../../initial_refinement/geometry_refinement/refined.expt')
     phil_file = data.get('phil_file', 'run.phil')
-    
-    # Find all master.h5 files
-    master_files = glob.glob(f"{raster_dir}/*_master.h5")
-    master_files.sort()
-    
+    max_jobs = max(1, int(data.get('max_jobs', 1)))
+    nproc_per_job = data.get('nproc_per_job', None)
+    pin_cores = data.get('pin_cores', False)
+    if pin_cores and not nproc_per_job:
+        nproc_per_job = job_nproc(max_jobs)
+    order = data.get('order', 'longest_first')
+    if order not in ORDERS:
+        raise RuntimeError(f"Unknown job order {order!r}, expected one of {ORDERS}")
+    force = data.get('force', False)
+    checksum = data.get('checksum', False)
+    span = Span('run_refined_proc', max_jobs=max_jobs, nproc_per_job=nproc_per_job)
+
+    # Only a geometry left to the default is looked up in the registry
+    if 'refined_geometry' not in data:
+        refined_geometry = registered_geometry(data) or refined_geometry
+
+    os.makedirs(refined_dir, exist_ok=True)
+    manifest_path = os.path.join(refined_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    # The phil and geometry paths are given relative to refined/ref_<run>/
+    ref_base = os.path.join(refined_dir, 'ref_')
+    phil_hash = file_digest(os.path.normpath(os.path.join(ref_base, '../..', phil_file)))
+    geometry_hash = file_digest(os.path.normpath(os.path.join(ref_base, '../..', refined_geometry)))
+
+    # Find all master.h5 files and describe each with its data files
+    signatures = {}
+    with open_catalog(data.get('catalog')) as catalog:
+        master_files = catalog.glob(raster_dir, "*_master.h5")
+        for master_file in master_files:
+            signature = master_signature(master_file, checksum, catalog)
+            signature['phil'] = phil_hash
+            signature['geometry'] = geometry_hash
+            signatures[master_file] = signature
+
     if not master_files:
         raise RuntimeError(f"No master.h5 files found in {raster_dir}/")
-    
-    # Process each file individually
-    all_commands = []
-    all_stdout = []
-    all_stderr = []
-    
+
+    # Split master files into unchanged (skipped) and new or invalidated ones
+    skipped = []
+    pending = []
     for master_file in master_files:
-        # Extract run number from filename
-        filename = os.path.basename(master_file)
-        run_name = filename.replace('_master.h5', '')
-        
-        # Create output directory for this run
-        outdir = f"{refined_dir}/ref_{run_name}"
-        if not os.path.exists(outdir):
-            os.makedirs(outdir)
-        
-        # Change to output directory
-        original_dir = os.getcwd()
-        os.chdir(outdir)
-        
-        try:
-            # Construct the command
-            cmd_parts = [
-                "xia2.ssx",
-                f"image=../../{master_file}",
-                f"--phil ../../{phil_file}",
-                f"reference_geometry=../../{refined_geometry}"
-            ]
-            
-            cmd = " ".join(cmd_parts)
-            
-            # Execute the command
-            result = subprocess.run(
-                cmd,
-                stdout=PIPE,
-                stderr=PIPE,
-                shell=True,
-                executable='/bin/bash',
-                text=True
-            )
-            
-            all_commands.append(cmd)
-            all_stdout.append(result.stdout)
-            all_stderr.append(result.stderr)
-            
-        finally:
-            # Return to original directory
-            os.chdir(original_dir)
-    
-    # Combine all outputs
-    combined_cmd = "\n".join(all_commands)
-    combined_stdout = "\n".join(all_stdout)
-    combined_stderr = "\n".join(all_stderr)
-    
-    return combined_cmd, combined_stdout, combined_stderr
+        signature = signatures[master_file]
+
+        if not force and manifest_current(manifest, master_file, signature, refined_dir):
+            skipped.append({
+                'master_file': master_file,
+                'outdir': master_outdir(master_file, refined_dir),
+                'cmd': manifest[master_file].get('cmd'),
+                'returncode': 0,
+                'success': True,
+                'skipped': True,
+            })
+        else:
+            pending.append(master_file)
+
+    if order == 'longest_first' and len(pending) > max_jobs:
+        with open_catalog(data.get('catalog')) as catalog:
+            pending = longest_first(pending, catalog)
+
+    # Process each remaining file individually, at most max_jobs at a time. The jobs
+    # finished so far are recorded in the manifest even if collecting the rest is interrupted
+    jobs = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            futures = {master_file: executor.submit(
+                refine_master_file, master_file, refined_dir, phil_file, refined_geometry, nproc_per_job, pin_cores
+            ) for master_file in pending}
+            for master_file, future in futures.items():
+                job = refinement_result(future, master_file, refined_dir)
+                job['skipped'] = False
+                jobs.append(job)
+    finally:
+        update_manifest(manifest_path, {
+            job['master_file']: dict(signatures[job['master_file']], returncode=job['returncode'], cmd=job['cmd'])
+            for job in jobs
+        })
+
+    succeeded = sum(1 for job in jobs if job['success'])
+    jobs = sorted(skipped + jobs, key=lambda job: job['master_file'])
+
+    return {
+        'jobs': jobs,
+        'succeeded': succeeded,
+        'failed': len(pending) - succeeded,
+        'skipped': len(skipped),
+        'metrics': summarize_metrics(collect_metrics(jobs)),
+        'span': span.finish(),
+    }
 
 
 @generate_flow_definition(modifiers={
@@ -99,9 +165,11 @@ def run_refined_proc(**data: Dict[str, Any]) -> tuple[str, str, str]:
 })
 class RunRefinedProc(GladierBaseTool):
     """Gladier tool for refined processing of master files using xia2.ssx."""
-    
+
+    consumes = ['phil', 'initial_geometry']
+    produces = ['refined_batches']
     flow_input = {}
     required_input = [
         'compute_endpoint',
     ]
-    funcx_functions = [run_refined_proc] 
\ No newline at end of file
+    funcx_functions = [run_refined_proc]
@@ -0,0 +1,241 @@
+from gladier import GladierBaseTool, generate_flow_definition
+from typing import Dict, Any
+
+
+def stream_refined_proc(**data: Dict[str, Any]) -> Dict[str, Any]:
+    """Refine master files as they are collected and merge incrementally.
+
+    Streaming counterpart of run_refined_proc followed by merge_all and run_prime.
+    Once the reference geometry exists, raster_dir is polled and every master file
+    whose files have settled goes to xia2.ssx straight away. After every merge_every
+    newly refined batches, merge_all and run_prime are re-run side by side on all
+    batches refined so far, so merged statistics are available while the chip is
+    still being collected. Batches refined while a merge runs are picked up by the
+    next one, started as soon as it finishes.
+
+    Args:
+        data: Dictionary containing the keys of run_refined_proc (raster_dir, refined_dir,
+            refined_geometry, phil_file, max_jobs, nproc_per_job, pin_cores, checksum, catalog,
+            data_dir, master_file, beamx, beamy, run_num, reuse_geometry, geometry_registry,
+            geometry_tolerance), those of merge_all and run_prime except output_dir, and:
+            - merge_every: New batches between incremental merges (default: 10)
+            - merge_output_dir: output_dir of merge_all (default: 'final_merge')
+            - prime_output_dir: output_dir of run_prime (default: 'prime_results')
+            - merge_prime: Re-run PRIME alongside each merge (default: True)
+            - poll_interval: Seconds between scans of raster_dir (default: 10)
+            - settle_seconds: Seconds a master file and its data files must stay unmodified
+              before they count as complete (default: 30)
+            - settle_timeout: Seconds after which a master file that has not settled is given up
+              on and reported under 'unsettled' (default: 3600)
+            - end_marker: Optional path whose appearance ends collection
+            - idle_timeout: Seconds without a new master file after which collection is
+              taken to have ended (default: 600)
+            - geometry_timeout: Seconds to wait for the reference geometry (default: 3600)
+
+    Returns:
+        dict: Per-file results under 'jobs', 'succeeded', 'failed' and 'skipped' counts, master
+        files given up on under 'unsettled', every incremental merge under 'merges' with the
+        batch count and the seconds since the start at which it finished, 'first_merge_seconds',
+        the summed resource usage under 'metrics' and the span of this call. A merge_all or
+        run_prime that raised is logged and recorded as {'error': ...}, and a refinement job
+        that raised as a failed job with its 'error', as in run_refined_proc; streaming carries on.
+
+    Note:
+        Master files are recorded in refined_dir/manifest.json exactly as run_refined_proc
+        does, so files already refined are skipped and a later run_refined_proc skips
+        the files refined here. A final merge covers any batches left after the last
+        scheduled one.
+    """
+    import logging
+    import os
+    import time
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+    from gladier_ssx.catalog import open_catalog
+    from gladier_ssx.local_executor import run_stage
+    from gladier_ssx.merging import merge_all, run_prime
+    from gladier_ssx.metrics import collect_metrics, summarize_metrics
+    from gladier_ssx.placement import job_nproc
+    from gladier_ssx.refinement import (MANIFEST_NAME, file_digest, load_manifest, manifest_current,
+                                        master_outdir, master_signature, refine_master_file, refinement_result,
+                                        registered_geometry, settled, update_manifest, wait_for_geometry)
+    from gladier_ssx.tracing import Span
+
+    logger = logging.getLogger('gladier_ssx.stream_refined_proc')
+
+    raster_dir = data.get('raster_dir', 'raster')
+    refined_dir = data.get('refined_dir', 'refined')
+    refined_geometry = data.get('refined_geometry', '../../initial_refinement/geometry_refinement/refined.expt')
+    phil_file = data.get('phil_file', 'run.phil')
+    max_jobs = max(1, int(data.get('max_jobs', 1)))
+    nproc_per_job = data.get('nproc_per_job', None)
+    pin_cores = data.get('pin_cores', False)
+    if pin_cores and not nproc_per_job:
+        nproc_per_job = job_nproc(max_jobs)
+    checksum = data.get('checksum', False)
+    merge_every = max(1, int(data.get('merge_every', 10)))
+    with_prime = data.get('merge_prime', True)
+    poll_interval = data.get('poll_interval', 10)
+    settle_seconds = data.get('settle_seconds', 30)
+    settle_timeout = data.get('settle_timeout', 3600)
+    end_marker = data.get('end_marker')
+    idle_timeout = data.get('idle_timeout', 600)
+    span = Span('stream_refined_proc', max_jobs=max_jobs, merge_every=merge_every)
+    t0 = time.monotonic()
+
+    # Only a geometry left to the default is looked up in the registry
+    if 'refined_geometry' not in data:
+        refined_geometry = registered_geometry(data) or refined_geometry
+    # The phil and geometry paths are given relative to refined/ref_<run>/
+    ref_base = os.path.join(refined_dir, 'ref_')
+    geometry_path = os.path.normpath(os.path.join(ref_base, '../..', refined_geometry))
+    wait_for_geometry(geometry_path, data.get('geometry_timeout', 3600), poll_interval)
+    phil_hash = file_digest(os.path.normpath(os.path.join(ref_base, '../..', phil_file)))
+    geometry_hash = file_digest(geometry_path)
+
+    os.makedirs(refined_dir, exist_ok=True)
+    manifest_path = os.path.join(refined_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    cwd = os.getcwd()
+    merge_input = dict(data, output_dir=data.get('merge_output_dir', 'final_merge'))
+    prime_input = dict(data, output_dir=data.get('prime_output_dir', 'prime_results'))
+
+    seen = set()
+    unsettled_since = {}
+    unsettled = []
+    batches = []
+    jobs = []
+    skipped = []
+    running = {}
+    signatures = {}
+    merges = []
+    merging = {}
+    merged_count = 0
+    last_arrival = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as refine_pool, \
+            ProcessPoolExecutor(max_workers=2) as merge_pool:
+
+        def start_merge():
+            """Merge and run PRIME on the batches refined so far, in processes of their own beside the refinement threads."""
+            nonlocal merged_count
+            stage_batches = sorted(batches)
+            merged_count = len(stage_batches)
+            merging[merge_pool.submit(run_stage, [merge_all], cwd,
+                                      dict(merge_input, batch_dirs=stage_batches))] = 'merge_all'
+            if with_prime:
+                merging[merge_pool.submit(run_stage, [run_prime], cwd,
+                                          dict(prime_input, batch_dirs=stage_batches))] = 'run_prime'
+            merges.append({'n_batches': merged_count})
+
+        def collect_merge(future):
+            """Store a finished merge_all or run_prime result, timing the merge once both are done."""
+            stage = merging.pop(future)
+            try:
+                merges[-1][stage] = future.result()
+            except Exception as e:
+                # A failed merge is superseded by the next one, so streaming carries on
+                logger.exception("%s on %d batches failed", stage, merges[-1]['n_batches'])
+                merges[-1][stage] = {'error': f"{type(e).__name__}: {e}"}
+            if not merging:
+                merges[-1]['seconds'] = time.monotonic() - t0
+
+        while True:
+            with open_catalog(data.get('catalog')) as catalog:
+                master_files = catalog.glob(raster_dir, "*_master.h5")
+            now = time.time()
+            for master_file in master_files:
+                if master_file in seen:
+                    continue
+                if not settled(master_file, settle_seconds, now):
+                    since = unsettled_since.setdefault(master_file, time.monotonic())
+                    if time.monotonic() - since >= settle_timeout:
+                        logger.warning("Giving up on %s, still being modified after %.0f s",
+                                       master_file, settle_timeout)
+                        seen.add(master_file)
+                        unsettled.append(master_file)
+                    continue
+                seen.add(master_file)
+                last_arrival = time.monotonic()
+                signature = master_signature(master_file, checksum)
+                signature['phil'] = phil_hash
+                signature['geometry'] = geometry_hash
+                if manifest_current(manifest, master_file, signature, refined_dir):
+                    outdir = master_outdir(master_file, refined_dir)
+                    skipped.append({'master_file': master_file, 'outdir': outdir,
+                                    'cmd': manifest[master_file].get('cmd'), 'returncode': 0,
+                                    'success': True, 'skipped': True})
+                    batches.append(os.path.join(outdir, 'batch_1'))
+                    continue
+                signatures[master_file] = signature
+                running[refine_pool.submit(refine_master_file, master_file, refined_dir, phil_file,
+                                           refined_geometry, nproc_per_job, pin_cores)] = master_file
+
+            # Requests made while a merge runs coalesce into one covering every batch so far
+            if not merging and len(batches) - merged_count >= merge_every:
+                start_merge()
+
+            collection_over = ((end_marker and os.path.exists(end_marker))
+                               or time.monotonic() - last_arrival >= idle_timeout)
+            if collection_over and len(seen) == len(master_files) and not running:
+                break
+
+            if not running and not merging:
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(list(running) + list(merging), timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in merging:
+                    collect_merge(future)
+                    continue
+                master_file = running.pop(future)
+                job = refinement_result(future, master_file, refined_dir)
+                job['skipped'] = False
+                jobs.append(job)
+                manifest = update_manifest(manifest_path, {master_file: dict(
+                    signatures[master_file], returncode=job['returncode'], cmd=job['cmd'])})
+                if job['success']:
+                    batches.append(os.path.join(job['outdir'], 'batch_1'))
+
+
+        # Collection has ended: wait for the merge in flight, then cover what it missed
+        for future in wait(list(merging)).done:
+            collect_merge(future)
+        if len(batches) > merged_count:
+            start_merge()
+            for future in wait(list(merging)).done:
+                collect_merge(future)
+
+    succeeded = sum(1 for job in jobs if job['success'])
+    failed = len(jobs) - succeeded
+    jobs = sorted(skipped + jobs, key=lambda job: job['master_file'])
+    return {
+        'jobs': jobs,
+        'succeeded': succeeded,
+        'failed': failed,
+        'skipped': len(skipped),
+        'unsettled': unsettled,
+        'merges': merges,
+        'first_merge_seconds': merges[0].get('seconds') if merges else None,
+        'metrics': summarize_metrics(collect_metrics({'jobs': jobs, 'merges': merges})),
+        'span': span.finish(n_batches=len(batches), n_merges=len(merges)),
+    }
+
+
+@generate_flow_definition(modifiers={
+    'stream_refined_proc': {
+        'WaitTime': 43200,
+        'ExceptionOnActionFailure': True
+    }
+})
+class StreamRefinedProc(GladierBaseTool):
+    """Gladier tool refining master files during collection and merging them incrementally."""
+
+    consumes = ['phil', 'initial_geometry']
+    produces = ['refined_batches', 'merged', 'prime_log']
+    flow_input = {}
+    required_input = [
+        'compute_endpoint',
+    ]
+    funcx_functions = [stream_refined_proc]
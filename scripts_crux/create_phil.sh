@@ -28,9 +28,16 @@ ORIGIN="0.0, 0.0, $DET_DISTANCE"  # You can update beam center later
 # geometry.detector.panel.slow_axis = $SLOW_AXIS
 # geometry.detector.panel.origin = $ORIGIN
 
+# nproc is only written when NPROC is set; otherwise xia2.ssx uses the cores of the node it runs on,
+# rather than those of the host that happened to create run.phil
+NPROC_LINE=""
+if [ -n "$NPROC" ]; then
+    NPROC_LINE="nproc = $NPROC"
+fi
+
 # Write run.phil
 cat <<EOF > run.phil
-nproc = 64
+$NPROC_LINE
 
 unit_cell = $UNIT_CELL
 space_group = $SPACE_GROUP